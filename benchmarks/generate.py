@@ -0,0 +1,130 @@
+"""
+seeded synthetic library data for benchmarks.
+
+    python benchmarks/generate.py OUT_DIR --books 100000 [--seed 42]
+
+writes books.csv, copies.csv, users.csv and checkouts.csv in the app's formats.
+book popularity is zipf-like, so a few titles get most of the loans, and a slice
+of the loans is still open with due dates around today (so reminders have work).
+"""
+import os
+import datetime
+
+import numpy as np
+import pandas as pd
+
+SYLLABLES = ["ka", "lo", "mi", "ren", "to", "sha", "vel", "dor", "an", "ith", "mor", "que",
+             "bel", "sar", "in", "gar", "eth", "ul", "pra", "zen", "o", "tri", "les", "nar"]
+FIRST_NAMES = ["anna", "ben", "chloe", "david", "emma", "felix", "grace", "hugo", "iris", "jack",
+               "kate", "liam", "maya", "noah", "olga", "paul", "rosa", "sam", "tara", "yusuf"]
+
+LOAN_DAYS = 14
+
+
+def _words(rng, n):
+    """n pseudo-words, 2-4 syllables each"""
+    lengths = rng.integers(2, 5, size=n)
+    picks = rng.integers(0, len(SYLLABLES), size=lengths.sum())
+    out, i = [], 0
+    for length in lengths:
+        out.append("".join(SYLLABLES[j] for j in picks[i:i + length]))
+        i += length
+    return out
+
+
+def generate(out_dir, books=10_000, users=None, checkouts=None, open_fraction=0.1, seed=42, today=None):
+    """write a synthetic dataset into out_dir, returns row counts per table"""
+    rng = np.random.default_rng(seed)
+    users = users or max(10, books // 10)
+    checkouts = checkouts or books * 3
+    today = today or datetime.date.today()
+    os.makedirs(out_dir, exist_ok=True)
+
+    # books: titles of 1-4 words from a vocabulary that grows with the catalog
+    vocab = np.array(_words(rng, max(500, books // 20)))
+    title_len = rng.integers(1, 5, size=books)
+    title_words = vocab[rng.integers(0, len(vocab), size=title_len.sum())]
+    bounds = np.concatenate([[0], np.cumsum(title_len)])
+    titles = [" ".join(title_words[bounds[i]:bounds[i + 1]]).title() for i in range(books)]
+    surnames = vocab[rng.integers(0, len(vocab), size=books)]
+    firsts = np.array(FIRST_NAMES)[rng.integers(0, len(FIRST_NAMES), size=books)]
+    authors = [f"{f.title()} {s.title()}" for f, s in zip(firsts, surnames)]
+    barcodes = np.array([f"978{i:010d}" for i in range(books)])
+
+    # copies: 1-5 per book, popular books get more
+    rank_weight = 1.0 / np.arange(1, books + 1) ** 1.1
+    popularity = rng.permutation(rank_weight / rank_weight.sum())
+    n_copies = np.clip(1 + (popularity / popularity.max() * 4).round().astype(int) + rng.integers(0, 2, size=books), 1, 5)
+    copy_book = np.repeat(np.arange(books), n_copies)
+    copy_ids = np.array([f"c{i:09d}" for i in range(len(copy_book))])
+    copies_df = pd.DataFrame({'copy_id': copy_ids, 'barcode': barcodes[copy_book], 'status': 'available'})
+
+    # open loans: distinct copies, weighted by book popularity (weighted sampling via random keys)
+    n_open = int(min(checkouts * open_fraction, len(copy_ids) * 0.5))
+    keys = rng.random(len(copy_ids)) ** (1.0 / (popularity[copy_book] * len(copy_ids)))
+    open_copies = np.argpartition(-keys, n_open)[:n_open] if n_open else np.array([], dtype=int)
+    open_start = [today - datetime.timedelta(days=int(d)) for d in rng.integers(0, 21, size=n_open)]
+
+    # returned loans: any copy, popularity-skewed, over the last two years
+    n_hist = checkouts - n_open
+    hist_books = rng.choice(books, size=n_hist, p=popularity)
+    first_copy = np.concatenate([[0], np.cumsum(n_copies)[:-1]])
+    hist_copies = first_copy[hist_books] + (rng.random(n_hist) * n_copies[hist_books]).astype(int)
+    hist_start = rng.integers(21, 730, size=n_hist)
+    hist_len = rng.integers(1, 21, size=n_hist)
+
+    base = np.datetime64(today, 'D')
+    co_dates = np.concatenate([base - hist_start, np.array(open_start, dtype='datetime64[D]')])
+    returned = np.concatenate([base - hist_start + hist_len, np.full(n_open, np.datetime64('NaT'), dtype='datetime64[D]')])
+    loan_copies = np.concatenate([hist_copies, open_copies]).astype(int)
+    order = np.argsort(co_dates, kind='stable')
+
+    user_ids = np.array([f"u{i:07d}" for i in range(users)])
+    # heavy readers borrow more, too
+    user_weight = 1.0 / np.arange(1, users + 1) ** 0.8
+    loan_users = rng.choice(users, size=checkouts, p=user_weight / user_weight.sum())
+
+    checkouts_df = pd.DataFrame({
+        'checkout_id': [f"k{i:09d}" for i in range(checkouts)],
+        'user_id': user_ids[loan_users],
+        'copy_id': copy_ids[loan_copies[order]],
+        'checkout_date': co_dates[order].astype(str),
+        'due_date': (co_dates[order] + LOAN_DAYS).astype(str),
+        'return_date': pd.Series(returned[order].astype(str)).replace('NaT', None),
+    })
+
+    on_loan = np.bincount(copy_book[open_copies], minlength=books) if n_open else np.zeros(books, dtype=int)
+    copy_lists = np.split(copy_ids, np.cumsum(n_copies)[:-1])
+    books_df = pd.DataFrame({
+        'barcode': barcodes,
+        'title': titles,
+        'author': authors,
+        'total_copies': n_copies,
+        'available_copies': n_copies - on_loan,
+        'copy_ids': [",".join(c) for c in copy_lists],
+    })
+    names = np.array(FIRST_NAMES)[rng.integers(0, len(FIRST_NAMES), size=users)]
+    users_df = pd.DataFrame({
+        'user_id': user_ids,
+        'name': [n.title() for n in names],
+        'email': [f"{n}.{i}@example.org" for i, n in enumerate(names)],
+    })
+
+    books_df.to_csv(os.path.join(out_dir, "books.csv"), index=False)
+    copies_df.to_csv(os.path.join(out_dir, "copies.csv"), index=False)
+    users_df.to_csv(os.path.join(out_dir, "users.csv"), index=False)
+    checkouts_df.to_csv(os.path.join(out_dir, "checkouts.csv"), index=False)
+    return {'books': books, 'copies': len(copy_ids), 'users': users, 'checkouts': checkouts, 'open_loans': n_open}
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="write a seeded synthetic library dataset")
+    parser.add_argument("out_dir")
+    parser.add_argument("--books", type=int, default=10_000)
+    parser.add_argument("--users", type=int, default=None)
+    parser.add_argument("--checkouts", type=int, default=None, help="default: 3 per book")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+    print(generate(args.out_dir, books=args.books, users=args.users, checkouts=args.checkouts, seed=args.seed))
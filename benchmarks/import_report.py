@@ -0,0 +1,106 @@
+"""
+import-time report for the app's startup path (README.md explains the two lists).
+
+    python benchmarks/import_report.py [--write]
+"""
+import ast
+import os
+import re
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+REPORT_FILE = os.path.join(ROOT, "benchmarks", "import_times.txt")
+MAIN_FILE = os.path.join(ROOT, "main.py")
+
+# imported inside functions of the deferred modules (scanner decode, isbn lookups)
+DEFERRED_LIBRARIES = ["cv2", "pyzbar.pyzbar", "requests"]
+
+LINE_RE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)")
+TOP_N = 15
+
+
+def main_imports(path=MAIN_FILE):
+    """(modules main.py imports at the top, modules it imports inside functions), in file order"""
+    with open(path, encoding="utf-8") as f:
+        tree = ast.parse(f.read())
+    top_level = {id(node) for node in tree.body}
+    first, deferred = [], []
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            names = [alias.name for alias in node.names]
+        elif isinstance(node, ast.ImportFrom) and node.level == 0:
+            names = [node.module]
+        else:
+            continue
+        (first if id(node) in top_level else deferred).extend((node.lineno, n) for n in names)
+    ordered = lambda found: list(dict.fromkeys(name for _, name in sorted(found)))
+    return ordered(first), ordered(deferred)
+
+
+def _installed(modules):
+    """(importable modules, [(module, why not)])"""
+    present, missing = [], []
+    for mod in modules:
+        probe = subprocess.run([sys.executable, "-c", f"import {mod}"], cwd=ROOT, capture_output=True, text=True)
+        if probe.returncode == 0:
+            present.append(mod)
+        else:
+            lines = probe.stderr.strip().splitlines()
+            missing.append((mod, lines[-1] if lines else "import failed"))
+    return present, missing
+
+
+def measure(modules, preload=()):
+    """
+    (total us, top rows as (cumulative us, self us, module, depth), missing modules).
+    anything `preload` already imports is left out, so deferred modules are charged
+    only for what they add on top of first paint
+    """
+    present, missing = _installed(modules)
+    preload, _ = _installed(preload)
+    if not present:
+        return 0, [], missing
+
+    script = "; ".join(f"import {m}" for m in preload)
+    script += ("; " if script else "") + "print('--mark--', file=__import__('sys').stderr); "
+    script += "; ".join(f"import {m}" for m in present)
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", script], cwd=ROOT, capture_output=True, text=True)
+    rows = []
+    lines = proc.stderr.splitlines()
+    for line in lines[lines.index("--mark--") + 1:]:
+        m = LINE_RE.match(line)
+        if m:
+            self_us, cum_us, indent, name = int(m.group(1)), int(m.group(2)), len(m.group(3)), m.group(4)
+            rows.append((cum_us, self_us, name, indent))
+    # indent 1 = imported directly by the -c line, their cumulative times add up to the total
+    top = [(c, s, n) for c, s, n, indent in rows if indent == 1]
+    return sum(c for c, _, _ in top), sorted(rows, reverse=True)[:TOP_N], missing
+
+
+def render():
+    first_paint, deferred = main_imports()
+    deferred = list(dict.fromkeys(DEFERRED_LIBRARIES + deferred))
+    out = [f"python {sys.version.split()[0]}, `python -X importtime`, times in ms", ""]
+    sections = (
+        ("first paint (main.py top level)", first_paint, ()),
+        ("deferred (imported on first use, on top of first paint)", deferred, first_paint),
+    )
+    for title, modules, preload in sections:
+        total, rows, missing = measure(modules, preload)
+        out.append(f"== {title}: {total / 1000:.1f} ms")
+        out.append(f"   modules: {', '.join(modules)}")
+        for mod, why in missing:
+            out.append(f"   not importable here: {mod} ({why})")
+        for cum_us, self_us, name, _ in rows:
+            out.append(f"   {cum_us / 1000:9.1f} ms  {self_us / 1000:7.1f} ms self  {name}")
+        out.append("")
+    return "\n".join(out)
+
+
+if __name__ == "__main__":
+    report = render()
+    print(report)
+    if "--write" in sys.argv:
+        with open(REPORT_FILE, "w", encoding="utf-8") as f:
+            f.write(report)
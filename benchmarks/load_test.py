@@ -0,0 +1,228 @@
+"""
+load test for the http api (utils/http_api.py) with keep-alive clients.
+
+    python benchmarks/load_test.py                                   # own server on 10k generated books
+    python benchmarks/load_test.py --engine sqlite --books 100000 --connections 32 --duration 20
+    python benchmarks/load_test.py --url http://127.0.0.1:8080       # a server that's already running
+
+each connection sends one request at a time, like a kiosk or barcode gun: mostly
+book lookups, then searches, user lookups, copy lookups and checkout + checkin of a
+small stack. prints requests/second and per-route latency percentiles, and writes
+them to benchmarks/results/load_test.json. against --url the ids come from
+--data-dir (default: the generated dataset), so point it at the same data.
+"""
+import asyncio
+import json
+import os
+import random
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from urllib.parse import quote, urlsplit
+
+import pandas as pd
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+sys.path.insert(0, ROOT)
+
+from benchmarks.run_benchmarks import dataset  # noqa: E402
+
+RESULTS_FILE = os.path.join(HERE, "results", "load_test.json")
+
+# share of each kind of request; a checkout is followed by the checkin of what it got
+MIX = [('book', 50), ('search', 15), ('user', 15), ('copy', 5), ('checkout', 15)]
+
+
+class Client:
+    """one keep-alive connection, one request in flight at a time"""
+
+    def __init__(self, host, port):
+        self.host, self.port = host, port
+        self.reader = self.writer = None
+
+    async def request(self, method, path, body=None):
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        data = json.dumps(body).encode() if body is not None else b""
+        self.writer.write(
+            f"{method} {path} HTTP/1.1\r\nHost: {self.host}\r\nContent-Type: application/json\r\n"
+            f"Content-Length: {len(data)}\r\n\r\n".encode() + data)
+        await self.writer.drain()
+        head = await self.reader.readuntil(b"\r\n\r\n")
+        lines = head.decode("latin-1").split("\r\n")
+        status = int(lines[0].split(" ")[1])
+        headers = {k.strip().lower(): v.strip() for k, v in (l.split(":", 1) for l in lines[1:] if ":" in l)}
+        payload = await self.reader.readexactly(int(headers.get('content-length', 0)))
+        if headers.get('connection', "").lower() == "close":
+            self.close()
+        return status, json.loads(payload) if payload and 'json' in headers.get('content-type', "") else None
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+        self.reader = self.writer = None
+
+
+def load_ids(data_dir):
+    books = pd.read_csv(os.path.join(data_dir, "books.csv"), dtype=str)
+    users = pd.read_csv(os.path.join(data_dir, "users.csv"), dtype=str)
+    copies = pd.read_csv(os.path.join(data_dir, "copies.csv"), dtype=str)
+    words = [w.lower() for t in books['title'].dropna().sample(min(200, len(books)), random_state=1) for w in t.split()]
+    return {
+        'barcodes': books['barcode'].tolist(),
+        'users': users['user_id'].tolist(),
+        'copies': copies['copy_id'].sample(min(5000, len(copies)), random_state=1).tolist(),
+        'words': words,
+    }
+
+
+async def worker(client, ids, rng, deadline, samples, errors):
+    kinds, weights = zip(*MIX)
+    while time.perf_counter() < deadline:
+        kind = rng.choices(kinds, weights)[0]
+        calls = []
+        if kind == 'book':
+            calls.append(('book', "GET", f"/books/{rng.choice(ids['barcodes'])}", None))
+        elif kind == 'search':
+            calls.append(('search', "GET", f"/search?q={quote(rng.choice(ids['words']))}&limit=20", None))
+        elif kind == 'user':
+            calls.append(('user', "GET", f"/users/{rng.choice(ids['users'])}", None))
+        elif kind == 'copy':
+            calls.append(('copy', "GET", f"/copies/{rng.choice(ids['copies'])}", None))
+        else:
+            stack = rng.sample(ids['barcodes'], rng.randint(1, 3))
+            calls.append(('checkout', "POST", "/checkout", {'user_id': rng.choice(ids['users']), 'barcodes': stack}))
+        for route, method, path, body in calls:
+            t0 = time.perf_counter()
+            try:
+                status, payload = await client.request(method, path, body)
+            except (ConnectionError, asyncio.IncompleteReadError) as e:
+                errors.append(f"{route}: {e!r}")
+                client.close()
+                continue
+            samples.setdefault(route, []).append(time.perf_counter() - t0)
+            if status >= 500 or (status >= 400 and status != 404):
+                errors.append(f"{route}: http {status}")
+            if route == 'checkout' and status == 200:
+                copy_ids = [r['copy_id'] for r in payload['results'] if r['ok']]
+                if copy_ids:
+                    calls.append(('checkin', "POST", "/checkin", {'copy_ids': copy_ids}))
+
+
+def _percentiles(values):
+    values = sorted(values)
+    pick = lambda q: values[min(len(values) - 1, int(len(values) * q))]
+    return {
+        'n': len(values),
+        'p50_ms': round(1000 * statistics.median(values), 3),
+        'p95_ms': round(1000 * pick(0.95), 3),
+        'p99_ms': round(1000 * pick(0.99), 3),
+    }
+
+
+async def run_load(host, port, ids, connections, duration, seed):
+    samples, errors = {}, []
+    clients = [Client(host, port) for _ in range(connections)]
+    deadline = time.perf_counter() + duration
+    t0 = time.perf_counter()
+    await asyncio.gather(*(worker(c, ids, random.Random(seed + i), deadline, samples, errors)
+                           for i, c in enumerate(clients)))
+    elapsed = time.perf_counter() - t0
+    for c in clients:
+        c.close()
+    total = sum(len(v) for v in samples.values())
+    return {
+        'requests': total,
+        'seconds': round(elapsed, 2),
+        'requests_per_second': round(total / elapsed, 1),
+        'errors': len(errors),
+        'error_examples': errors[:5],
+        'routes': {route: _percentiles(values) for route, values in sorted(samples.items())},
+    }
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_server(engine, data_dir, port):
+    """the api in its own process, so clients and server don't share a GIL"""
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "utils.http_api", "--engine", engine, "--data-dir", data_dir, "--port", str(port)],
+        cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.time() + 300  # a cold start on a big dataset takes a while
+    while time.time() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError("api server exited during startup")
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=1):
+                return proc
+        except OSError:
+            time.sleep(0.2)
+    proc.kill()
+    raise RuntimeError("api server didn't come up")
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="load test the http api")
+    parser.add_argument("--url", default=None, help="test a running server instead of starting one")
+    parser.add_argument("--engine", default="csv")
+    parser.add_argument("--books", type=int, default=10000, help="size of the generated dataset")
+    parser.add_argument("--data-dir", default=None, help="where the ids come from (default: generated dataset)")
+    parser.add_argument("--connections", type=int, default=16)
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", default=RESULTS_FILE)
+    args = parser.parse_args()
+
+    source = args.data_dir or dataset(args.books, args.seed)
+    ids = load_ids(source)
+    work, proc = None, None
+    try:
+        if args.url:
+            url = urlsplit(args.url)
+            host, port = url.hostname, url.port or 80
+        else:
+            # a scratch copy: the test checks books in and out
+            work = tempfile.mkdtemp(prefix=f"libload-{args.engine}-")
+            for name in ("books.csv", "copies.csv", "users.csv", "checkouts.csv"):
+                shutil.copy(os.path.join(source, name), work)
+            host, port = "127.0.0.1", _free_port()
+            print(f"starting {args.engine} api on {len(ids['barcodes'])} books...", flush=True)
+            proc = start_server(args.engine, work, port)
+        print(f"{args.connections} connections for {args.duration:.0f}s against {host}:{port}", flush=True)
+        result = asyncio.run(run_load(host, port, ids, args.connections, args.duration, args.seed))
+    finally:
+        if proc is not None:
+            proc.terminate()
+            proc.wait(timeout=30)
+        if work:
+            shutil.rmtree(work, ignore_errors=True)
+
+    print(f"{result['requests']} requests in {result['seconds']}s = {result['requests_per_second']} req/s, "
+          f"{result['errors']} errors")
+    for route, s in result['routes'].items():
+        print(f"  {route:9s} n={s['n']:7d}  p50 {s['p50_ms']:8.3f} ms  p95 {s['p95_ms']:8.3f} ms  p99 {s['p99_ms']:8.3f} ms")
+    for example in result['error_examples']:
+        print(f"  error: {example}")
+
+    result['meta'] = {'engine': args.engine, 'books': len(ids['barcodes']), 'connections': args.connections,
+                      'url': args.url}
+    os.makedirs(os.path.dirname(args.output), exist_ok=True)
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(result, f, indent=2)
+    print(f"results written to {args.output}")
+    return 1 if result['errors'] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,218 @@
+"""
+database-layer benchmarks on seeded synthetic data, compared against benchmarks/baseline.json.
+
+    python benchmarks/run_benchmarks.py [--engines csv,sqlite,arrow] [--save-baseline]
+"""
+import datetime
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import uuid
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+
+from benchmarks.generate import generate  # noqa: E402
+from utils.cache import shared_cache  # noqa: E402
+from utils.database import get_database  # noqa: E402
+from utils.reminders import ReminderScheduler  # noqa: E402
+
+DATA_CACHE = os.path.join(HERE, ".data")
+RESULTS_FILE = os.path.join(HERE, "results", "latest.json")
+BASELINE_FILE = os.path.join(HERE, "baseline.json")
+
+# timings this small are mostly noise, don't call them regressions
+NOISE_FLOOR_MS = 0.05
+
+
+class NullNotifier:
+    """stands in for NotificationSystem so check_reminders measures scheduling, not smtp"""
+
+    def queue_emails(self, emails):
+        return list(range(len(emails)))
+
+
+def _summary(samples):
+    samples = sorted(samples)
+    return {
+        'n': len(samples),
+        'median_ms': round(1000 * statistics.median(samples), 4),
+        'p95_ms': round(1000 * samples[min(len(samples) - 1, int(len(samples) * 0.95))], 4),
+    }
+
+
+def _timed(fn, reps):
+    samples = []
+    for _ in range(reps):
+        t0 = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - t0)
+    return samples
+
+
+def dataset(books, seed):
+    """generated once per (scale, seed) and reused"""
+    path = os.path.join(DATA_CACHE, f"{books}-{seed}")
+    if not os.path.exists(os.path.join(path, "checkouts.csv")):
+        print(f"generating {books} books (seed {seed})...", flush=True)
+        generate(path, books=books, seed=seed)
+    return path
+
+
+def bench_engine(engine, source_dir, seed, quick=False):
+    work = tempfile.mkdtemp(prefix=f"libbench-{engine}-")
+    try:
+        for name in ("books.csv", "copies.csv", "users.csv", "checkouts.csv"):
+            shutil.copy(os.path.join(source_dir, name), work)
+        rng = random.Random(seed)
+        out = {}
+
+        t0 = time.perf_counter()
+        db = get_database(engine, work)
+        books = db.get_all_books()
+        out['cold_start'] = _summary([time.perf_counter() - t0])
+
+        if engine != "sqlite":
+            # the first compaction moves two years of closed loans into the monthly archive
+            out['archive'] = _summary(_timed(db.compact_journal, 1))
+
+        def reopen():
+            # a second process start on the same files: nothing cached, nothing to migrate
+            shared_cache.invalidate()
+            fresh = get_database(engine, work)
+            fresh.get_all_books()
+            fresh.get_checkouts_page(0, 50)
+        out['reopen'] = _summary(_timed(reopen, 3))
+
+        barcodes = books['barcode'].tolist()
+        users = db.get_all_users()['user_id'].tolist()
+        # loans go to the most-stocked titles first, like at a real desk
+        stocked = books.sort_values('available_copies', ascending=False)['barcode'].tolist()[:200]
+        reps = 5 if quick else 20
+
+        out['get_book'] = _summary(_timed(lambda: db.get_book(rng.choice(barcodes)), reps * 10))
+
+        new_books = iter(range(10 ** 6))
+        out['add_book'] = _summary(_timed(
+            lambda: db.add_book(f"979{next(new_books):010d}", "Bench Title", "Bench Author", 2), reps))
+
+        borrowed = []
+
+        def checkout():
+            result = db.checkout_books(rng.choice(users), [rng.choice(stocked)])[0]
+            if result['ok']:
+                borrowed.append(result['copy_id'])
+        out['checkout_book'] = _summary(_timed(checkout, reps * 10))
+        out['check_in_copy'] = _summary(_timed(lambda: db.check_in_copy(borrowed.pop()), min(len(borrowed), reps * 10)))
+
+        # a patron's stack of five at the desk, validated and written as one batch
+        stacks = []
+        out['checkout_books_5'] = _summary(_timed(
+            lambda: stacks.append(db.checkout_books(rng.choice(users), rng.sample(stocked, 5))), reps * 2))
+        returned = [r['copy_id'] for stack in stacks for r in stack if r['ok']]
+        out['check_in_copies_5'] = _summary(_timed(
+            lambda: db.check_in_copies([returned.pop() for _ in range(min(5, len(returned)))]), len(returned) // 5))
+
+        words = [w for t in rng.sample(books['title'].tolist(), 50) for w in t.split()]
+        queries = [rng.choice(words).lower() for _ in range(reps * 5)]
+        queries += [q[:3] for q in queries[:reps]]                             # prefixes
+        queries += [q[:2] + q[3:] for q in queries[:reps] if len(q) > 4]       # typos
+        search_iter = iter(queries)
+        out['search_books'] = _summary(_timed(lambda: db.search_books(next(search_iter)), len(queries)))
+
+        out['get_recent_events'] = _summary(_timed(lambda: db.get_recent_events(10), reps))
+
+        # one month of history from a year back, i.e. a single archive file
+        month = (datetime.date.today() - datetime.timedelta(days=365)).replace(day=1)
+        out['history_month'] = _summary(_timed(
+            lambda: db.get_checkouts(month, month + datetime.timedelta(days=30)), max(3, reps // 4)))
+
+        def reminders():
+            sent_file = os.path.join(work, f"reminders-{uuid.uuid4().hex}.csv")
+            ReminderScheduler(db, NullNotifier(), sent_file=sent_file).run_once()
+        out['check_reminders'] = _summary(_timed(reminders, max(3, reps // 4)))
+        return out
+    finally:
+        shutil.rmtree(work, ignore_errors=True)
+
+
+def compare(results, baseline, tolerance):
+    """list of (engine, scale, op, base ms, now ms, ratio) that got slower than tolerance"""
+    regressions = []
+    for engine, scales in results['results'].items():
+        for scale, ops in scales.items():
+            base_ops = baseline.get('results', {}).get(engine, {}).get(scale, {})
+            for op, now in ops.items():
+                base = base_ops.get(op)
+                if base is None:
+                    continue
+                b, n = base['median_ms'], now['median_ms']
+                ratio = n / b if b else float('inf')
+                if ratio > 1 + tolerance and n - b > NOISE_FLOOR_MS:
+                    regressions.append((engine, scale, op, b, n, ratio))
+    return regressions
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="benchmark the Database layer on synthetic data")
+    parser.add_argument("--scales", default="10000,100000", help="comma-separated book counts")
+    parser.add_argument("--engines", default="csv", help="comma-separated: csv, sqlite, arrow (needs pyarrow)")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--quick", action="store_true", help="fewer repetitions")
+    parser.add_argument("--baseline", default=BASELINE_FILE)
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed slowdown vs baseline (0.25 = 25%%)")
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--output", default=RESULTS_FILE)
+    args = parser.parse_args()
+
+    results = {
+        'meta': {
+            'date': datetime.datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'seed': args.seed,
+        },
+        'results': {},
+    }
+    for engine in args.engines.split(","):
+        for scale in args.scales.split(","):
+            source = dataset(int(scale), args.seed)
+            print(f"[{engine} @ {scale} books]", flush=True)
+            ops = bench_engine(engine, source, args.seed, quick=args.quick)
+            results['results'].setdefault(engine, {})[scale] = ops
+            for op, s in ops.items():
+                print(f"  {op:18s} median {s['median_ms']:10.3f} ms   p95 {s['p95_ms']:10.3f} ms   (n={s['n']})")
+
+    os.makedirs(os.path.dirname(args.output), exist_ok=True)
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+    print(f"results written to {args.output}")
+
+    if args.save_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        print(f"baseline saved to {args.baseline}")
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print("no baseline to compare against (run with --save-baseline)")
+        return 0
+    with open(args.baseline, encoding="utf-8") as f:
+        regressions = compare(results, json.load(f), args.tolerance)
+    for engine, scale, op, b, n, ratio in regressions:
+        print(f"REGRESSION {engine} @ {scale}: {op} {b:.3f} ms -> {n:.3f} ms ({ratio:.2f}x)")
+    if not regressions:
+        print(f"no regressions beyond {args.tolerance:.0%} of baseline")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
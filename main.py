@@ -1,20 +1,51 @@
 import streamlit as st
 import pandas as pd
 import os
-import requests
-import uuid
-import cv2
 import datetime
+import time
 
-from utils.barcode_scanner import BarcodeScanner
-from utils.database import Database
+# keep this list light: it runs on every rerun. opencv/pyzbar (scanner), requests
+# (isbn lookups) and the bulk importer are imported where they're first used.
+# see benchmarks/import_times.txt
+from utils.database import get_database, SORT_KEYS, ARCHIVE_AFTER_DAYS
+from utils.isbn_lookup import lookup_isbn
 from utils.notifications import NotificationSystem
+from utils.reminders import start_reminder_scheduler, REMINDER_INTERVAL_SECONDS
+from utils.metrics import metrics, start_metrics_server
+from utils.analytics import get_analytics
 
 print("DEBUG [top-level]: main.py is loading...")
 
-db = Database()
-scanner = BarcodeScanner()
-notify = NotificationSystem()  # global instance
+# singletons live in st.cache_resource, so reruns reuse them instead of rebuilding
+@st.cache_resource
+def get_db():
+    return get_database()  # LIBRARY_DB_ENGINE=sqlite switches to the indexed engine
+
+@st.cache_resource
+def get_notify():
+    notify = NotificationSystem()
+    # due-date reminders go out on their own; the admin button just runs one pass right away
+    start_reminder_scheduler(get_db(), notify, int(os.environ.get("LIBRARY_REMINDER_INTERVAL", REMINDER_INTERVAL_SECONDS)))
+    return notify
+
+@st.cache_resource
+def get_scanner():
+    from utils.barcode_scanner import BarcodeScanner  # pulls in opencv + pyzbar
+    return BarcodeScanner()
+
+@st.cache_resource
+def get_metrics_server():
+    # LIBRARY_METRICS_PORT=9100 exposes /metrics for a prometheus scraper
+    port = os.environ.get("LIBRARY_METRICS_PORT")
+    return start_metrics_server(int(port)) if port else None
+
+@st.cache_resource
+def get_reports():
+    return get_analytics(get_db())
+
+db = get_db()
+notify = get_notify()
+get_metrics_server()
 
 def check_admin_auth():
     return st.session_state.get('admin_authenticated', False)
@@ -36,39 +67,78 @@ def admin_login():
                 print("DEBUG [admin_login]: invalid credentials")
 
 def fetch_book_info_from_isbn(isbn):
-    if not isbn or not isbn.strip().isdigit():
-        return "", ""
-    url = f"https://openlibrary.org/api/books?bibkeys=ISBN:{isbn}&jscmd=data&format=json"
-    try:
-        resp = requests.get(url, timeout=5)
-        resp.raise_for_status()
-        data = resp.json()
-        key = f"ISBN:{isbn}"
-        if key in data:
-            record = data[key]
-            authors = record.get("authors", [])
-            author_name = authors[0]["name"] if authors else "unknown"
-            return record.get("title", ""), author_name
-        else:
-            return "", ""
-    except Exception as e:
-        print(f"DEBUG [fetch_book_info_from_isbn]: error => {e}")
-        return "", ""
+    # catalog first, then the on-disk isbn cache; open library only on a cold miss
+    return lookup_isbn(isbn, db)
+
+def recent_events_feed(n=10):
+    """admin event feed: only asks the db for events newer than what this session has seen"""
+    cursor = st.session_state.get("events_cursor")
+    new_events, st.session_state["events_cursor"] = db.get_events_since(cursor, limit=n)
+    if cursor is None or "events_feed" not in st.session_state:
+        feed = new_events
+    else:
+        # the cursor keeps new_events and the cached feed disjoint, two identical rows are two real events
+        feed = pd.concat([new_events, st.session_state["events_feed"]], ignore_index=True).head(n)
+    st.session_state["events_feed"] = feed
+    return feed
+
+PAGE_SIZES = [25, 50, 100, 250]
+
+def paged_table(key, fetch, sort_keys, default_sort=None, descending=False, columns=None, **filters):
+    """
+    shows one page of a table. fetch(offset, limit, sort, descending, **filters) returns
+    (frame, total), so only the visible rows are read and sent to the browser
+    """
+    c1, c2, c3, c4, c5 = st.columns([3, 2, 2, 1, 1])
+    options = ["(stored order)"] + sort_keys
+    sort = c1.selectbox("sort by", options, index=options.index(default_sort) if default_sort else 0, key=f"{key}_sort")
+    sort = None if sort == options[0] else sort
+    desc = c2.checkbox("descending", value=descending, key=f"{key}_desc")
+    size = c3.selectbox("rows per page", PAGE_SIZES, index=1, key=f"{key}_size")
+
+    # a different sort, page size or filter starts again at page 1
+    view = (sort, desc, size, tuple(sorted(filters.items())))
+    if st.session_state.get(f"{key}_view") != view:
+        st.session_state[f"{key}_view"] = view
+        st.session_state[f"{key}_page"] = 0
+    page = st.session_state.get(f"{key}_page", 0)
+    if c4.button("prev", key=f"{key}_prev"):
+        page = max(0, page - 1)
+    if c5.button("next", key=f"{key}_next"):
+        page += 1
+
+    frame, total = fetch(offset=page * size, limit=size, sort=sort, descending=desc, **filters)
+    pages = max(1, -(-total // size))
+    if page >= pages:
+        page = pages - 1
+        frame, total = fetch(offset=page * size, limit=size, sort=sort, descending=desc, **filters)
+    st.session_state[f"{key}_page"] = page
+
+    if columns:
+        frame = frame[columns]
+    st.dataframe(frame, hide_index=True)
+    first = page * size + 1 if total else 0
+    st.caption(f"rows {first}-{page * size + len(frame)} of {total} (page {page + 1}/{pages})")
 
 def main():
     print("DEBUG [main()]: start in console")
     st.title("library management system")
 
     menu = st.sidebar.selectbox("menu", ["home (checkout)", "search books", "admin panel"])
-    if menu == "home (checkout)":
-        show_home_checkout()
-    elif menu == "search books":
-        show_search()
-    elif menu == "admin panel":
-        if not check_admin_auth():
-            admin_login()
-        else:
-            show_admin()
+    # st.stop() and st.rerun() end the run by raising, the finally still records it
+    t0 = time.perf_counter()
+    try:
+        if menu == "home (checkout)":
+            show_home_checkout()
+        elif menu == "search books":
+            show_search()
+        elif menu == "admin panel":
+            if not check_admin_auth():
+                admin_login()
+            else:
+                show_admin()
+    finally:
+        metrics.observe("library_rerun_seconds", time.perf_counter() - t0, page=menu)
 
     print("DEBUG [main()]: end in console")
 
@@ -90,9 +160,7 @@ def show_home_checkout():
             typed_id = st.text_input("existing user id")
             if st.button("sign in"):
                 if typed_id.strip():
-                    users_df = db.get_all_users()
-                    match = users_df[users_df['user_id'].astype(str).str.strip() == typed_id.strip()]
-                    if match.empty:
+                    if db.get_user(typed_id) is None:
                         st.error("that user id doesn't exist. check or create new.")
                     else:
                         st.session_state["current_user_id"] = typed_id.strip()
@@ -105,19 +173,18 @@ def show_home_checkout():
             new_email = st.text_input("your email")
             if st.button("create account"):
                 if new_name and new_email:
-                    allu = db.get_all_users()
-                    dup = allu[allu['email'].str.lower().str.strip() == new_email.lower().strip()]
-                    if not dup.empty:
+                    dup = db.get_user_by_email(new_email)
+                    if dup is not None:
                         st.error("an account with that email already exists!")
                         if st.button("email me my user id"):
-                            user_id = dup.iloc[0]['user_id']
+                            user_id = dup['user_id']
                             subject = "Your Library User ID"
                             body = f"Hello,\n\nYour user id is: {user_id}\n\nRegards,\nLibrary"
                             print(f"DEBUG [email_user_id]: sending user id {user_id} to {new_email.strip()}")
-                            ok = notify.send_email(new_email.strip(), subject, body)
+                            ok = notify.queue_email(new_email.strip(), subject, body)
                             if ok:
-                                st.success(f"emailed your user id to {new_email.strip()}")
-                                print("DEBUG [email_user_id]: success => email sent")
+                                st.success(f"your user id is on its way to {new_email.strip()}")
+                                print("DEBUG [email_user_id]: success => email queued")
                             else:
                                 st.error("failed to send email. check logs or smtp config.")
                                 print("DEBUG [email_user_id]: fail => see logs.")
@@ -132,19 +199,18 @@ def show_home_checkout():
             forgot_email = st.text_input("enter your email to retrieve user id")
             if st.button("send user id to my email"):
                 if forgot_email.strip():
-                    users_df = db.get_all_users()
-                    match = users_df[users_df['email'].str.lower().str.strip() == forgot_email.lower().strip()]
-                    if match.empty:
+                    match = db.get_user_by_email(forgot_email)
+                    if match is None:
                         st.error("no user found with that email.")
                     else:
-                        user_id = match.iloc[0]['user_id']
+                        user_id = match['user_id']
                         subject = "Your Library User ID"
                         body = f"Hello,\n\nYour user id is: {user_id}\n\nRegards,\nLibrary"
                         print(f"DEBUG [forgot_user_id]: sending user id {user_id} to {forgot_email.strip()}")
-                        success = notify.send_email(forgot_email.strip(), subject, body)
+                        success = notify.queue_email(forgot_email.strip(), subject, body)
                         if success:
-                            st.success(f"emailed your user id to {forgot_email.strip()}")
-                            print("DEBUG [forgot_user_id]: success => email sent")
+                            st.success(f"your user id is on its way to {forgot_email.strip()}")
+                            print("DEBUG [forgot_user_id]: success => email queued")
                         else:
                             st.error("failed to send email. see logs.")
                             print("DEBUG [forgot_user_id]: fail => see logs.")
@@ -157,53 +223,45 @@ def show_home_checkout():
     else:
         st.info(f"you are currently user id => {st.session_state['current_user_id']}")
 
-    st.subheader("checkout a book")
+    st.subheader("checkout books")
 
+    # a stack of books goes out as one batch: scan or type each barcode, then check them all out
     if st.button("scan barcode now"):
-        scanned = scanner.scan_barcode()
+        scanned = get_scanner().scan_barcode()
         if scanned:
-            st.session_state["checkout_barcode"] = scanned
+            stack = st.session_state.get("checkout_barcodes", "").split()
+            st.session_state["checkout_barcodes"] = "\n".join(stack + [scanned])
             st.success(f"scanned => {scanned}")
 
-    typed_barcode = st.text_input("book barcode (isbn)", value=st.session_state.get("checkout_barcode",""))
+    typed = st.text_area("book barcodes (isbn), one per line", value=st.session_state.get("checkout_barcodes", ""))
+    barcodes = typed.split()
     if st.button("fetch open library data"):
-        t,a = fetch_book_info_from_isbn(typed_barcode)
-        if t or a:
-            st.write(f"**title**: {t}, **author**: {a}")
-        else:
-            st.warning("not found in open library or invalid isbn")
-
-    if st.button("checkout book"):
-        user_id = st.session_state["current_user_id"]
-        book = db.get_book(typed_barcode)
-        if not book:
-            st.error("that book isn't in the db. ask an admin to add it.")
-            return
+        for barcode in barcodes:
+            t,a = fetch_book_info_from_isbn(barcode)
+            if t or a:
+                st.write(f"{barcode}: **title**: {t}, **author**: {a}")
+            else:
+                st.warning(f"{barcode}: not found in open library or invalid isbn")
 
-        copy_id = db.checkout_copy(typed_barcode)
-        if not copy_id:
-            st.error("no copies available or invalid. cannot checkout.")
+    if st.button("checkout books"):
+        if not barcodes:
+            st.error("enter at least one barcode")
             return
-
-        now = datetime.datetime.now()
-        due_date = now + datetime.timedelta(days=14)
-        co_id = str(uuid.uuid4())[:8]
-        db.record_checkout(
-            checkout_id=co_id,
-            user_id=user_id,
-            copy_id=copy_id,
-            date_str=now.strftime("%Y-%m-%d"),
-            due_str=due_date.strftime("%Y-%m-%d")
-        )
-        st.success(f"checked out '{book['title']}' by {book['author']} — due {due_date.strftime('%Y-%m-%d')}")
+        user_id = st.session_state["current_user_id"]
+        results = db.checkout_books(user_id, barcodes)
+        for r in results:
+            if r['ok']:
+                st.success(f"checked out '{r['title']}' — due {r['due_date']}")
+            elif r['error'] == "that book isn't in the db":
+                st.error(f"{r['barcode']}: that book isn't in the db. ask an admin to add it.")
+            else:
+                st.error(f"{r['barcode']} ({r['title'] or 'unknown'}): {r['error']}. cannot checkout.")
+        print(f"DEBUG [checkout]: {sum(r['ok'] for r in results)}/{len(results)} items checked out for {user_id}")
+        st.session_state["checkout_barcodes"] = ""
 
     st.write("books in db (simplified):")
-    all_books = db.get_all_books()
-    if all_books.empty:
-        st.info("no books yet.")
-    else:
-        user_view = all_books[['title','author','total_copies','available_copies']]
-        st.dataframe(user_view)
+    paged_table("home_books", db.get_books_page, ['title', 'author', 'available_copies'], default_sort='title',
+                columns=['title', 'author', 'total_copies', 'available_copies'])
 
 def show_search():
     st.header("search books")
@@ -217,14 +275,16 @@ def show_search():
 
 def show_admin():
     st.header("admin panel")
+    stats = db.cache_stats()
+    st.caption(f"table cache: {stats['hits']} hits / {stats['misses']} disk reads")
 
-    tab1, tab2, tab3, tab4 = st.tabs(["books", "users", "checkouts", "notifications"])
+    tab1, tab2, tab3, tab4, tab5, tab6 = st.tabs(["books", "users", "checkouts", "notifications", "performance", "analytics"])
 
     # -- books --
     with tab1:
         st.subheader("book management")
         if st.button("scan new book"):
-            scanned = scanner.scan_barcode()
+            scanned = get_scanner().scan_barcode()
             if scanned:
                 st.session_state["admin_isbn"] = scanned
                 st.success(f"scanned => {scanned}")
@@ -252,33 +312,48 @@ def show_admin():
                 db.add_book(typed_isbn.strip(), fin_t.strip(), fin_a.strip(), fin_c)
                 st.success("book added or updated in db")
 
+        with st.expander("bulk import from a list of isbns"):
+            st.write("csv with `isbn,copies` rows, or one isbn per line")
+            isbn_file = st.file_uploader("isbn list", type=["csv", "txt"])
+            add_unknown = st.checkbox("also add isbns open library doesn't know (blank title)")
+            if isbn_file is not None and st.button("import books"):
+                from utils.bulk_import import import_isbns, parse_isbns
+                counts = parse_isbns(isbn_file.getvalue().decode("utf-8", errors="ignore").splitlines())
+                bar = st.progress(0.0, text="looking up metadata...")
+                summary = import_isbns(
+                    counts, db=db, add_unresolved=add_unknown,
+                    progress=lambda done, total: bar.progress(done / max(total, 1), text=f"resolved {done}/{total}"),
+                )
+                st.success(f"added {summary['copies']} copies of {summary['books']} books")
+                if summary['unresolved']:
+                    st.warning(f"{len(summary['unresolved'])} isbns not found: {', '.join(summary['unresolved'][:50])}")
+
         st.write("full books in db (admin view):")
-        st.dataframe(db.get_all_books())
+        paged_table("admin_books", db.get_books_page, SORT_KEYS['books'])
 
     # -- users --
     with tab2:
         st.subheader("user management")
-        st.write(db.get_all_users())
+        paged_table("admin_users", db.get_users_page, SORT_KEYS['users'], default_sort='name')
         with st.form("add_user"):
             nm = st.text_input("name")
             em = st.text_input("email")
             sb = st.form_submit_button("create user")
             if sb:
                 if nm and em:
-                    allu = db.get_all_users()
-                    existing = allu[allu['email'].str.lower().str.strip() == em.lower().strip()]
-                    if not existing.empty:
-                        ex_uid = existing.iloc[0]['user_id']
+                    existing = db.get_user_by_email(em)
+                    if existing is not None:
+                        ex_uid = existing['user_id']
                         st.warning(f"that email is already in use. user id => {ex_uid}")
                         st.info("if you want, you can send them an email with their user id:")
                         if st.button("email them their user id", key="email_existing_user"):
                             subject = "Your Library User ID"
                             body = f"Hello,\n\nYour user id is: {ex_uid}\n\nRegards,\nLibrary"
                             print(f"DEBUG [admin_email_user_id]: about to email user id {ex_uid} to {em.strip()}")
-                            ok = notify.send_email(em.strip(), subject, body)
+                            ok = notify.queue_email(em.strip(), subject, body)
                             if ok:
-                                st.success(f"we emailed the user id to {em.strip()}")
-                                print("DEBUG [admin_email_user_id]: success => email sent")
+                                st.success(f"queued an email with the user id to {em.strip()}")
+                                print("DEBUG [admin_email_user_id]: success => email queued")
                             else:
                                 st.error("failed to send email. see logs.")
                                 print("DEBUG [admin_email_user_id]: failed => see logs.")
@@ -291,36 +366,50 @@ def show_admin():
     # -- checkouts --
     with tab3:
         st.subheader("checkouts + checkins")
-        st.write("recent events (checkin/checkout):")
-        recents = db.get_recent_events(10)
-        st.dataframe(recents)
-
-        st.write("all checkout records:")
-        st.dataframe(db.get_all_checkouts())
-
-        st.write("check in a book copy (by copy_id):")
-        copy_id_input = st.text_input("copy id")
-        if st.button("check in copy"):
-            ok = db.check_in_copy(copy_id_input.strip())
-            if ok:
-                st.success("checked in successfully!")
-            else:
-                st.error("check-in failed. maybe invalid copy id or already returned.")
+        # check-in first, so the feed and table below already show it
+        st.write("check in book copies (copy ids, one per line):")
+        copy_ids_input = st.text_area("copy ids")
+        if st.button("check in copies"):
+            results = db.check_in_copies(copy_ids_input.split())
+            done = [r for r in results if r['ok']]
+            if done:
+                st.success(f"checked in {len(done)} of {len(results)} copies")
+            for r in results:
+                if not r['ok']:
+                    st.error(f"{r['copy_id']}: check-in failed ({r['error']})")
+            if results:
+                st.dataframe(pd.DataFrame(results)[['copy_id', 'title', 'user_id', 'ok', 'error']], hide_index=True)
 
-            st.write("updated events:")
-            st.dataframe(db.get_recent_events(10))
-            st.write("updated checkouts:")
-            st.dataframe(db.get_all_checkouts())
-            st.write("updated books:")
-            st.dataframe(db.get_all_books())
+        st.write("recent events (checkin/checkout):")
+        st.dataframe(recent_events_feed(10))
+
+        st.write("checkout records:")
+        f1, f2, f3 = st.columns(3)
+        status = f1.selectbox("show", ["all", "open", "overdue", "returned"], key="co_status")
+        borrower = f2.text_input("only user id", key="co_user").strip()
+        # without a range only open loans and recent returns are shown, a range also reads the archive
+        span = f3.date_input("loans out between", value=(), key="co_range")
+        start, end = (span[0], span[-1]) if span else (None, None)
+        if not span:
+            st.caption(f"open loans and returns from the last {ARCHIVE_AFTER_DAYS} days; pick dates to search the archive")
+        paged_table("admin_checkouts", db.get_checkouts_page, SORT_KEYS['checkouts'],
+                    default_sort='checkout_date', descending=True,
+                    status=None if status == "all" else status, user_id=borrower or None,
+                    start=start, end=end)
 
     # -- notifications & email settings --
     with tab4:
         st.subheader("notifications & email settings")
         st.write("send reminders for 3 days before due, due day, 3 days overdue.")
         if st.button("send reminder/overdue emails"):
-            notify.check_reminders(db)
-            st.success("reminders triggered. check console logs for details")
+            queued = notify.check_reminders(db)
+            st.success(f"queued {queued} reminder(s). check console logs for details")
+        ob = notify.outbox_stats()
+        st.caption(
+            f"outbox: {ob['queued']} queued, {ob['sending']} sending, {ob['failed']} failed | "
+            f"oldest {ob['oldest_age']:.0f}s | sent {ob['sent']}, retried {ob['retried']} | "
+            f"latency p50 {ob['latency_p50']:.1f}s, p95 {ob['latency_p95']:.1f}s"
+        )
 
         st.write("---")
         st.write("**set or update smtp credentials** (gmail account & password)**")
@@ -350,6 +439,86 @@ def show_admin():
             else:
                 st.error("please enter a valid email address")
 
+    # -- performance --
+    with tab5:
+        show_performance()
+
+    # -- analytics --
+    with tab6:
+        show_analytics()
+
+def show_analytics():
+    """circulation reports, answered from the daily rollups in utils.analytics"""
+    st.subheader("circulation analytics")
+    reports = get_reports()
+    today = datetime.date.today()
+    span = st.date_input("between", value=(today - datetime.timedelta(days=30), today), key="an_range")
+    if len(span) < 2:
+        st.info("pick an end date")
+        return
+    start, end = span
+
+    summary = reports.summary(start, end)
+    c1, c2, c3, c4, c5 = st.columns(5)
+    c1.metric("checkouts", summary['checkouts'])
+    c2.metric("returns", summary['returns'])
+    c3.metric("avg loan (days)", summary['avg_loan_days'] if summary['avg_loan_days'] is not None else "-")
+    c4.metric("returned late", f"{summary['overdue_rate']:.0%}" if summary['overdue_rate'] is not None else "-")
+    c5.metric("overdue now", f"{summary['overdue_now']} / {summary['open_loans']}")
+
+    daily = reports.daily(start, end)
+    st.write("loans per day:")
+    st.line_chart(daily.set_index('day')[['checkouts', 'returns']])
+
+    left, right = st.columns(2)
+    left.write("most borrowed titles:")
+    left.dataframe(reports.top_titles(start, end, n=20)[['title', 'author', 'checkouts', 'avg_loan_days', 'overdue_rate']],
+                   hide_index=True)
+    right.write("most borrowed authors:")
+    right.dataframe(reports.top_authors(start, end, n=20)[['author', 'titles', 'checkouts', 'avg_loan_days', 'overdue_rate']],
+                    hide_index=True)
+
+    st.caption("finished days come from the stored rollups, today is rolled up live every few seconds")
+    if st.button("rebuild rollups from the full history"):
+        days = reports.rebuild()
+        st.success(f"rolled up {days} days")
+
+def show_performance():
+    """per-operation timings and i/o counters collected by utils.metrics in this process"""
+    st.subheader("performance")
+    uptime = time.time() - metrics.started
+    st.caption(f"collected over the last {uptime / 60:.0f} min in this process. p50/p95 cover the most recent calls")
+
+    rows = metrics.histograms()
+    if not rows:
+        st.info("nothing recorded yet")
+    else:
+        timings = pd.DataFrame(rows)
+        ops = timings[timings['metric'] == "library_db_op_seconds"]
+        if not ops.empty:
+            st.write("database operations (slowest total first):")
+            st.dataframe(ops.drop(columns=['metric']).dropna(axis=1, how='all').round(3), hide_index=True)
+        pages = timings[timings['metric'] == "library_rerun_seconds"]
+        if not pages.empty:
+            st.write("page reruns:")
+            st.dataframe(pages.drop(columns=['metric']).dropna(axis=1, how='all').round(1), hide_index=True)
+        other = timings[~timings['metric'].isin(["library_db_op_seconds", "library_rerun_seconds"])]
+        if not other.empty:
+            st.write("files, smtp and open library:")
+            st.dataframe(other.dropna(axis=1, how='all').round(3), hide_index=True)
+
+    counters = metrics.counters()
+    if counters:
+        st.write("counters:")
+        st.dataframe(pd.DataFrame(counters).fillna(""), hide_index=True)
+
+    col1, col2 = st.columns(2)
+    col1.download_button("download metrics (prometheus text)", metrics.render_prometheus(),
+                         file_name="library_metrics.txt", mime="text/plain")
+    if col2.button("reset metrics"):
+        metrics.reset()
+        st.rerun()
+
 if __name__ == "__main__":
     print("DEBUG [__main__]: about to call main()")
     main()
@@ -0,0 +1,124 @@
+"""
+shared fixtures. the tests import the app the same way the benchmarks do, from the
+repo root, and talk to local stand-ins instead of real smtp / open library servers.
+"""
+import os
+import socketserver
+import sys
+import threading
+from http.server import ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from utils.openlibrary_stub import StubHandler  # noqa: E402
+
+
+class SmtpStandIn(socketserver.ThreadingTCPServer):
+    """
+    just enough smtp for smtplib: EHLO/HELO, MAIL, RCPT, DATA, RSET, NOOP, QUIT.
+    every delivered message is kept as (connection number, raw message). recipients in
+    `reject` get a 550, and with `hangup_after` set the server drops a connection once
+    it has taken that many messages on it, like a server with a per-session limit.
+    """
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), SmtpHandler)
+        self.port = self.server_address[1]
+        self.lock = threading.Lock()
+        self.connections = 0
+        self.quits = 0
+        self.messages = []
+        self.reject = set()
+        self.hangup_after = None
+
+    def next_connection(self):
+        with self.lock:
+            self.connections += 1
+            return self.connections
+
+
+class SmtpHandler(socketserver.StreamRequestHandler):
+
+    def reply(self, line):
+        self.wfile.write(line.encode("ascii") + b"\r\n")
+
+    def handle(self):
+        server = self.server
+        conn_no = server.next_connection()
+        taken = 0
+        self.reply("220 stand-in ready")
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            verb = line.decode("ascii", "replace").strip().split(" ")[0].upper()
+            if verb in ("EHLO", "HELO"):
+                self.reply("250 stand-in")
+            elif verb == "RCPT":
+                recipient = line.decode("ascii", "replace").split(":", 1)[1].strip().strip("<>")
+                self.reply("550 no such user" if recipient in server.reject else "250 ok")
+            elif verb in ("MAIL", "RSET", "NOOP"):
+                self.reply("250 ok")
+            elif verb == "DATA":
+                self.reply("354 go ahead")
+                data = []
+                while True:
+                    chunk = self.rfile.readline()
+                    if not chunk or chunk == b".\r\n":
+                        break
+                    data.append(chunk)
+                with server.lock:
+                    server.messages.append((conn_no, b"".join(data).decode("utf-8", "replace")))
+                taken += 1
+                self.reply("250 queued")
+                if server.hangup_after and taken >= server.hangup_after:
+                    return
+            elif verb == "QUIT":
+                with server.lock:
+                    server.quits += 1
+                self.reply("221 bye")
+                return
+            else:
+                self.reply("502 not implemented")
+
+
+@pytest.fixture
+def smtp_server():
+    server = SmtpStandIn()
+    thread = threading.Thread(target=server.serve_forever, args=(0.05,), daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+class RecordingStubHandler(StubHandler):
+    """the open library stub, noting the isbns asked for in each request"""
+
+    def do_GET(self):
+        keys = parse_qs(urlparse(self.path).query).get("bibkeys", [""])[0].split(",")
+        with self.server.lock:
+            self.server.requests.append([k.split(":", 1)[-1] for k in keys if k])
+        super().do_GET()
+
+
+@pytest.fixture
+def openlibrary():
+    """the stub from utils/openlibrary_stub.py on a free port; .url is its base url"""
+    server = ThreadingHTTPServer(("127.0.0.1", 0), RecordingStubHandler)
+    server.daemon_threads = True
+    server.lock = threading.Lock()
+    server.requests = []
+    server.url = f"http://127.0.0.1:{server.server_address[1]}"
+    thread = threading.Thread(target=server.serve_forever, args=(0.05,), daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
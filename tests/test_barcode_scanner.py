@@ -0,0 +1,249 @@
+import threading
+import time
+
+import numpy as np
+import pytest
+
+from utils.barcode_scanner import BarcodeScanner, CameraBusy, CameraSession, get_camera_session, scan_frames
+
+# ean-13 bit patterns, enough to draw a barcode pyzbar can read
+L_CODES = ["0001101", "0011001", "0010011", "0111101", "0100011", "0110001", "0101111", "0111011", "0110111", "0001011"]
+G_CODES = ["0100111", "0110011", "0011011", "0100001", "0011101", "0111001", "0000101", "0010001", "0001001", "0010111"]
+R_CODES = ["1110010", "1100110", "1101100", "1000010", "1011100", "1001110", "1010000", "1000100", "1001000", "1110100"]
+PARITY = ["LLLLLL", "LLGLGG", "LLGGLG", "LLGGGL", "LGLLGG", "LGGLLG", "LGGGLL", "LGLGLG", "LGLGGL", "LGGLGL"]
+
+
+def ean13_frame(digits, h=480, w=640, module=3):
+    """(13-digit code, BGR frame with the barcode drawn in the middle) for 12 digits"""
+    d = [int(c) for c in digits]
+    code = digits + str((10 - sum(x * (3 if i % 2 else 1) for i, x in enumerate(d)) % 10) % 10)
+    bits = "101"
+    for i, c in enumerate(code[1:7]):
+        bits += (L_CODES if PARITY[int(code[0])][i] == "L" else G_CODES)[int(c)]
+    bits += "01010" + "".join(R_CODES[int(c)] for c in code[7:]) + "101"
+    frame = np.full((h, w, 3), 255, np.uint8)
+    x0 = (w - len(bits) * module) // 2
+    for i, bit in enumerate(bits):
+        if bit == "1":
+            frame[h // 2 - 60:h // 2 + 60, x0 + i * module:x0 + (i + 1) * module] = 0
+    return code, frame
+
+
+BLANK = np.full((480, 640, 3), 255, np.uint8)
+
+
+class FakeCapture:
+    """cv2.VideoCapture stand-in: `frame` is served at ~fps until `frames_left` runs out"""
+
+    def __init__(self, opened=True, fps=100, frames_left=None):
+        self.opened = opened
+        self.interval = 1.0 / fps
+        self.frames_left = frames_left
+        self.frame = BLANK
+        self.reads = 0
+        self.released = False
+
+    def isOpened(self):
+        return self.opened and not self.released
+
+    def read(self):
+        time.sleep(self.interval)
+        if self.released or self.frames_left == 0:
+            return False, None
+        if self.frames_left is not None:
+            self.frames_left -= 1
+        self.reads += 1
+        return True, self.frame
+
+    def get(self, prop):
+        return 1.0 / self.interval
+
+    def release(self):
+        self.released = True
+
+
+class FakeOpener:
+    """opener(source) for CameraSession, keeps every capture it hands out"""
+
+    def __init__(self, **capture_args):
+        self.capture_args = capture_args
+        self.captures = []
+
+    def __call__(self, source):
+        capture = FakeCapture(**self.capture_args)
+        self.captures.append(capture)
+        return capture
+
+
+def _wait_for(predicate, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.02)
+    return False
+
+
+def test_session_keeps_one_capture_across_scans():
+    opener = FakeOpener()
+    session = CameraSession(source=0, opener=opener, idle_timeout=60)
+    try:
+        with session.use() as first:
+            assert first is not None
+            assert first.next_frame(0)[1] is not None
+        # between scans the camera stays open and keeps grabbing
+        assert session.is_open
+        assert _wait_for(lambda: first.seq > 5)
+        with session.use() as second:
+            assert second is first
+            seq = second.seq
+            assert second.next_frame(seq)[0] > seq
+        assert len(opener.captures) == 1
+        assert not opener.captures[0].released
+    finally:
+        session.close()
+    assert opener.captures[0].released
+    assert not session.is_open
+
+
+def test_session_reopens_after_the_capture_ends():
+    opener = FakeOpener(frames_left=3)
+    session = CameraSession(opener=opener, idle_timeout=60)
+    try:
+        with session.use() as grabber:
+            assert _wait_for(lambda: grabber.ended)
+        with session.use() as grabber:
+            assert grabber is not None and not grabber.ended
+        assert len(opener.captures) == 2
+        assert opener.captures[0].released
+    finally:
+        session.close()
+
+
+def test_camera_that_will_not_open_gives_no_grabber():
+    opener = FakeOpener(opened=False)
+    session = CameraSession(opener=opener, idle_timeout=60)
+    with session.use() as grabber:
+        assert grabber is None
+    assert opener.captures[0].released
+    assert not session.is_open
+
+
+def test_second_scan_gets_camera_busy_while_the_first_runs():
+    session = CameraSession(opener=FakeOpener(), idle_timeout=60)
+    holding, done = threading.Event(), threading.Event()
+
+    def first_scan():
+        with session.use():
+            holding.set()
+            done.wait(5)
+
+    t = threading.Thread(target=first_scan)
+    t.start()
+    try:
+        assert holding.wait(5)
+        with pytest.raises(CameraBusy):
+            with session.use(wait=0.1):
+                pass
+    finally:
+        done.set()
+        t.join()
+    # free again once the first scan is done
+    with session.use(wait=0.1) as grabber:
+        assert grabber is not None
+    session.close()
+
+
+def test_second_scan_waits_for_a_short_first_scan():
+    session = CameraSession(opener=FakeOpener(), idle_timeout=60)
+    holding = threading.Event()
+
+    def first_scan():
+        with session.use():
+            holding.set()
+            time.sleep(0.2)
+
+    t = threading.Thread(target=first_scan)
+    t.start()
+    assert holding.wait(5)
+    with session.use(wait=5) as grabber:
+        assert grabber is not None
+    t.join()
+    session.close()
+
+
+def test_idle_reaper_releases_the_camera():
+    opener = FakeOpener()
+    session = CameraSession(opener=opener, idle_timeout=0.2)
+    with session.use() as grabber:
+        assert grabber is not None
+    # the reaper looks at least once a second
+    assert _wait_for(lambda: not session.is_open, timeout=4)
+    assert opener.captures[0].released
+    # and the next scan simply opens it again
+    with session.use() as grabber:
+        assert grabber is not None
+    assert len(opener.captures) == 2
+    session.close()
+
+
+def test_idle_reaper_leaves_a_scan_in_progress_alone():
+    opener = FakeOpener()
+    session = CameraSession(opener=opener, idle_timeout=0.2)
+    with session.use() as grabber:
+        time.sleep(1.5)
+        assert session.is_open
+        assert not opener.captures[0].released
+        assert grabber.next_frame(grabber.seq)[1] is not None
+    session.close()
+
+
+def test_scanner_uses_the_shared_session_with_its_opener():
+    opener = FakeOpener()
+    scanner = BarcodeScanner(source=917, opener=opener)
+    assert scanner.camera is get_camera_session(917)
+    assert scanner.camera.opener is opener
+    # another scanner on the same camera shares the session, and the open device
+    with scanner.camera.use() as grabber:
+        assert grabber is not None
+    with BarcodeScanner(source=917).camera.use() as again:
+        assert again is grabber
+    assert len(opener.captures) == 1
+    scanner.camera.close()
+
+
+def test_existing_session_refuses_different_settings():
+    opener = FakeOpener()
+    session = get_camera_session(918, opener=opener, idle_timeout=30)
+    assert get_camera_session(918) is session
+    assert get_camera_session(918, opener=opener, idle_timeout=30) is session
+    with pytest.raises(ValueError):
+        get_camera_session(918, opener=FakeOpener())
+    with pytest.raises(ValueError):
+        get_camera_session(918, idle_timeout=5)
+    assert session.opener is opener and session.idle_timeout == 30
+
+
+def test_back_to_back_scans_decode_on_the_warm_session():
+    pytest.importorskip("pyzbar.pyzbar", exc_type=ImportError)  # needs the zbar shared library
+    first_code, first_frame = ean13_frame("978030640615")
+    second_code, second_frame = ean13_frame("400638133393")
+    opener = FakeOpener(fps=30)
+    session = CameraSession(opener=opener, idle_timeout=60)
+    try:
+        with session.use() as grabber:
+            opener.captures[0].frame = first_frame
+            barcode, stats = scan_frames(grabber, timeout=5)
+        assert barcode == first_code
+        with session.use() as grabber:
+            opener.captures[0].frame = second_frame
+            # a read already in flight may still carry the first barcode, let it pass
+            seq = grabber.seq
+            assert _wait_for(lambda: grabber.seq > seq + 1)
+            barcode, stats = scan_frames(grabber, timeout=5)
+        assert barcode == second_code
+        # the second scan didn't wait for the camera to open
+        assert stats.time_to_decode is not None and stats.time_to_decode < 1.0
+        assert len(opener.captures) == 1
+    finally:
+        session.close()
@@ -0,0 +1,84 @@
+import cv2
+import pandas as pd
+import pytest
+
+from test_barcode_scanner import BLANK, ean13_frame
+from utils.batch_decode import FRAMES_PER_TASK, decode_images, decode_video, reconcile
+
+SHELF_CODE, SHELF_FRAME = ean13_frame("978030640615")
+ODD_CODE, ODD_FRAME = ean13_frame("400638133393")
+
+
+@pytest.fixture
+def zbar():
+    pytest.importorskip("pyzbar.pyzbar", exc_type=ImportError)  # needs the zbar shared library
+
+
+def test_decode_images_counts_barcodes_and_lists_unreadable_files(zbar, tmp_path):
+    cv2.imwrite(str(tmp_path / "a.png"), SHELF_FRAME)
+    cv2.imwrite(str(tmp_path / "b.jpg"), SHELF_FRAME)
+    cv2.imwrite(str(tmp_path / "c.png"), ODD_FRAME)
+    cv2.imwrite(str(tmp_path / "empty.png"), BLANK)
+    (tmp_path / "broken.png").write_bytes(b"not an image")
+    (tmp_path / "notes.txt").write_text("skipped, not an image extension")
+
+    found, unreadable = decode_images(str(tmp_path), workers=2)
+    assert found == {
+        SHELF_CODE: {'count': 2, 'first_seen': str(tmp_path / "a.png")},
+        ODD_CODE: {'count': 1, 'first_seen': str(tmp_path / "c.png")},
+    }
+    assert unreadable == [str(tmp_path / "broken.png")]
+
+
+def test_decode_video_samples_every_nth_frame_across_tasks(zbar, tmp_path):
+    path = str(tmp_path / "shelf.avi")
+    total, every = 2 * FRAMES_PER_TASK + 20, 7
+    # a frame that's a multiple of `every` but not at that offset from its task's start
+    odd_frame = next(i for i in range(FRAMES_PER_TASK, 2 * FRAMES_PER_TASK) if i % every == 0 and i % FRAMES_PER_TASK % every)
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"MJPG"), 25, (640, 480))
+    assert writer.isOpened()
+    for i in range(total):
+        writer.write(ODD_FRAME if i == odd_frame else SHELF_FRAME)
+    writer.release()
+
+    found = decode_video(path, every=every, workers=2)
+    sampled = len(range(0, total, every))
+    assert found == {
+        SHELF_CODE: {'count': sampled - 1, 'first_seen': f"{path}@0"},
+        ODD_CODE: {'count': 1, 'first_seen': f"{path}@{odd_frame}"},
+    }
+
+
+def test_decode_video_rejects_an_unreadable_file(tmp_path):
+    path = tmp_path / "broken.avi"
+    path.write_bytes(b"not a video")
+    with pytest.raises(ValueError):
+        decode_video(str(path))
+
+
+class CatalogStandIn:
+    """just the get_all_books() that reconcile reads"""
+
+    def __init__(self, available):
+        self.books = pd.DataFrame({'barcode': list(available), 'available_copies': list(available.values())})
+
+    def get_all_books(self):
+        return self.books
+
+
+def test_reconcile_sorts_the_audit_into_missing_unexpected_and_on_loan():
+    db = CatalogStandIn({"1001": 2, "1002": 1, "1003": 0, "1004": 0, "1005": 3})
+    found = {code: {'count': 1, 'first_seen': "shelf.png"} for code in ("1001", "1003", "2001")}
+    assert reconcile(found, db) == {
+        # on the shelf per the catalog, but not seen
+        'missing': ["1002", "1005"],
+        # not in the catalog at all
+        'unexpected': ["2001"],
+        # seen although every copy is out
+        'on_loan': ["1003"],
+    }
+
+
+def test_reconcile_with_nothing_seen_reports_every_stocked_book_missing():
+    db = CatalogStandIn({"1001": 1, "1002": 0})
+    assert reconcile({}, db) == {'missing': ["1001"], 'unexpected': [], 'on_loan': []}
@@ -0,0 +1,116 @@
+import socket
+
+import pytest
+
+from utils.bulk_import import import_isbns, parse_isbns, resolve_metadata
+from utils.database import get_database
+from utils.isbn_lookup import IsbnCache
+
+# the stub treats isbns ending in 0 as unknown, that's 2 of these 25
+ISBNS = [f"978{n:010d}" for n in range(1, 26)]
+MISSES = [i for i in ISBNS if i.endswith("0")]
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return IsbnCache(str(tmp_path / "isbn_cache.db"))
+
+
+@pytest.fixture(params=["csv", "sqlite"])
+def db(request, tmp_path):
+    return get_database(request.param, str(tmp_path / "data"))
+
+
+def _closed_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def test_resolve_metadata_asks_in_bibkeys_batches(openlibrary, cache):
+    meta = resolve_metadata(ISBNS, cache=cache, base_url=openlibrary.url, batch_size=10, workers=2)
+    assert sorted(len(r) for r in openlibrary.requests) == [5, 10, 10]
+    assert sorted(i for r in openlibrary.requests for i in r) == sorted(ISBNS)
+    for isbn in ISBNS:
+        if isbn in MISSES:
+            assert meta[isbn] is None
+        else:
+            assert meta[isbn] == (f"Book {isbn}", f"Author {isbn[-3:]}")
+
+
+def test_progress_is_reported_per_batch(openlibrary, cache):
+    calls = []
+    resolve_metadata(ISBNS, cache=cache, base_url=openlibrary.url, batch_size=10, workers=2,
+                     progress=lambda done, total: calls.append((done, total)))
+    assert calls[0] == (0, 25)
+    assert calls[-1] == (25, 25)
+    assert len(calls) == 1 + 3
+    assert [done for done, _ in calls] == sorted(done for done, _ in calls)
+
+
+def test_hits_and_misses_are_cached(openlibrary, cache):
+    first = resolve_metadata(ISBNS, cache=cache, base_url=openlibrary.url, batch_size=10)
+    asked = len(openlibrary.requests)
+    calls = []
+    again = resolve_metadata(ISBNS, cache=cache, base_url=openlibrary.url, batch_size=10,
+                             progress=lambda done, total: calls.append((done, total)))
+    assert again == first
+    assert len(openlibrary.requests) == asked
+    assert calls == [(25, 25)]
+
+
+def test_books_already_in_the_catalog_are_not_looked_up(openlibrary, cache, db):
+    db.add_book(ISBNS[0], "Shelved Title", "Shelved Author", 1)
+    meta = resolve_metadata(ISBNS[:5], db=db, cache=cache, base_url=openlibrary.url)
+    assert meta[ISBNS[0]] == ("Shelved Title", "Shelved Author")
+    assert ISBNS[0] not in [i for r in openlibrary.requests for i in r]
+
+
+def test_unreachable_server_leaves_isbns_unresolved_and_uncached(cache):
+    meta = resolve_metadata(ISBNS[:5], cache=cache, base_url=f"http://127.0.0.1:{_closed_port()}")
+    assert meta == {isbn: None for isbn in ISBNS[:5]}
+    # a failed request isn't a "not found", the next import asks again
+    assert cache.get(ISBNS[0]) == (None, False)
+
+
+def test_import_isbns_adds_every_book_with_one_write(openlibrary, db):
+    writes = []
+    add_books = db.add_books
+
+    def counting_add_books(rows):
+        writes.append(list(rows))
+        return add_books(rows)
+
+    db.add_books = counting_add_books
+    counts = {isbn: (2 if n % 3 == 0 else 1) for n, isbn in enumerate(ISBNS)}
+    progress = []
+    summary = import_isbns(counts, db=db, base_url=openlibrary.url, batch_size=10,
+                           progress=lambda done, total: progress.append(done))
+
+    assert len(writes) == 1
+    found = [i for i in ISBNS if i not in MISSES]
+    assert summary == {'books': len(found), 'copies': sum(counts[i] for i in found), 'unresolved': MISSES}
+    assert progress[-1] == len(ISBNS)
+    for isbn in found:
+        book = db.get_book(isbn)
+        assert book['title'] == f"Book {isbn}"
+        assert book['author'] == f"Author {isbn[-3:]}"
+        assert int(book['total_copies']) == counts[isbn]
+        assert int(book['available_copies']) == counts[isbn]
+    for isbn in MISSES:
+        assert db.get_book(isbn) is None
+
+
+def test_import_isbns_can_add_unresolved_books(openlibrary, db):
+    summary = import_isbns({isbn: 1 for isbn in ISBNS[:12]}, db=db, base_url=openlibrary.url,
+                           add_unresolved=True)
+    assert summary['books'] == 12
+    assert summary['unresolved'] == [ISBNS[9]]
+    placeholder = db.get_book(ISBNS[9])
+    assert placeholder is not None
+    assert not isinstance(placeholder['title'], str) or placeholder['title'] == ""
+
+
+def test_parse_isbns_sums_repeats_and_skips_headers():
+    lines = ["isbn,copies", "978-0000000001,2", "9780000000001", "", "9780000000002,3", "junk"]
+    assert parse_isbns(lines) == {"9780000000001": 3, "9780000000002": 3}
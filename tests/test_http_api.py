@@ -0,0 +1,44 @@
+import pytest
+
+from utils.database import get_database
+from utils.http_api import HttpError, LibraryApi
+
+BARCODE = "9780000000001"
+
+
+@pytest.fixture
+def api(tmp_path):
+    db = get_database("csv", str(tmp_path / "data"))
+    db.add_book(BARCODE, "Title", "Author", 1)
+    return LibraryApi(db)
+
+
+@pytest.mark.parametrize("path", ["/health", "/metrics", f"/books/{BARCODE}", "/copies/x", "/search", "/users/x"])
+@pytest.mark.parametrize("method", ["POST", "PUT", "DELETE"])
+def test_read_routes_only_answer_get(api, method, path):
+    with pytest.raises(HttpError) as err:
+        api.route(method, path, {}, {})
+    assert err.value.status == 405
+
+
+@pytest.mark.parametrize("path", ["/checkout", "/checkin"])
+def test_write_routes_only_answer_post(api, path):
+    with pytest.raises(HttpError) as err:
+        api.route("GET", path, {}, {})
+    assert err.value.status == 405
+
+
+@pytest.mark.parametrize("loan_days", [True, False, 0, 366, 14.0, "14"])
+def test_checkout_rejects_loan_days_that_are_not_whole_days(api, loan_days):
+    user_id = api.db.add_user("Reader", "reader@example.org")
+    with pytest.raises(HttpError) as err:
+        api.checkout({'user_id': user_id, 'barcodes': [BARCODE], 'loan_days': loan_days})
+    assert err.value.status == 400
+    assert api.db.get_book(BARCODE)['available_copies'] == 1
+
+
+def test_checkout_with_valid_loan_days(api):
+    user_id = api.db.add_user("Reader", "reader@example.org")
+    route, call = api.route("POST", "/checkout", {}, {'user_id': user_id, 'barcodes': [BARCODE], 'loan_days': 7})
+    assert route == "checkout"
+    assert call()['ok']
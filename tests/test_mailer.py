@@ -0,0 +1,119 @@
+import threading
+import time
+from email.message import EmailMessage
+
+from utils.mailer import RateLimiter, SmtpPool
+
+
+def _message(n, to="reader@example.org"):
+    msg = EmailMessage()
+    msg['From'] = "library@example.org"
+    msg['To'] = to
+    msg['Subject'] = f"notice {n}"
+    msg.set_content(f"body {n}")
+    return msg
+
+
+def _pool(server, **kwargs):
+    return SmtpPool("127.0.0.1", server.port, starttls=False, timeout=5, **kwargs)
+
+
+def _subjects(server):
+    return sorted(int(raw.split("Subject: notice ", 1)[1].split("\n", 1)[0]) for _, raw in server.messages)
+
+
+def test_send_many_splits_a_batch_over_the_pool(smtp_server):
+    pool = _pool(smtp_server, size=3)
+    results = pool.send_many([_message(i) for i in range(10)])
+    pool.close()
+    assert results == [True] * 10
+    # every message exactly once, over no more connections than the pool allows
+    assert _subjects(smtp_server) == list(range(10))
+    assert 1 <= smtp_server.connections <= 3
+
+
+def test_connections_are_reused_between_calls(smtp_server):
+    pool = _pool(smtp_server, size=1)
+    assert pool.send_many([_message(i) for i in range(5)]) == [True] * 5
+    assert pool.send(_message(5))
+    assert pool.send(_message(6))
+    assert smtp_server.connections == 1
+    pool.close()
+    assert smtp_server.quits == 1
+
+
+def test_connection_is_recycled_after_max_per_connection(smtp_server):
+    pool = _pool(smtp_server, size=1, max_per_connection=2)
+    assert pool.send_many([_message(i) for i in range(5)]) == [True] * 5
+    pool.close()
+    assert smtp_server.connections == 3
+    # each connection carried at most two messages
+    per_conn = [conn for conn, _ in smtp_server.messages]
+    assert max(per_conn.count(c) for c in set(per_conn)) == 2
+
+
+def test_reconnects_after_the_server_drops_the_connection(smtp_server):
+    smtp_server.hangup_after = 2
+    pool = _pool(smtp_server, size=1)
+    assert pool.send_many([_message(i) for i in range(5)]) == [True] * 5
+    # the message that hit the dead connection was resent on a new one, nothing twice
+    assert _subjects(smtp_server) == list(range(5))
+    assert smtp_server.connections == 3
+    # the pool keeps working on the connection it reopened
+    assert pool.send(_message(5))
+    pool.close()
+
+
+def test_refused_recipient_fails_only_that_message(smtp_server):
+    smtp_server.reject.add("nobody@example.org")
+    pool = _pool(smtp_server, size=1)
+    batch = [_message(0), _message(1, to="nobody@example.org"), _message(2)]
+    assert pool.send_many(batch) == [True, False, True]
+    pool.close()
+    assert _subjects(smtp_server) == [0, 2]
+    assert smtp_server.connections == 1
+
+
+def test_unreachable_server_fails_the_batch(smtp_server):
+    port = smtp_server.port
+    smtp_server.shutdown()
+    smtp_server.server_close()
+    pool = SmtpPool("127.0.0.1", port, starttls=False, size=2, timeout=2)
+    assert pool.send_many([_message(i) for i in range(3)]) == [False, False, False]
+
+
+def test_rate_limit_spaces_out_sends(smtp_server):
+    pool = _pool(smtp_server, size=4, rate_per_second=20)
+    t0 = time.monotonic()
+    assert pool.send_many([_message(i) for i in range(10)]) == [True] * 10
+    elapsed = time.monotonic() - t0
+    pool.close()
+    # 10 sends at 20/s need 9 gaps of 50ms, however many connections share the limit
+    assert elapsed >= 0.4
+
+
+def test_rate_limiter_is_shared_across_threads():
+    limiter = RateLimiter(per_second=50)
+    stamps, lock = [], threading.Lock()
+
+    def worker():
+        for _ in range(5):
+            limiter.wait()
+            with lock:
+                stamps.append(time.monotonic())
+
+    threads = [threading.Thread(target=worker) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    stamps.sort()
+    assert stamps[-1] - stamps[0] >= 19 * 0.02 * 0.9
+
+
+def test_unlimited_rate_limiter_does_not_wait():
+    limiter = RateLimiter(None)
+    t0 = time.monotonic()
+    for _ in range(1000):
+        limiter.wait()
+    assert time.monotonic() - t0 < 0.1
@@ -0,0 +1,66 @@
+import datetime
+
+import pytest
+
+from utils.database import get_database
+from utils.reminders import ReminderScheduler
+
+TODAY = datetime.date(2026, 10, 18)
+
+
+class QueueingNotifier:
+    """keeps what would have gone to the outbox"""
+
+    def __init__(self):
+        self.emails = []
+
+    def queue_emails(self, emails):
+        self.emails.extend(emails)
+        return list(range(len(emails)))
+
+
+@pytest.fixture(params=["csv", "sqlite"])
+def db(request, tmp_path):
+    return get_database(request.param, str(tmp_path / "data"))
+
+
+def _lend(db, barcode, email):
+    db.add_book(barcode, f"Title {barcode}", "Author", 1)
+    user_id = db.add_user("Reader", email)
+    # 14-day loans from 11 days ago are 3 days from due today
+    [result] = db.checkout_books(user_id, [barcode], today=TODAY - datetime.timedelta(days=11))
+    assert result['ok']
+    return result
+
+
+def _sent_rows(scheduler):
+    with open(scheduler.sent_file, encoding="utf-8") as f:
+        return [line.split(",")[0] for line in f.read().splitlines()[1:]]
+
+
+def test_each_reminder_goes_out_once_across_schedulers(db):
+    first = _lend(db, "9780000000001", "one@example.org")
+    second = _lend(db, "9780000000002", "two@example.org")
+    notify = QueueingNotifier()
+    assert ReminderScheduler(db, notify).run_once(TODAY) == 2
+    # a second process (or the admin button) sees the file and sends nothing new
+    assert ReminderScheduler(db, notify).run_once(TODAY) == 0
+    assert sorted(e[0] for e in notify.emails) == ["one@example.org", "two@example.org"]
+    assert sorted(_sent_rows(ReminderScheduler(db, notify))) == sorted([first['checkout_id'], second['checkout_id']])
+
+
+def test_returned_loans_are_pruned_from_the_sent_file(db):
+    first = _lend(db, "9780000000001", "one@example.org")
+    second = _lend(db, "9780000000002", "two@example.org")
+    notify = QueueingNotifier()
+    running = ReminderScheduler(db, notify)
+    assert running.run_once(TODAY) == 2
+    db.check_in_copies([first['copy_id']], today=TODAY)
+
+    fresh = ReminderScheduler(db, notify)
+    assert fresh.run_once(TODAY) == 0
+    assert _sent_rows(fresh) == [second['checkout_id']]
+    assert fresh._sent == {(second['checkout_id'], 'due_soon')}
+    # the scheduler that was already running notices the rewrite and forgets the returned loan too
+    assert running.run_once(TODAY) == 0
+    assert running._sent == {(second['checkout_id'], 'due_soon')}
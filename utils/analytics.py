@@ -0,0 +1,253 @@
+"""
+circulation reports answered from daily rollups in data/analytics/ instead of the raw
+loan history; see README.md for the layout.
+"""
+import datetime
+import json
+import os
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+from utils.cache import shared_cache
+from utils.database import iso_date
+from utils.locking import get_lock
+from utils.metrics import metrics
+
+COUNT_COLUMNS = ['checkouts', 'returns', 'loan_days', 'overdue_returns']
+DAY_COLUMNS = ['day'] + COUNT_COLUMNS
+TITLE_COLUMNS = ['day', 'barcode'] + COUNT_COLUMNS
+
+# today's numbers change with every loan, they're rolled up again at most this often
+TODAY_TTL_SECONDS = 10
+
+
+def _next_day(day):
+    return (datetime.date.fromisoformat(day) + datetime.timedelta(days=1)).isoformat()
+
+
+def rollup(loans, copies, since=None, until=None):
+    """
+    per (day, barcode) counts for a checkouts frame, sorted by day. days before `since`
+    and from `until` on are left out (both iso dates, either can be None)
+    """
+    to_book = copies.drop_duplicates('copy_id').set_index('copy_id')['barcode']
+    loans = loans.assign(barcode=loans['copy_id'].map(to_book).fillna("unknown"))
+
+    def in_range(day):
+        mask = day.notna()
+        if since:
+            mask &= day >= since
+        if until:
+            mask &= day < until
+        return mask
+
+    went = loans[in_range(loans['checkout_date'])]
+    checkouts = went.groupby(['checkout_date', 'barcode']).size().rename('checkouts')
+
+    back = loans[in_range(loans['return_date'])]
+    start = pd.to_datetime(back['checkout_date'], format="%Y-%m-%d", errors='coerce')
+    end = pd.to_datetime(back['return_date'], format="%Y-%m-%d", errors='coerce')
+    back = back.assign(
+        loan_days=(end - start).dt.days.fillna(0).astype(int),
+        overdue_returns=(back['return_date'] > back['due_date']).astype(int),
+    )
+    returns = back.groupby(['return_date', 'barcode']).agg(
+        returns=('copy_id', 'size'), loan_days=('loan_days', 'sum'), overdue_returns=('overdue_returns', 'sum'))
+
+    checkouts.index.names = returns.index.names = ['day', 'barcode']
+    table = pd.concat([checkouts, returns], axis=1).fillna(0).astype(int).reset_index()
+    if table.empty:
+        return pd.DataFrame(columns=TITLE_COLUMNS)
+    return table[TITLE_COLUMNS].sort_values(['day', 'barcode'], kind='stable').reset_index(drop=True)
+
+
+def day_totals(titles):
+    """the per-title rollup summed up per day"""
+    if titles.empty:
+        return pd.DataFrame(columns=DAY_COLUMNS)
+    return titles.groupby('day', sort=True)[COUNT_COLUMNS].sum().reset_index()
+
+
+def _rates(frame):
+    """average loan length and share of late returns, from summed counts"""
+    returns = frame['returns'].replace(0, np.nan)
+    return frame.assign(avg_loan_days=(frame['loan_days'] / returns).round(1),
+                        overdue_rate=(frame['overdue_returns'] / returns).round(3))
+
+
+def _load_rollup(path):
+    return pd.read_csv(path, dtype={'day': str, 'barcode': str})
+
+
+class CirculationAnalytics:
+    """daily rollups of one library's circulation, and the reports built from them"""
+
+    def __init__(self, db, folder=None):
+        self.db = db
+        self.folder = folder or os.path.join(db.data_dir, "analytics")
+        self.days_file = os.path.join(self.folder, "daily.csv")
+        self.titles_file = os.path.join(self.folder, "daily_titles.csv")
+        self.state_file = os.path.join(self.folder, "state.json")
+        os.makedirs(self.folder, exist_ok=True)
+        # several app processes can refresh, only one appends at a time
+        self.lock = get_lock(os.path.join(self.folder, "rollup.lock"))
+        self._today_lock = threading.Lock()
+        self._today = None  # (day, built at, per-title rows)
+
+    # -- keeping the rollups current --
+
+    def refresh(self, today=None):
+        """roll up every finished day since the last refresh, returns how many days that was"""
+        today = (today or datetime.date.today()).isoformat()
+        with self.lock:
+            through = self._state().get('through')
+            if through is not None and _next_day(through) >= today:
+                return 0
+            since = _next_day(through) if through else None
+            with metrics.timer("library_analytics_refresh_seconds"):
+                # the first run reads the whole history once, after that only recent loans
+                loans = self.db.get_checkouts(start=since) if since else self.db.get_all_checkouts()
+                fresh = rollup(loans, self.db._copies_frame(), since=since, until=today)
+                titles = self._titles()
+                if since:
+                    titles = titles[titles['day'] < since]  # a rerun after a crash replaces its days
+                titles = pd.concat([titles, fresh], ignore_index=True) if len(titles) else fresh
+                self._save(self.titles_file, titles)
+                self._save(self.days_file, day_totals(titles))
+                first = since or (fresh['day'].iloc[0] if len(fresh) else today)
+                yesterday = (datetime.date.fromisoformat(today) - datetime.timedelta(days=1)).isoformat()
+                self._save_state({'through': yesterday})
+            days = (datetime.date.fromisoformat(today) - datetime.date.fromisoformat(first)).days
+            metrics.inc("library_analytics_days_rolled_up_total", days)
+            return days
+
+    def rebuild(self):
+        """throw the rollups away and roll up the whole history again (after importing old loans)"""
+        with self.lock:
+            for path in (self.state_file, self.titles_file, self.days_file):
+                if os.path.exists(path):
+                    os.remove(path)
+                shared_cache.invalidate(path)
+            with self._today_lock:
+                self._today = None
+            return self.refresh()
+
+    def _state(self):
+        if not os.path.exists(self.state_file):
+            return {}
+        with open(self.state_file, encoding="utf-8") as f:
+            return json.load(f)
+
+    def _save_state(self, state):
+        tmp = f"{self.state_file}.{os.getpid()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(state, f)
+        os.replace(tmp, self.state_file)
+
+    def _save(self, path, df):
+        tmp = f"{path}.{os.getpid()}.tmp"
+        df.to_csv(tmp, index=False)
+        os.replace(tmp, path)
+        shared_cache.put(path, df)
+
+    def _titles(self):
+        if not os.path.exists(self.titles_file):
+            return pd.DataFrame(columns=TITLE_COLUMNS)
+        return shared_cache.get(self.titles_file, _load_rollup)
+
+    def _days(self):
+        if not os.path.exists(self.days_file):
+            return pd.DataFrame(columns=DAY_COLUMNS)
+        return shared_cache.get(self.days_file, _load_rollup)
+
+    def _today_rows(self, today):
+        """today's per-title counts, from the loans touched today"""
+        with self._today_lock:
+            hit = self._today
+            if hit is not None and hit[0] == today and time.monotonic() - hit[1] < TODAY_TTL_SECONDS:
+                return hit[2]
+        rows = rollup(self.db.get_checkouts(start=today), self.db._copies_frame(), since=today, until=_next_day(today))
+        with self._today_lock:
+            self._today = (today, time.monotonic(), rows)
+        return rows
+
+    def _between(self, table, start, end, today):
+        """rows of a day-sorted rollup (self._days or self._titles) between start and end, today's live numbers included"""
+        start, end = iso_date(start), iso_date(end)
+        self.refresh(datetime.date.fromisoformat(today))
+        frame = table()
+        days = frame['day'].to_numpy(dtype=object)
+        lo = np.searchsorted(days, start, side='left') if start else 0
+        hi = np.searchsorted(days, end, side='right') if end else len(days)
+        part = frame.iloc[lo:hi]
+        if (not start or start <= today) and (not end or end >= today):
+            live = self._today_rows(today)
+            if len(live):
+                live = live if 'barcode' in frame else day_totals(live)
+                part = pd.concat([part, live[frame.columns]], ignore_index=True) if len(part) else live[frame.columns]
+        return part
+
+    # -- reports --
+
+    def daily(self, start=None, end=None, today=None):
+        """one row per day from start to end (quiet days as zeros): checkouts, returns, avg_loan_days, overdue_rate"""
+        today = (today or datetime.date.today()).isoformat()
+        start, end = iso_date(start), iso_date(end)
+        part = self._between(self._days, start, end, today)
+        first = start or (part['day'].iloc[0] if len(part) else today)
+        calendar = pd.date_range(first, end or today, freq="D").strftime("%Y-%m-%d")
+        part = part.groupby('day')[COUNT_COLUMNS].sum().reindex(calendar, fill_value=0)
+        part.index.name = 'day'
+        return _rates(part.reset_index())
+
+    def top_titles(self, start=None, end=None, n=10, today=None):
+        """most borrowed titles in the range: barcode, title, author, checkouts, returns, rates (all titles if n is None)"""
+        today = (today or datetime.date.today()).isoformat()
+        part = self._between(self._titles, start, end, today)
+        per_title = part.groupby('barcode')[COUNT_COLUMNS].sum()
+        per_title = per_title.sort_values('checkouts', ascending=False, kind='stable')
+        if n is not None:
+            per_title = per_title.head(n)
+        books = self.db.get_all_books()[['barcode', 'title', 'author']].drop_duplicates('barcode')
+        out = per_title.reset_index().merge(books, on='barcode', how='left')
+        return _rates(out[['barcode', 'title', 'author'] + COUNT_COLUMNS])
+
+    def top_authors(self, start=None, end=None, n=10, today=None):
+        """authors by checkouts in the range, with how many of their titles went out"""
+        per_title = self.top_titles(start, end, n=None, today=today)
+        per_title = per_title.assign(author=per_title['author'].fillna("unknown"))
+        out = per_title.groupby('author').agg(
+            checkouts=('checkouts', 'sum'), titles=('barcode', 'size'),
+            returns=('returns', 'sum'), loan_days=('loan_days', 'sum'), overdue_returns=('overdue_returns', 'sum'))
+        out = out.sort_values('checkouts', ascending=False, kind='stable')
+        return _rates((out if n is None else out.head(n)).reset_index())
+
+    def summary(self, start=None, end=None, today=None):
+        """range totals, plus the loans open and overdue right now"""
+        day = today or datetime.date.today()
+        totals = self.daily(start, end, today=day)[COUNT_COLUMNS].sum()
+        returns = int(totals['returns'])
+        open_loans = self.db.get_open_loans()
+        return {
+            'checkouts': int(totals['checkouts']),
+            'returns': returns,
+            'avg_loan_days': round(totals['loan_days'] / returns, 1) if returns else None,
+            'overdue_rate': round(totals['overdue_returns'] / returns, 3) if returns else None,
+            'open_loans': len(open_loans),
+            'overdue_now': sum(1 for _, _, due in open_loans.values() if isinstance(due, str) and due < day.isoformat()),
+        }
+
+
+_analytics = {}
+_analytics_lock = threading.Lock()
+
+
+def get_analytics(db):
+    """one CirculationAnalytics per data dir per process, so today's numbers are shared"""
+    with _analytics_lock:
+        if db.data_dir not in _analytics:
+            _analytics[db.data_dir] = CirculationAnalytics(db)
+        return _analytics[db.data_dir]
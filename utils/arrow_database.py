@@ -0,0 +1,233 @@
+"""
+arrow (feather v2) storage engine, LIBRARY_DB_ENGINE=arrow. needs pyarrow; see README.md.
+
+    python -m utils.arrow_database to-arrow|to-csv [DATA_DIR]
+"""
+import os
+
+import numpy as np
+import pandas as pd
+
+try:
+    import pyarrow as pa
+except ImportError as e:  # optional dependency, only this engine needs it
+    raise ImportError("the arrow storage engine needs pyarrow (pip install pyarrow)") from e
+
+from utils.database import Database, DEFAULT_DATA_DIR, CSV_DTYPES, split_copy_ids, table_name
+from utils.metrics import instrumented
+
+AUTHORS = pa.dictionary(pa.int32(), pa.string())
+
+SCHEMAS = {
+    'books': pa.schema([
+        ('barcode', pa.string()),
+        ('title', pa.string()),
+        ('author', AUTHORS),
+        ('total_copies', pa.int32()),
+        ('available_copies', pa.int32()),
+        ('copy_ids', pa.string()),
+    ]),
+    'copies': pa.schema([
+        ('copy_id', pa.string()),
+        ('barcode', pa.string()),
+        ('status', pa.string()),
+    ]),
+    'users': pa.schema([
+        ('user_id', pa.string()),
+        ('name', pa.string()),
+        ('email', pa.string()),
+    ]),
+    'checkouts': pa.schema([
+        ('checkout_id', pa.string()),
+        ('user_id', pa.string()),
+        ('copy_id', pa.string()),
+        ('checkout_date', pa.date32()),
+        ('due_date', pa.date32()),
+        ('return_date', pa.date32()),
+    ]),
+}
+TABLES = list(SCHEMAS)
+
+
+def _string_dtype():
+    """arrow-backed strings with NaN for missing, i.e. what read_csv gives in pandas 3"""
+    for args in ((("pyarrow",), {'na_value': np.nan}), (("pyarrow_numpy",), {})):
+        try:
+            return pd.StringDtype(*args[0], **args[1])
+        except (TypeError, ValueError):
+            continue
+    return None  # old pandas: strings come back as python objects
+
+
+STRING_DTYPE = _string_dtype()
+
+
+def _column(values, name, type_):
+    """one pandas column as an arrow array of the schema type"""
+    present = values.notna()
+    if pa.types.is_dictionary(type_):
+        # categories sorted, so sorting the Categorical sorts alphabetically
+        text = values[present].astype(str)
+        cats = pd.Categorical(text.reindex(values.index), categories=sorted(text.unique()))
+        return pa.array(cats).cast(type_)
+    if pa.types.is_date32(type_):
+        text = values.astype(object).where(present & (values.astype(str) != ""), None)
+        parsed = pd.to_datetime(text, format="%Y-%m-%d", errors="coerce")
+        bad = text.notna() & parsed.isna()
+        if bad.any():
+            raise ValueError(f"{name}: not a yyyy-mm-dd date: {text[bad].iloc[0]!r}")
+        return pa.array(parsed, from_pandas=True).cast(type_)
+    if pa.types.is_integer(type_):
+        return pa.array(pd.to_numeric(values), from_pandas=True).cast(type_)
+    if not pd.api.types.is_string_dtype(values) or not values[present].map(type).eq(str).all():
+        values = values.astype(object).where(present, None).map(lambda v: v if v is None else str(v))
+    return pa.array(values, from_pandas=True, type=type_)
+
+
+def to_arrow(table, df):
+    """DataFrame -> arrow Table with the table's schema (missing columns become nulls)"""
+    schema = SCHEMAS[table]
+    arrays = []
+    for field in schema:
+        values = df[field.name] if field.name in df else pd.Series([None] * len(df), index=df.index)
+        arrays.append(_column(values, f"{table}.{field.name}", field.type))
+    return pa.Table.from_arrays(arrays, schema=schema)
+
+
+def from_arrow(arrow_table):
+    """
+    arrow Table -> DataFrame in the shape the Database code expects. strings and ints
+    are wrapped without copying; dates become iso strings like in the csvs
+    (a cheap cast in arrow, the rest of the code compares dates as text)
+    """
+    for i, field in enumerate(arrow_table.schema):
+        if pa.types.is_date32(field.type):
+            arrow_table = arrow_table.set_column(i, field.name, arrow_table.column(i).cast(pa.string()))
+    mapper = {pa.string(): STRING_DTYPE}.get if STRING_DTYPE is not None else None
+    return arrow_table.to_pandas(types_mapper=mapper)
+
+
+def read_table(path):
+    """memory-maps an arrow ipc file; the frame's buffers point into the mapping"""
+    source = pa.memory_map(path, "r")
+    return from_arrow(pa.ipc.open_file(source).read_all())
+
+
+def write_table(table, df, path):
+    """writes df as an uncompressed arrow ipc file (so it can be mapped back), returns bytes written"""
+    data = to_arrow(table, df)
+    with open(path, "wb") as f:
+        with pa.ipc.new_file(f, data.schema) as writer:
+            writer.write_table(data)
+        f.flush()
+        os.fsync(f.fileno())
+        return f.tell()
+
+
+def _replace(path, write):
+    tmp = f"{path}.{os.getpid()}.tmp"
+    try:
+        write(tmp)
+        os.replace(tmp, path)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+
+def _archive_months(data_dir, ext):
+    """the archived checkout months (archive/checkouts-YYYY-MM<ext>) as paths without the extension"""
+    folder = os.path.join(data_dir, "archive")
+    if not os.path.isdir(folder):
+        return []
+    return sorted(os.path.join(folder, name[:-len(ext)]) for name in os.listdir(folder)
+                  if name.startswith("checkouts-") and name.endswith(ext))
+
+
+def csv_to_arrow(data_dir=None, tables=None, overwrite=True):
+    """
+    writes <table>.arrow next to every <table>.csv, archived checkout months included.
+    copies are split out of books.csv when there's no copies.csv yet, tables with no
+    csv at all start out empty. returns {table: rows}. don't run it while the app is writing.
+    """
+    data_dir = data_dir or DEFAULT_DATA_DIR
+    counts = {}
+    for table in tables or TABLES:
+        target = os.path.join(data_dir, f"{table}.arrow")
+        if os.path.exists(target) and not overwrite:
+            continue
+        source = os.path.join(data_dir, f"{table}.csv")
+        if os.path.exists(source):
+            df = pd.read_csv(source, dtype=CSV_DTYPES[f"{table}.csv"])
+        elif table == 'copies' and os.path.exists(os.path.join(data_dir, "books.csv")):
+            df = split_copy_ids(pd.read_csv(os.path.join(data_dir, "books.csv"), dtype=CSV_DTYPES['books.csv']))
+        else:
+            df = pd.DataFrame(columns=SCHEMAS[table].names)
+        _replace(target, lambda tmp: write_table(table, df, tmp))
+        counts[table] = len(df)
+    if 'checkouts' in (tables or TABLES):
+        for month in _archive_months(data_dir, ".csv"):
+            if os.path.exists(month + ".arrow") and not overwrite:
+                continue
+            df = pd.read_csv(month + ".csv", dtype=CSV_DTYPES['checkouts.csv'])
+            _replace(month + ".arrow", lambda tmp: write_table('checkouts', df, tmp))
+            counts[os.path.relpath(month, data_dir)] = len(df)
+    return counts
+
+
+def arrow_to_csv(data_dir=None, tables=None):
+    """the other way round: <table>.csv from every <table>.arrow, returns {table: rows}"""
+    data_dir = data_dir or DEFAULT_DATA_DIR
+    sources = [os.path.join(data_dir, table) for table in tables or TABLES]
+    if 'checkouts' in (tables or TABLES):
+        sources += _archive_months(data_dir, ".arrow")
+    counts = {}
+    for source in sources:
+        if not os.path.exists(source + ".arrow"):
+            continue
+        df = read_table(source + ".arrow")
+        _replace(source + ".csv", lambda tmp: df.to_csv(tmp, index=False))
+        counts[os.path.relpath(source, data_dir)] = len(df)
+    return counts
+
+
+@instrumented
+class ArrowDatabase(Database):
+    """csv engine logic on arrow files: same journal, same caches, typed memory-mapped tables"""
+
+    engine = "arrow"
+    table_ext = ".arrow"
+
+    def _initialize_files(self):
+        # first start on a csv data dir converts it, a fresh one gets empty tables
+        missing = [t for t in TABLES if not os.path.exists(os.path.join(self.data_dir, f"{t}.arrow"))]
+        if any(not os.path.exists(m + ".arrow") for m in _archive_months(self.data_dir, ".csv")):
+            missing = [t for t in TABLES if t in missing or t == 'checkouts']  # months archived by the csv engine
+        if missing:
+            csv_to_arrow(self.data_dir, tables=missing, overwrite=False)
+
+    def _parse(self, path):
+        return read_table(path)
+
+    def _dump(self, df, path):
+        # path is the temp file next to the target, e.g. books.arrow.<pid>.<thread>.tmp
+        return write_table(table_name(path), df, path)
+
+    def _editable(self, df):
+        # a Categorical only takes values it already has, new authors need a plain column
+        df = df.copy()
+        for col in df.columns:
+            if isinstance(df[col].dtype, pd.CategoricalDtype):
+                df[col] = df[col].astype(object)
+        return df
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="convert the library tables between csv and arrow")
+    parser.add_argument("direction", choices=["to-arrow", "to-csv"])
+    parser.add_argument("data_dir", nargs="?", default=None)
+    args = parser.parse_args()
+    convert = csv_to_arrow if args.direction == "to-arrow" else arrow_to_csv
+    for table, rows in convert(args.data_dir).items():
+        print(f"{table}: {rows} rows")
@@ -1,65 +1,428 @@
+import os
+import threading
+import time
+from contextlib import contextmanager
+
 import cv2
-from pyzbar import pyzbar
 import streamlit as st
 
-class BarcodeScanner:
+# decode on the middle part of the frame, scaled down to this width; pyzbar's cost
+# grows with pixel count and barcodes held up to the camera are near the center anyway
+ROI_FRACTION = 0.6
+DECODE_WIDTH = 640
+# every Nth decode looks at the whole frame, in case the barcode is off-center
+FULL_FRAME_EVERY = 5
+
+# the browser only needs a rough preview; pushing every raw frame is most of the cost
+PREVIEW_FPS = 5
+PREVIEW_WIDTH = 480
+
+SCAN_TIMEOUT_SECONDS = 60
+
+# the camera stays open between scans and is released after this long unused
+CAMERA_IDLE_SECONDS = 120
+
+
+def decode_frame(frame, roi=ROI_FRACTION, width=DECODE_WIDTH, full=False):
+    """
+    barcodes in a BGR (or grayscale) frame as (data, (x, y, w, h)) with the rect in
+    full-frame coordinates. only the center roi is decoded unless full=True
+    """
+    # needs the zbar shared library; the camera session and capture side work without it
+    from pyzbar import pyzbar
+    gray = frame if frame.ndim == 2 else cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+    h, w = gray.shape[:2]
+    x0 = y0 = 0
+    if not full and roi < 1.0:
+        cw, ch = int(w * roi), int(h * roi)
+        x0, y0 = (w - cw) // 2, (h - ch) // 2
+        gray = gray[y0:y0 + ch, x0:x0 + cw]
+    scale = 1.0
+    if gray.shape[1] > width:
+        scale = width / gray.shape[1]
+        gray = cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+
+    found = []
+    for barcode in pyzbar.decode(gray):
+        x, y, bw, bh = barcode.rect
+        rect = (int(x / scale) + x0, int(y / scale) + y0, int(bw / scale), int(bh / scale))
+        found.append((barcode.data.decode("utf-8"), rect))
+    return found
+
+
+class FrameGrabber:
+    """
+    reads frames on a background thread and keeps only the newest one, so the decoder
+    always works on a current frame and never falls behind the camera. frames that
+    arrive while a decode is running are simply skipped.
+    with pace=True (video files) frames are released at the file's own frame rate,
+    so a recording replays like a live camera; lossless=True instead waits for the
+    decoder to take each frame, for going through a recording as fast as possible.
+    """
+
+    def __init__(self, capture, pace=False, lossless=False):
+        self.capture = capture
+        self.pace = pace
+        self.lossless = lossless
+        self._taken = 0
+        self._cond = threading.Condition()
+        self._frame = None
+        self._seq = 0
+        self._running = False
+        self._thread = None
+        self.ended = False
+        self.fps = 0.0
+
+    def start(self):
+        self._running = True
+        self._thread = threading.Thread(target=self._loop, daemon=True, name="barcode-frame-grabber")
+        self._thread.start()
+        return self
+
+    def stop(self):
+        with self._cond:
+            self._running = False
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout=2)
+
+    def _loop(self):
+        interval = 0.0
+        if self.pace:
+            file_fps = self.capture.get(cv2.CAP_PROP_FPS) or 30.0
+            interval = 1.0 / file_fps
+        last = time.monotonic()
+        while self._running:
+            ok, frame = self.capture.read()
+            now = time.monotonic()
+            if not ok:
+                with self._cond:
+                    self.ended = True
+                    self._cond.notify_all()
+                return
+            # smoothed capture rate
+            dt = now - last
+            if dt > 0:
+                self.fps = 0.9 * self.fps + 0.1 * (1.0 / dt) if self.fps else 1.0 / dt
+            with self._cond:
+                if self.lossless:
+                    self._cond.wait_for(lambda: self._taken >= self._seq or not self._running)
+                self._frame = frame
+                self._seq += 1
+                self._cond.notify_all()
+            if interval:
+                time.sleep(max(0.0, interval - (time.monotonic() - now)))
+            last = now
+
+    @property
+    def seq(self):
+        return self._seq
+
+    def next_frame(self, after_seq, timeout=1.0):
+        """(seq, frame) for the newest frame newer than after_seq, or (after_seq, None)"""
+        with self._cond:
+            self._cond.wait_for(lambda: self._seq > after_seq or self.ended, timeout)
+            if self._seq > after_seq:
+                self._taken = self._seq
+                self._cond.notify_all()
+                return self._seq, self._frame
+            return after_seq, None
+
+
+class ScanStats:
+    """counters for one scan; time_to_decode is from the first frame to the result"""
+
     def __init__(self):
-        self.camera = None
+        self.started = time.monotonic()
+        self.first_frame = None
+        self.decoded = 0
+        self.skipped = 0
+        self.decode_seconds = 0.0
+        self.capture_fps = 0.0
+        self.time_to_decode = None
 
-    def scan_barcode(self):
-        """Scan barcode using webcam or manual input"""
+    def as_dict(self):
+        elapsed = time.monotonic() - self.started
+        return {
+            'capture_fps': round(self.capture_fps, 1),
+            'decode_fps': round(self.decoded / elapsed, 1) if elapsed > 0 else 0.0,
+            'frames_decoded': self.decoded,
+            'frames_skipped': self.skipped,
+            'decode_ms': round(1000 * self.decode_seconds / self.decoded, 1) if self.decoded else 0.0,
+            'time_to_decode_ms': round(1000 * self.time_to_decode, 1) if self.time_to_decode is not None else None,
+        }
+
+
+def scan_capture(capture, pace=False, lossless=False, timeout=SCAN_TIMEOUT_SECONDS, on_frame=None, should_stop=None):
+    """
+    run the decode loop on any cv2.VideoCapture-like source until a barcode turns up.
+    returns (barcode or None, ScanStats)
+    """
+    grabber = FrameGrabber(capture, pace=pace, lossless=lossless).start()
+    try:
+        return scan_frames(grabber, timeout=timeout, on_frame=on_frame, should_stop=should_stop)
+    finally:
+        grabber.stop()
+
+
+def scan_frames(grabber, timeout=SCAN_TIMEOUT_SECONDS, on_frame=None, should_stop=None):
+    """
+    decode frames from a running FrameGrabber until a barcode turns up.
+    on_frame(frame, hits) is called after every decode (throttle it yourself).
+    returns (barcode or None, ScanStats)
+    """
+    stats = ScanStats()
+    # an already-running grabber is warm, the next frame is at most one frame interval
+    # away. don't use the current one, it may still show the previous scan's barcode
+    seq = grabber.seq
+    attempts = 0
+    while time.monotonic() - stats.started < timeout:
+        if should_stop is not None and should_stop():
+            break
+        new_seq, frame = grabber.next_frame(seq)
+        if frame is None:
+            if grabber.ended:
+                break
+            continue
+        if stats.first_frame is None:
+            stats.first_frame = time.monotonic()
+        stats.skipped += max(0, new_seq - seq - 1)
+        seq = new_seq
+
+        attempts += 1
+        t0 = time.monotonic()
+        hits = decode_frame(frame, full=(attempts % FULL_FRAME_EVERY == 0))
+        stats.decode_seconds += time.monotonic() - t0
+        stats.decoded += 1
+        stats.capture_fps = grabber.fps
+        if on_frame is not None:
+            on_frame(frame, hits)
+        if hits:
+            stats.time_to_decode = time.monotonic() - stats.first_frame
+            return hits[0][0], stats
+    return None, stats
+
+
+def scan_video_file(path, pace=True, timeout=SCAN_TIMEOUT_SECONDS):
+    """
+    offline mode: replay a recorded video through the same pipeline as the webcam.
+    pace=False decodes every frame as fast as it can instead of in real time
+    """
+    capture = cv2.VideoCapture(path)
+    try:
+        if not capture.isOpened():
+            raise ValueError(f"could not open video file: {path}")
+        return scan_capture(capture, pace=pace, lossless=not pace, timeout=timeout)
+    finally:
+        capture.release()
+
+
+class CameraBusy(RuntimeError):
+    """another session is scanning with the camera right now"""
+
+
+class CameraSession:
+    """
+    keeps the camera open (and its FrameGrabber running) between scans, so a scan
+    starts decoding right away instead of waiting for the camera to warm up.
+    one scan uses it at a time; it's released after idle_timeout seconds without use.
+    opener(source) builds the capture, pass a fake one in tests.
+    """
+
+    def __init__(self, source=0, opener=None, idle_timeout=CAMERA_IDLE_SECONDS):
+        self.source = source
+        self.opener = opener or cv2.VideoCapture
+        self.idle_timeout = idle_timeout
+        self._in_use = threading.Lock()
+        self._state = threading.Lock()
+        self._capture = None
+        self._grabber = None
+        self._last_used = time.monotonic()
+        self._reaper = None
+
+    @property
+    def is_open(self):
+        return self._grabber is not None
+
+    def _open_locked(self):
+        if self._grabber is not None and not self._grabber.ended:
+            return True
+        self._close_locked()
+        capture = self.opener(self.source)
+        if not capture.isOpened():
+            capture.release()
+            return False
+        print(f"DEBUG [camera_session]: opened camera {self.source}")
+        self._capture = capture
+        self._grabber = FrameGrabber(capture).start()
+        if self._reaper is None:
+            self._reaper = threading.Thread(target=self._reap_loop, daemon=True, name="camera-idle-reaper")
+            self._reaper.start()
+        return True
+
+    def _close_locked(self):
+        if self._grabber is not None:
+            self._grabber.stop()
+            self._grabber = None
+        if self._capture is not None:
+            self._capture.release()
+            self._capture = None
+            print(f"DEBUG [camera_session]: released camera {self.source}")
+
+    @contextmanager
+    def use(self, wait=5.0):
+        """
+        with session.use() as grabber: ... -- grabber is None if the camera can't be opened.
+        raises CameraBusy if another scan holds the camera for longer than `wait`
+        """
+        if not self._in_use.acquire(timeout=wait):
+            raise CameraBusy("the camera is being used by another scan")
         try:
-            # Initialize camera
-            self.camera = cv2.VideoCapture(0)
-
-            if not self.camera.isOpened():
-                st.warning("Could not access webcam. Would you like to enter the barcode manually?")
-                manual_barcode = st.text_input("Enter barcode number manually")
-                if manual_barcode and st.button("Submit Barcode"):
-                    return manual_barcode
-                return None
+            with self._state:
+                opened = self._open_locked()
+                grabber = self._grabber if opened else None
+            yield grabber
+        finally:
+            self._last_used = time.monotonic()
+            self._in_use.release()
 
-            # Create placeholder for video feed
-            frame_placeholder = st.empty()
-            stop_button = st.button("Stop Scanner")
+    def close(self):
+        with self._in_use, self._state:
+            self._close_locked()
+
+    def _reap_loop(self):
+        while True:
+            time.sleep(max(1.0, self.idle_timeout / 4))
+            if time.monotonic() - self._last_used < self.idle_timeout or not self.is_open:
+                continue
+            # don't wait on a scan in progress, that counts as use anyway
+            if self._in_use.acquire(blocking=False):
+                try:
+                    with self._state:
+                        if time.monotonic() - self._last_used >= self.idle_timeout:
+                            self._close_locked()
+                finally:
+                    self._in_use.release()
+
+
+_sessions = {}
+_sessions_lock = threading.Lock()
 
-            while not stop_button:
-                ret, frame = self.camera.read()
-                if not ret:
-                    st.error("Failed to capture video frame")
-                    break
 
-                # Convert to grayscale
-                gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+def get_camera_session(source=0, opener=None, idle_timeout=None):
+    """
+    one camera session per source per process, shared by every streamlit session and rerun.
+    opener / idle_timeout only apply when the session is created; left out they mean "whatever
+    it already has", and asking for different ones on an existing session is a ValueError
+    since the device can't be opened twice
+    """
+    with _sessions_lock:
+        session = _sessions.get(source)
+        if session is None:
+            session = _sessions[source] = CameraSession(
+                source, opener=opener, idle_timeout=CAMERA_IDLE_SECONDS if idle_timeout is None else idle_timeout)
+            return session
+        if opener is not None and opener is not session.opener:
+            raise ValueError(f"camera {source!r} already has a session with a different opener")
+        if idle_timeout is not None and idle_timeout != session.idle_timeout:
+            raise ValueError(f"camera {source!r} already has a session with idle_timeout={session.idle_timeout}")
+        return session
 
-                # Detect barcodes
-                barcodes = pyzbar.decode(gray)
 
-                for barcode in barcodes:
-                    # Extract barcode data
-                    barcode_data = barcode.data.decode("utf-8")
+class BarcodeScanner:
+    def __init__(self, source=None, opener=None):
+        # a video file path replays a recording instead of using the webcam
+        source = source if source is not None else os.environ.get("LIBRARY_SCANNER_SOURCE", "0")
+        self.source = int(source) if str(source).isdigit() else source
+        self.opener = opener
+        self.last_stats = None
+
+    @property
+    def camera(self):
+        return get_camera_session(self.source, opener=self.opener)
 
-                    # Draw rectangle around barcode
-                    (x, y, w, h) = barcode.rect
-                    cv2.rectangle(frame, (x, y), (x + w, y + h), (0, 255, 0), 2)
+    def _preview(self, frame_placeholder):
+        last = [0.0]
 
-                    # Clean up and return data
-                    self.camera.release()
-                    return barcode_data
+        def show(frame, hits):
+            now = time.monotonic()
+            if now - last[0] < 1.0 / PREVIEW_FPS and not hits:
+                return
+            last[0] = now
+            frame = frame.copy()
+            h, w = frame.shape[:2]
+            cw, ch = int(w * ROI_FRACTION), int(h * ROI_FRACTION)
+            cv2.rectangle(frame, ((w - cw) // 2, (h - ch) // 2), ((w + cw) // 2, (h + ch) // 2), (255, 255, 255), 1)
+            for _, (x, y, bw, bh) in hits:
+                cv2.rectangle(frame, (x, y), (x + bw, y + bh), (0, 255, 0), 2)
+            if w > PREVIEW_WIDTH:
+                frame = cv2.resize(frame, None, fx=PREVIEW_WIDTH / w, fy=PREVIEW_WIDTH / w, interpolation=cv2.INTER_AREA)
+            frame_placeholder.image(frame, channels="BGR")
+        return show
 
-                # Display frame
-                frame_placeholder.image(frame, channels="BGR")
+    def _manual_entry(self):
+        st.warning("Would you like to enter the barcode manually?")
+        manual_barcode = st.text_input("Enter barcode number manually")
+        if manual_barcode and st.button("Submit Barcode"):
+            return manual_barcode
+        return None
 
-            return None
+    def _run_scan(self, grabber_or_capture, frame_placeholder):
+        preview = self._preview(frame_placeholder)
+        if isinstance(self.source, str):
+            # recordings are replayed from the start every time
+            return scan_capture(grabber_or_capture, pace=True, on_frame=preview)
+        return scan_frames(grabber_or_capture, on_frame=preview)
+
+    def scan_barcode(self):
+        """Scan barcode using webcam or manual input"""
+        try:
+            # Create placeholder for video feed
+            frame_placeholder = st.empty()
+            stop_button = st.button("Stop Scanner")
+            if stop_button:
+                return None
+
+            if isinstance(self.source, str):
+                capture = (self.opener or cv2.VideoCapture)(self.source)
+                try:
+                    if not capture.isOpened():
+                        st.error(f"Could not open recording {self.source}")
+                        return self._manual_entry()
+                    barcode_data, stats = self._run_scan(capture, frame_placeholder)
+                finally:
+                    capture.release()
+            else:
+                # the camera session stays open between scans and reruns
+                with self.camera.use() as grabber:
+                    if grabber is None:
+                        st.error("Could not access webcam.")
+                        return self._manual_entry()
+                    barcode_data, stats = self._run_scan(grabber, frame_placeholder)
+
+            self.last_stats = stats.as_dict()
+            print(f"DEBUG [scan_barcode]: result={barcode_data} stats={self.last_stats}")
+            st.caption(
+                f"scanner: {self.last_stats['capture_fps']} fps captured, "
+                f"{self.last_stats['decode_ms']} ms/decode, "
+                f"time to decode {self.last_stats['time_to_decode_ms']} ms"
+            )
+            if barcode_data is None:
+                st.error("no barcode found before the scanner timed out")
+            return barcode_data
+
+        except CameraBusy:
+            st.error("the camera is busy with another scan, try again in a moment")
+            return self._manual_entry()
 
         except Exception as e:
             st.error(f"Scanner Error: {str(e)}")
-            st.warning("Would you like to enter the barcode manually?")
-            manual_barcode = st.text_input("Enter barcode number manually")
-            if manual_barcode and st.button("Submit Barcode"):
-                return manual_barcode
-            return None
+            return self._manual_entry()
 
-        finally:
-            if self.camera is not None:
-                self.camera.release()
\ No newline at end of file
+
+if __name__ == "__main__":
+    # offline replay: python -m utils.barcode_scanner recording.mp4 [--fast]
+    import sys
+    result, stats = scan_video_file(sys.argv[1], pace="--fast" not in sys.argv)
+    print(f"barcode: {result}")
+    print(stats.as_dict())
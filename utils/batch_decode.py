@@ -0,0 +1,138 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import cv2
+
+from utils.barcode_scanner import decode_frame
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.tif', '.tiff', '.webp')
+
+# shelf photos hold many small barcodes, so decode at (nearly) full resolution
+BATCH_DECODE_WIDTH = 4000
+
+# each worker gets a run of consecutive video frames, so it can seek once and read sequentially
+FRAMES_PER_TASK = 120
+
+
+def _decode_image(path):
+    img = cv2.imread(path, cv2.IMREAD_GRAYSCALE)
+    if img is None:
+        return path, None
+    return path, [data for data, _ in decode_frame(img, full=True, width=BATCH_DECODE_WIDTH)]
+
+
+def _decode_video_range(args):
+    path, start, stop, step = args
+    capture = cv2.VideoCapture(path)
+    found = []
+    try:
+        capture.set(cv2.CAP_PROP_POS_FRAMES, start)
+        for index in range(start, stop):
+            # grab() skips decoding the frames we don't look at. frame numbers are absolute,
+            # so every `step`-th frame of the video is sampled whatever task it falls in
+            if index % step:
+                if not capture.grab():
+                    break
+                continue
+            ok, frame = capture.read()
+            if not ok:
+                break
+            found.extend((data, index) for data, _ in decode_frame(frame, full=True, width=BATCH_DECODE_WIDTH))
+    finally:
+        capture.release()
+    return found
+
+
+def decode_images(directory, workers=None):
+    """
+    {barcode: {'count': n, 'first_seen': path}} for every image in a directory,
+    plus the list of files that couldn't be read
+    """
+    paths = sorted(
+        os.path.join(directory, name) for name in os.listdir(directory)
+        if name.lower().endswith(IMAGE_EXTENSIONS)
+    )
+    found, unreadable = {}, []
+    with ProcessPoolExecutor(workers) as pool:
+        chunk = max(1, len(paths) // ((workers or os.cpu_count() or 1) * 4))
+        for path, barcodes in pool.map(_decode_image, paths, chunksize=chunk):
+            if barcodes is None:
+                unreadable.append(path)
+                continue
+            for data in barcodes:
+                entry = found.setdefault(data, {'count': 0, 'first_seen': path})
+                entry['count'] += 1
+    return found, unreadable
+
+
+def decode_video(path, every=5, workers=None):
+    """
+    {barcode: {'count': n, 'first_seen': 'file@frame'}} from every `every`-th frame of a
+    video, split into frame ranges across the process pool
+    """
+    capture = cv2.VideoCapture(path)
+    total = int(capture.get(cv2.CAP_PROP_FRAME_COUNT))
+    capture.release()
+    if total <= 0:
+        raise ValueError(f"could not read frames from {path}")
+    tasks = [(path, start, min(start + FRAMES_PER_TASK, total), every)
+             for start in range(0, total, FRAMES_PER_TASK)]
+    found = {}
+    with ProcessPoolExecutor(workers) as pool:
+        for hits in pool.map(_decode_video_range, tasks):
+            for data, index in hits:
+                entry = found.setdefault(data, {'count': 0, 'first_seen': f"{path}@{index}"})
+                entry['count'] += 1
+    return found
+
+
+def reconcile(found, db):
+    """
+    compare what the audit saw with the catalog:
+    missing    - books with copies on the shelf that weren't seen
+    unexpected - barcodes that aren't in the catalog at all
+    on_loan    - seen on the shelf although every copy is checked out
+    """
+    books = db.get_all_books()
+    available = dict(zip(books['barcode'].astype(str), books['available_copies'].astype(int)))
+    seen = set(found)
+    return {
+        'missing': sorted(bc for bc, n in available.items() if n > 0 and bc not in seen),
+        'unexpected': sorted(bc for bc in seen if bc not in available),
+        'on_loan': sorted(bc for bc in seen if available.get(bc) == 0),
+    }
+
+
+if __name__ == "__main__":
+    # python -m utils.batch_decode <image dir | video file> [--every N] [--workers N] [--json out.json]
+    import argparse
+    import json
+
+    from utils.database import get_database
+
+    parser = argparse.ArgumentParser(description="decode barcodes from shelf photos or video and audit them against the catalog")
+    parser.add_argument("source", help="directory of images or a video file")
+    parser.add_argument("--every", type=int, default=5, help="decode every Nth video frame")
+    parser.add_argument("--workers", type=int, default=None, help="processes (default: one per core)")
+    parser.add_argument("--data-dir", default=None)
+    parser.add_argument("--engine", default=None)
+    parser.add_argument("--json", default=None, help="write the full report here")
+    args = parser.parse_args()
+
+    unreadable = []
+    if os.path.isdir(args.source):
+        found, unreadable = decode_images(args.source, workers=args.workers)
+    else:
+        found = decode_video(args.source, every=args.every, workers=args.workers)
+    report = reconcile(found, get_database(args.engine, args.data_dir))
+
+    print(f"found {len(found)} distinct barcodes")
+    for key in ('missing', 'unexpected', 'on_loan'):
+        print(f"{key}: {len(report[key])}")
+        for bc in report[key][:50]:
+            print(f"  {bc}")
+    if unreadable:
+        print(f"{len(unreadable)} files could not be read")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({'found': found, 'unreadable': unreadable, **report}, f, indent=2)
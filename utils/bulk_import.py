@@ -0,0 +1,150 @@
+import csv
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from utils.database import get_database
+from utils.isbn_lookup import fetch_open_library, get_isbn_cache, normalize_isbn
+
+# the bibkeys api takes many isbns per call; keep urls a sane length
+LOOKUP_BATCH = 50
+LOOKUP_WORKERS = 4
+
+
+def parse_isbns(lines):
+    """
+    {isbn: copies} from csv lines with isbn[,copies] columns, or one isbn per line.
+    repeated isbns add up
+    """
+    counts = {}
+    for row in csv.reader(lines):
+        if not row or not row[0].strip():
+            continue
+        isbn = normalize_isbn(row[0])
+        if not isbn:
+            continue  # header or junk
+        copies = int(row[1]) if len(row) > 1 and row[1].strip().isdigit() else 1
+        counts[isbn] = counts.get(isbn, 0) + copies
+    return counts
+
+
+def read_isbn_file(path):
+    with open(path, newline="", encoding="utf-8") as f:
+        return parse_isbns(f)
+
+
+def _batches(items, size):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def resolve_metadata(isbns, db=None, cache=None, base_url=None, batch_size=LOOKUP_BATCH,
+                     workers=LOOKUP_WORKERS, progress=None):
+    """
+    {isbn: (title, author) or None}. catalog and isbn cache first, the rest goes to
+    open library in bibkeys batches, `workers` requests at a time.
+    progress(done, total) is called as isbns get resolved
+    """
+    cache = cache or get_isbn_cache()
+    total = len(isbns)
+    results, todo = {}, []
+    for isbn in isbns:
+        book = db.get_book(isbn) if db is not None else None
+        if book and isinstance(book.get('title'), str) and book['title']:
+            results[isbn] = (book['title'], book['author'] if isinstance(book.get('author'), str) else "")
+            continue
+        entry, fresh = cache.get(isbn)
+        if entry is not None and fresh:
+            results[isbn] = (entry[0], entry[1]) if entry[2] else None
+        else:
+            todo.append(isbn)
+
+    done = len(results)
+    lock = threading.Lock()
+    if progress:
+        progress(done, total)
+    if not todo:
+        return results
+
+    import requests  # only needed when something has to go over the network
+    session = requests.Session()
+    try:
+        with ThreadPoolExecutor(workers) as pool:
+            futures = {
+                pool.submit(fetch_open_library, batch, base_url=base_url, session=session): batch
+                for batch in _batches(todo, batch_size)
+            }
+            for fut in as_completed(futures):
+                batch = futures[fut]
+                try:
+                    found = fut.result()
+                    cache.put_many(found)
+                except Exception as e:
+                    # leave the batch unresolved (and uncached), it can be retried later
+                    print(f"DEBUG [bulk_import]: lookup of {len(batch)} isbns failed => {e}")
+                    found = {isbn: None for isbn in batch}
+                with lock:
+                    results.update(found)
+                    done += len(batch)
+                    if progress:
+                        progress(done, total)
+    finally:
+        session.close()
+    return results
+
+
+def import_isbns(counts, db=None, base_url=None, add_unresolved=False, progress=None, **lookup_args):
+    """
+    bulk-add books: counts is {isbn: copies}. metadata is resolved in batches and every
+    book goes into the catalog with one write. isbns nobody knows are skipped unless
+    add_unresolved is set (they get an empty title to fill in later).
+    returns {'books', 'copies', 'unresolved': [isbns]}
+    """
+    db = db or get_database()
+    lookup_args.setdefault('cache', get_isbn_cache(os.path.join(db.data_dir, "isbn_cache.db")))
+    counts = {normalize_isbn(i): int(n) for i, n in counts.items() if normalize_isbn(i)}
+    meta = resolve_metadata(list(counts), db=db, base_url=base_url, progress=progress, **lookup_args)
+
+    rows, unresolved = [], []
+    for isbn, copies in counts.items():
+        found = meta.get(isbn)
+        if found is None:
+            unresolved.append(isbn)
+            if not add_unresolved:
+                continue
+            found = ("", "")
+        rows.append((isbn, found[0], found[1], copies))
+    added = db.add_books(rows)
+    print(f"DEBUG [bulk_import]: added {added} copies of {len(rows)} books, {len(unresolved)} unresolved")
+    return {'books': len(rows), 'copies': added, 'unresolved': unresolved}
+
+
+if __name__ == "__main__":
+    # python -m utils.bulk_import isbns.csv [--data-dir DIR] [--base-url URL] [--add-unresolved]
+    import argparse
+    import sys
+
+    parser = argparse.ArgumentParser(description="bulk-add books from a file of isbns")
+    parser.add_argument("file", help="csv with isbn[,copies] rows, or one isbn per line")
+    parser.add_argument("--data-dir", default=None)
+    parser.add_argument("--engine", default=None, help="csv or sqlite (default: LIBRARY_DB_ENGINE)")
+    parser.add_argument("--base-url", default=None, help="open library base url, e.g. a local stub server")
+    parser.add_argument("--batch-size", type=int, default=LOOKUP_BATCH)
+    parser.add_argument("--workers", type=int, default=LOOKUP_WORKERS)
+    parser.add_argument("--add-unresolved", action="store_true")
+    args = parser.parse_args()
+
+    def report(done, total):
+        sys.stderr.write(f"\rresolved {done}/{total}")
+        sys.stderr.flush()
+
+    db = get_database(args.engine, args.data_dir)
+    summary = import_isbns(
+        read_isbn_file(args.file), db=db, base_url=args.base_url, add_unresolved=args.add_unresolved,
+        progress=report, batch_size=args.batch_size, workers=args.workers,
+    )
+    sys.stderr.write("\n")
+    print(f"added {summary['copies']} copies of {summary['books']} books")
+    if summary['unresolved']:
+        print(f"{len(summary['unresolved'])} isbns not found: {' '.join(summary['unresolved'][:20])}"
+              + (" ..." if len(summary['unresolved']) > 20 else ""))
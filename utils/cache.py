@@ -0,0 +1,76 @@
+import os
+import threading
+
+
+class TableCache:
+    """
+    keeps parsed DataFrames in memory, keyed by file path.
+    an entry is reused until the file's mtime/size or its version counter changes,
+    so repeated get_all_* calls within a rerun don't go back to disk.
+    """
+
+    def __init__(self):
+        self._entries = {}   # path -> (signature, df)
+        self._versions = {}  # path -> int, bumped by invalidate()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _signature(self, path):
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            return None
+        return (st.st_mtime_ns, st.st_size, self._versions.get(path, 0))
+
+    def get(self, path, loader):
+        """return the cached frame for path, calling loader(path) on a miss"""
+        path = os.path.abspath(path)
+        sig = self._signature(path)
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is not None and sig is not None and entry[0] == sig:
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+
+        df = loader(path)
+        with self._lock:
+            # only keep it if nobody touched the file while we were parsing
+            if sig is not None and self._signature(path) == sig:
+                self._entries[path] = (sig, df)
+        return df
+
+    def put(self, path, df):
+        """call right after writing df to path so the next read is a hit"""
+        path = os.path.abspath(path)
+        with self._lock:
+            self._versions[path] = self._versions.get(path, 0) + 1
+            sig = self._signature(path)
+            if sig is None:
+                self._entries.pop(path, None)
+            else:
+                self._entries[path] = (sig, df)
+
+    def invalidate(self, path=None):
+        """drop one entry (or everything) and bump its version"""
+        with self._lock:
+            paths = [os.path.abspath(path)] if path else list(self._entries)
+            for p in paths:
+                self._versions[p] = self._versions.get(p, 0) + 1
+                self._entries.pop(p, None)
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': (self.hits / total) if total else 0.0,
+                'entries': len(self._entries),
+            }
+
+
+# shared by every Database in the process, so the forms handler's
+# Database() sees the same parsed frames as the app's one
+shared_cache = TableCache()
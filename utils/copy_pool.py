@@ -0,0 +1,72 @@
+from collections import deque
+
+COPY_STATUSES = ('available', 'on_loan', 'lost')
+
+
+class CopyPool:
+    """
+    per-book copy status plus a free list of available copies.
+    acquire/release are O(1) amortized; stale free-list entries are skipped lazily.
+    returned copies go to the back of the queue, so loans rotate across copies.
+    """
+
+    __slots__ = ('status', '_free', '_queued', 'available')
+
+    def __init__(self):
+        self.status = {}       # copy_id -> status, in shelf order
+        self._free = deque()
+        self._queued = set()
+        self.available = 0
+
+    def add(self, copy_id, status='available'):
+        self.status[copy_id] = None
+        self.set_status(copy_id, status)
+
+    def set_status(self, copy_id, status):
+        old = self.status.get(copy_id)
+        if old == status:
+            return
+        self.status[copy_id] = status
+        if old == 'available':
+            self.available -= 1
+        if status == 'available':
+            self.available += 1
+            if copy_id not in self._queued:
+                self._queued.add(copy_id)
+                self._free.append(copy_id)
+
+    def peek(self):
+        """the copy acquire() would hand out next, without taking it"""
+        while self._free:
+            copy_id = self._free[0]
+            if self.status.get(copy_id) == 'available':
+                return copy_id
+            self._free.popleft()
+            self._queued.discard(copy_id)
+        return None
+
+    def peek_many(self, n):
+        """up to n copies acquire() would hand out next, in that order, without taking them"""
+        if n <= 0 or self.peek() is None:
+            return []
+        out = []
+        for copy_id in self._free:
+            if self.status.get(copy_id) == 'available':
+                out.append(copy_id)
+                if len(out) == n:
+                    break
+        return out
+
+    def acquire(self):
+        """take a free copy and mark it on loan, or None when every copy is out"""
+        copy_id = self.peek()
+        if copy_id is not None:
+            self.set_status(copy_id, 'on_loan')
+        return copy_id
+
+    def release(self, copy_id):
+        self.set_status(copy_id, 'available')
+
+    @property
+    def total(self):
+        return len(self.status)
@@ -2,18 +2,174 @@ import pandas as pd
 import uuid
 import os
 import datetime
+import json
+import threading
+import time
+import warnings
+from collections import Counter, deque
 
+import numpy as np
+
+from utils.cache import shared_cache
+from utils.journal import get_journal
+from utils.copy_pool import CopyPool, COPY_STATUSES
+from utils.locking import get_lock, retry_on_conflict
+from utils.metrics import metrics, instrumented
+from utils.search_index import SearchIndex
+
+DEFAULT_DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "data")
+
+# explicit dtypes so ids and barcodes stay strings instead of being re-inferred as ints
+CSV_DTYPES = {
+    'books.csv': {'barcode': str, 'title': str, 'author': str, 'copy_ids': str},
+    'users.csv': {'user_id': str, 'name': str, 'email': str},
+    'checkouts.csv': str,
+    'copies.csv': str,
+}
+
+COPY_COLUMNS = ['copy_id', 'barcode', 'status']
+CHECKOUT_COLUMNS = ['checkout_id', 'user_id', 'copy_id', 'checkout_date', 'due_date', 'return_date']
+
+# background compaction folds the journal into checkouts.csv once it gets this big
+COMPACT_INTERVAL_SECONDS = 60
+COMPACT_JOURNAL_BYTES = 256 * 1024
+
+# returned loans stay in checkouts.csv this long; after that compaction moves them to
+# archive/checkouts-YYYY-MM.csv (by return month), which only date-range queries read
+ARCHIVE_AFTER_DAYS = 28
+
+# how many journal events get_events_since can serve from memory
+RECENT_EVENTS_KEPT = 5000
+
+# default loan period for checkouts made at the desk or through the form
+LOAN_DAYS = 14
+
+# optimistic circulation writes retry this many times before giving up
+CONFLICT_RETRIES = 20
+
+# columns the paged admin queries can sort by, and the checkout filters they know
+SORT_KEYS = {
+    'books': ['barcode', 'title', 'author', 'total_copies', 'available_copies'],
+    'users': ['user_id', 'name', 'email'],
+    'checkouts': CHECKOUT_COLUMNS,
+}
+CHECKOUT_STATUSES = ('open', 'overdue', 'returned')
+
+
+def check_page_args(table, sort, status=None):
+    """sort keys and filters come from the ui, so anything else is refused (sqlite puts them in the sql)"""
+    if sort and sort not in SORT_KEYS[table]:
+        raise ValueError(f"can't sort {table} by {sort!r}")
+    if status and status not in CHECKOUT_STATUSES:
+        raise ValueError(f"unknown checkout status filter: {status}")
+
+
+def table_name(path):
+    """books / copies / users / checkouts for a table file, archive months and temp files included"""
+    return os.path.basename(path).split(".")[0].split("-")[0]
+
+
+def archive_cutoff(today=None):
+    """loans returned before this iso date belong in the archive"""
+    return ((today or datetime.date.today()) - datetime.timedelta(days=ARCHIVE_AFTER_DAYS)).isoformat()
+
+
+def iso_date(day):
+    if day is None or day == "":
+        return None
+    return day.strftime("%Y-%m-%d") if isinstance(day, datetime.date) else str(day)
+
+
+def loans_between(frame, start=None, end=None):
+    """rows of a checkouts frame whose loan was out at some point between start and end (inclusive)"""
+    mask = pd.Series(True, index=frame.index)
+    if end:
+        mask &= frame['checkout_date'] <= end
+    if start:
+        mask &= frame['return_date'].isna() | (frame['return_date'] >= start)
+    return frame[mask]
+
+
+def _read_json(path):
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _write_json(path, data):
+    tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=1, sort_keys=True)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+def split_copy_ids(books):
+    """copies table (copy_id, barcode, status) from the comma-joined copy_ids column of books"""
+    copies = books[['barcode', 'copy_ids']].dropna()
+    copies = copies.assign(copy_id=copies['copy_ids'].str.split(',')).explode('copy_id')
+    copies['copy_id'] = copies['copy_id'].str.strip()
+    copies = copies[copies['copy_id'] != '']
+    copies['status'] = 'available'
+    return copies[COPY_COLUMNS]
+
+
+def get_database(engine=None, data_dir=None):
+    """
+    builds a Database for the configured storage engine.
+    engine is "csv" (default), "sqlite" or "arrow"; falls back to the LIBRARY_DB_ENGINE env var.
+    """
+    engine = (engine or os.environ.get("LIBRARY_DB_ENGINE", "csv")).lower()
+    if engine == "csv":
+        return Database(data_dir=data_dir)
+    if engine == "sqlite":
+        from utils.sqlite_database import SqliteDatabase  # import here to avoid circular imports
+        return SqliteDatabase(data_dir=data_dir)
+    if engine == "arrow":
+        from utils.arrow_database import ArrowDatabase  # needs pyarrow
+        return ArrowDatabase(data_dir=data_dir)
+    raise ValueError(f"unknown storage engine: {engine}")
+
+
+@instrumented
 class Database:
-    def __init__(self):
-        base_dir = os.path.dirname(os.path.abspath(__file__))
-        self.books_file = os.path.join(base_dir, "..", "data", "books.csv")
-        self.users_file = os.path.join(base_dir, "..", "data", "users.csv")
-        self.checkouts_file = os.path.join(base_dir, "..", "data", "checkouts.csv")
+    """csv storage engine. every other engine keeps these method signatures."""
+
+    engine = "csv"
+    table_ext = ".csv"  # the arrow engine swaps the table files, everything else is shared
+
+    def __init__(self, data_dir=None, cache=None):
+        self.data_dir = data_dir or DEFAULT_DATA_DIR
+        self.cache = cache or shared_cache
+        self._derived_cache = {}
+        self.books_file = os.path.join(self.data_dir, "books" + self.table_ext)
+        self.users_file = os.path.join(self.data_dir, "users" + self.table_ext)
+        self.checkouts_file = os.path.join(self.data_dir, "checkouts" + self.table_ext)
+        self.copies_file = os.path.join(self.data_dir, "copies" + self.table_ext)
+        self.journal_file = os.path.join(self.data_dir, "checkouts.journal")
+        # closed loans by return month, plus a small manifest of what each month holds
+        self.archive_dir = os.path.join(self.data_dir, "archive")
+        self.archive_manifest = os.path.join(self.archive_dir, "checkouts.json")
 
         # ensure there's a data directory
-        os.makedirs(os.path.join(base_dir, "..", "data"), exist_ok=True)
+        os.makedirs(self.data_dir, exist_ok=True)
         self._initialize_files()
 
+        # catalog (books + copies) and users are read-modify-write, so they're
+        # written under cross-process locks; circulation goes through the journal
+        self.catalog_lock = get_lock(os.path.join(self.data_dir, "catalog.lock"))
+        self.users_lock = get_lock(os.path.join(self.data_dir, "users.lock"))
+
+        # circulation writes go to an append-only journal; checkouts.csv is the compacted base
+        self.journal = get_journal(self.journal_file)
+        self._co_lock = threading.RLock()
+        self._co_base = None
+        self._copies_base = None
+        self._circ_version = 0
+        self._journal_gen = None
+        self._journal_offset = 0
+        _start_compactor(self)
+
     def _initialize_files(self):
         # create empty csvs if needed
         if not os.path.exists(self.books_file):
@@ -25,9 +181,97 @@ class Database:
             pd.DataFrame(columns=['user_id','name','email']).to_csv(self.users_file, index=False)
 
         if not os.path.exists(self.checkouts_file):
-            pd.DataFrame(columns=[
-                'checkout_id','user_id','copy_id','checkout_date','due_date','return_date'
-            ]).to_csv(self.checkouts_file, index=False)
+            pd.DataFrame(columns=CHECKOUT_COLUMNS).to_csv(self.checkouts_file, index=False)
+
+        if not os.path.exists(self.copies_file):
+            # one-time split of the comma-joined copy_ids column into its own table
+            books = pd.read_csv(self.books_file, dtype=CSV_DTYPES['books.csv'])
+            split_copy_ids(books).to_csv(self.copies_file, index=False)
+
+    def _load_table(self, path):
+        name = os.path.basename(path)
+        with metrics.timer("library_file_read_seconds", file=name):
+            df = self._parse(path)
+        metrics.inc("library_file_read_bytes_total", os.path.getsize(path), file=name)
+        metrics.inc("library_file_read_rows_total", len(df), file=name)
+        return df
+
+    def _read(self, path):
+        """
+        parsed frame for one of our csvs, served from the cache while the file is unchanged.
+        the frame is shared with other Database instances, treat it as read-only.
+        """
+        return self.cache.get(path, self._load_table)
+
+    def _parse(self, path):
+        return pd.read_csv(path, dtype=CSV_DTYPES.get(table_name(path) + ".csv"))
+
+    def _editable(self, df):
+        """a copy of a cached frame that rows can be assigned into"""
+        return df.copy()
+
+    def _dump(self, df, path):
+        """serialize df to path and fsync it, returns the bytes written"""
+        with open(path, "w", newline="") as f:
+            df.to_csv(f, index=False)
+            f.flush()
+            os.fsync(f.fileno())
+            return f.tell()
+
+    def _derived(self, name, frame, build):
+        """an index built from frame, rebuilt only when the cached frame object changes"""
+        hit = self._derived_cache.get(name)
+        if hit is not None and hit[0] is frame:
+            return hit[1]
+        value = build(frame)
+        self._derived_cache[name] = (frame, value)
+        return value
+
+    def _book_index(self):
+        """barcode -> row label in the books frame"""
+        books = self._read(self.books_file)
+        return books, self._derived('books_by_barcode', books, lambda df: dict(zip(df['barcode'].tolist(), df.index)))
+
+    def _copy_index(self):
+        """copy_id -> barcode, and barcode -> copy ids in shelf order"""
+        def build(copies):
+            by_book = {}
+            ids, barcodes = copies['copy_id'].tolist(), copies['barcode'].tolist()
+            for cid, bc in zip(ids, barcodes):
+                by_book.setdefault(bc, []).append(cid)
+            return dict(zip(ids, barcodes)), by_book
+        return self._derived('copies', self._read(self.copies_file), build)
+
+    def _user_index(self):
+        """user_id -> row label in the users frame"""
+        users = self._read(self.users_file)
+        # reversed so a duplicated id resolves to its first row, like the old filter did
+        return users, self._derived('users_by_id', users, lambda df: dict(zip(df['user_id'].str.strip().tolist()[::-1], df.index[::-1])))
+
+    def _write(self, path, df, cache=True):
+        # write next to the target and rename, so readers never see a half-written csv
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        name = os.path.basename(path)
+        try:
+            with metrics.timer("library_file_write_seconds", file=name):
+                size = self._dump(df, tmp)
+                os.replace(tmp, path)
+        except Exception:
+            self.cache.invalidate(path)
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+        metrics.inc("library_file_write_bytes_total", size, file=name)
+        metrics.inc("library_file_write_rows_total", len(df), file=name)
+        # keep the frame we just wrote so the next read doesn't re-parse it
+        if cache:
+            self.cache.put(path, df)
+        else:
+            self.cache.invalidate(path)
+
+    def cache_stats(self):
+        """hit/miss counters of the table cache, i.e. how many csv parses we skipped"""
+        return self.cache.stats()
 
     def add_book(self, barcode, title, author, copies):
         """
@@ -35,23 +279,27 @@ class Database:
         increments total_copies + available_copies, merges copy_ids.
         otherwise adds a new row.
         """
+        # under the lock the cache re-validates against the files, so we always
+        # start from what's on disk and can't clobber another writer
+        with self.catalog_lock:
+            self._add_book_locked(barcode, title, author, copies)
+
+    def _add_book_locked(self, barcode, title, author, copies):
         copies = int(copies)
-        books_df = pd.read_csv(self.books_file)
-        books_df['barcode'] = books_df['barcode'].astype(str)
+        books_df, by_barcode = self._book_index()
+        new_ids = [str(uuid.uuid4()) for _ in range(copies)]
 
-        existing = books_df[books_df['barcode'] == str(barcode)]
-        if not existing.empty:
-            idx = existing.index[0]
+        idx = by_barcode.get(str(barcode))
+        if idx is not None:
+            books_df = self._editable(books_df)
             row = books_df.loc[idx]
             cur_total = int(row['total_copies'])
-            cur_avail = int(row['available_copies'])
+            cur_avail = self._available(barcode)
 
             cur_ids = []
             if isinstance(row['copy_ids'], str) and row['copy_ids'].strip():
                 cur_ids = row['copy_ids'].split(',')
 
-            new_ids = [str(uuid.uuid4()) for _ in range(copies)]
-
             # update
             books_df.at[idx,'title'] = title if title else row['title']
             books_df.at[idx,'author'] = author if author else row['author']
@@ -60,7 +308,6 @@ class Database:
             books_df.at[idx,'copy_ids'] = ','.join(cur_ids + new_ids)
         else:
             # brand-new row
-            new_ids = [str(uuid.uuid4()) for _ in range(copies)]
             new_row = pd.DataFrame([{
                 'barcode': str(barcode),
                 'title': title,
@@ -71,171 +318,668 @@ class Database:
             }])
             books_df = pd.concat([books_df, new_row], ignore_index=True)
 
-        books_df.to_csv(self.books_file, index=False)
+        # copies.csv is the source of truth for copies; books.csv keeps the joined
+        # copy_ids column only so older readers of the file keep working
+        copies_df = self._read(self.copies_file)
+        new_copies = pd.DataFrame({'copy_id': new_ids, 'barcode': str(barcode), 'status': 'available'})
+        self._write(self.copies_file, pd.concat([copies_df, new_copies], ignore_index=True))
+        old_books = self._read(self.books_file)
+        self._write(self.books_file, books_df)
+
+        # carry the barcode and search indexes over to the new frame instead of rebuilding them
+        row = books_df.index[-1] if idx is None else idx
+        hit = self._derived_cache.get('books_by_barcode')
+        if hit is not None and hit[0] is old_books:
+            hit[1][str(barcode)] = row
+            self._derived_cache['books_by_barcode'] = (books_df, hit[1])
+        hit = self._derived_cache.get('search_index')
+        if hit is not None and hit[0] is old_books:
+            hit[1].add(str(barcode), books_df.at[row, 'title'], books_df.at[row, 'author'])
+            self._derived_cache['search_index'] = (books_df, hit[1])
+
+    def add_books(self, rows):
+        """
+        add_book for many books at once: rows of (barcode, title, author, copies),
+        committed with a single write of books.csv and copies.csv.
+        repeated barcodes are merged. returns the number of copies added
+        """
+        merged = {}
+        for barcode, title, author, copies in rows:
+            barcode = str(barcode)
+            prev = merged.get(barcode, ("", "", 0))
+            merged[barcode] = (title or prev[0], author or prev[1], prev[2] + int(copies))
+        if not merged:
+            return 0
+
+        with self.catalog_lock:
+            books_df, by_barcode = self._book_index()
+            books_df = self._editable(books_df)
+            new_books, new_copies = [], []
+            for barcode, (title, author, copies) in merged.items():
+                new_ids = [str(uuid.uuid4()) for _ in range(copies)]
+                new_copies.extend(new_ids)
+                idx = by_barcode.get(barcode)
+                if idx is None:
+                    new_books.append({
+                        'barcode': barcode,
+                        'title': title,
+                        'author': author,
+                        'total_copies': copies,
+                        'available_copies': copies,
+                        'copy_ids': ','.join(new_ids),
+                    })
+                    continue
+                row = books_df.loc[idx]
+                cur_ids = row['copy_ids'].split(',') if isinstance(row['copy_ids'], str) and row['copy_ids'].strip() else []
+                books_df.at[idx, 'title'] = title if title else row['title']
+                books_df.at[idx, 'author'] = author if author else row['author']
+                books_df.at[idx, 'total_copies'] = int(row['total_copies']) + copies
+                books_df.at[idx, 'available_copies'] = self._available(barcode) + copies
+                books_df.at[idx, 'copy_ids'] = ','.join(cur_ids + new_ids)
+
+            barcodes = [bc for bc, (_, _, n) in merged.items() for _ in range(n)]
+            copies_df = pd.concat([
+                self._read(self.copies_file),
+                pd.DataFrame({'copy_id': new_copies, 'barcode': barcodes, 'status': 'available'}),
+            ], ignore_index=True)
+            if new_books:
+                books_df = pd.concat([books_df, pd.DataFrame(new_books)], ignore_index=True)
+            self._write(self.copies_file, copies_df)
+            self._write(self.books_file, books_df)
+        return len(new_copies)
 
     def checkout_copy(self, barcode):
         """
-        tries to find a book with the given barcode, and if there's at least 1 available copy,
-        decrement the availability by 1, and return the chosen copy_id. else return None.
+        deprecated, use checkout_books: this only marks a free copy on loan and returns its
+        copy_id (None if there's none). the loan itself is a separate record_checkout, and a
+        caller that never records it leaves the copy on loan with no loan attached
         """
-        books_df = pd.read_csv(self.books_file)
-        books_df['barcode'] = books_df['barcode'].astype(str)
+        warnings.warn("checkout_copy is deprecated, use checkout_books", DeprecationWarning, stacklevel=2)
+        # optimistic: pick a copy from our view of the journal, then append only if
+        # nobody else wrote in between (compare-and-swap on the journal position)
+        for attempt in range(CONFLICT_RETRIES):
+            with self._co_lock:
+                self._sync_journal()
+                version = (self._journal_gen, self._journal_offset)
+                pool = self._pools.get(str(barcode))
+                chosen_id = pool.peek() if pool else None
+            if chosen_id is None:
+                return None
+            if self.journal.append_if(version, [{'op': 'status', 'copy_id': chosen_id, 'status': 'on_loan'}]):
+                return chosen_id
+            retry_on_conflict(attempt, CONFLICT_RETRIES, "checkout_copy")
+
+    def set_copy_status(self, copy_id, status):
+        """mark a copy available / on_loan / lost. returns False for unknown copies"""
+        if status not in COPY_STATUSES:
+            raise ValueError(f"unknown copy status: {status}")
+        if self.get_copy(copy_id) is None:
+            return False
+        self.journal.append({'op': 'status', 'copy_id': copy_id, 'status': status})
+        return True
 
-        match = books_df[books_df['barcode'] == str(barcode)]
-        if match.empty:
+    def get_book(self, barcode):
+        df, by_barcode = self._book_index()
+        idx = by_barcode.get(str(barcode))
+        if idx is None:
             return None
-        idx = match.index[0]
-        row = books_df.loc[idx]
-
-        av = int(row['available_copies'])
-        if av < 1:
+        book = df.loc[idx].to_dict()
+        book['available_copies'] = self._available(barcode)
+        return book
+
+    def get_copy_ids(self, barcode):
+        """copy ids of a book in shelf order"""
+        _, by_book = self._copy_index()
+        return list(by_book.get(str(barcode), []))
+
+    def get_copy(self, copy_id):
+        """copy record (copy_id, barcode, status) or None; on-loan status comes from open checkouts"""
+        to_book, _ = self._copy_index()
+        barcode = to_book.get(copy_id)
+        if barcode is None:
             return None
-
-        # parse copy_ids
-        copy_ids = row['copy_ids'].split(',') if row['copy_ids'].strip() else []
-        if not copy_ids:
-            return None  # no copy ids left?
-
-        chosen_id = copy_ids[0]  # naive approach: pick first
-        # decrement available
-        books_df.at[idx, 'available_copies'] = av - 1
-        books_df.to_csv(self.books_file, index=False)
-        return chosen_id
-
-    def get_book(self, barcode):
-        df = pd.read_csv(self.books_file)
-        df['barcode'] = df['barcode'].astype(str)
-        row = df[df['barcode'] == str(barcode)]
-        if row.empty:
+        with self._co_lock:
+            self._sync_journal()
+            pool = self._pools.get(barcode)
+            status = pool.status.get(copy_id) if pool else None
+        return {'copy_id': copy_id, 'barcode': barcode, 'status': status or 'available'}
+
+    def find_book_by_copy(self, copy_id):
+        """book record owning this copy id, O(1) through the copy index"""
+        to_book, _ = self._copy_index()
+        barcode = to_book.get(copy_id)
+        if barcode is None:
             return None
-        return row.to_dict('records')[0]
+        return self.get_book(barcode)
 
-    def search_books(self, term):
-        df = pd.read_csv(self.books_file)
-        return df[
-            df['title'].str.contains(term, case=False, na=False) |
-            df['author'].str.contains(term, case=False, na=False)
-        ]
+    def search_books(self, term, limit=50):
+        """
+        title/author search through the inverted index: prefix matches and small typos
+        are found too, results come back best match first (at most `limit` rows)
+        """
+        hits = self._search_index().search(term, limit)
+        return self._books_by_barcode([doc_id for doc_id, _ in hits])
+
+    def _search_index(self):
+        books = self._read(self.books_file)
+        return self._derived('search_index', books, lambda df: SearchIndex.from_records(
+            zip(df['barcode'].tolist(), df['title'].tolist(), df['author'].tolist())
+        ))
+
+    def _books_by_barcode(self, barcodes):
+        """book rows for these barcodes, in the given order"""
+        books, by_barcode = self._book_index()
+        rows = [by_barcode[b] for b in barcodes if b in by_barcode]
+        out = books.loc[rows].reset_index(drop=True)
+        with self._co_lock:
+            self._sync_journal()
+            out['available_copies'] = [
+                self._pools[b].available if b in self._pools else 0 for b in out['barcode']
+            ]
+        return out
 
     def add_user(self, name, email):
-        users_df = pd.read_csv(self.users_file)
         user_id = str(uuid.uuid4())[:8]
         new_row = pd.DataFrame([{
             'user_id': user_id,
             'name': name,
             'email': email
         }])
-        users_df = pd.concat([users_df, new_row], ignore_index=True)
-        users_df.to_csv(self.users_file, index=False)
+        with self.users_lock:
+            users_df = self._read(self.users_file)
+            users_df = pd.concat([users_df, new_row], ignore_index=True)
+            self._write(self.users_file, users_df)
         return user_id
 
+    def get_user(self, user_id):
+        users_df, by_id = self._user_index()
+        idx = by_id.get(str(user_id).strip())
+        if idx is None:
+            return None
+        return users_df.loc[idx].to_dict()
+
+    def get_user_by_email(self, email):
+        users_df = self._read(self.users_file)
+        match = users_df[users_df['email'].str.lower().str.strip() == email.lower().strip()]
+        if match.empty:
+            return None
+        return match.to_dict('records')[0]
+
+    # callers get their own copy so they can't corrupt the cached frames
     def get_all_books(self):
-        return pd.read_csv(self.books_file)
+        return self._books_frame().copy()
 
     def get_all_users(self):
-        return pd.read_csv(self.users_file)
+        return self._read(self.users_file).copy()
 
     def get_all_checkouts(self):
-        return pd.read_csv(self.checkouts_file)
+        """the whole loan history: reads every archived month, prefer get_checkouts with a range"""
+        return self.get_checkouts()
+
+    def get_checkouts(self, start=None, end=None):
+        """
+        loans that were out at some point between start and end (iso strings or dates,
+        inclusive, either can be left open). open and recently returned loans come from
+        memory; archived months are only read when the range reaches back into them
+        """
+        start, end = iso_date(start), iso_date(end)
+        frame = self._checkouts_frame()
+        paths = self._archive_paths(start, end)
+        if paths:
+            # a crash mid-compaction can leave a loan in both, the hot copy wins
+            parts = [self._load_table(p) for p in paths]
+            frame = pd.concat(parts + [frame], ignore_index=True).drop_duplicates('checkout_id', keep='last')
+        return loans_between(frame, start, end).reset_index(drop=True)
+
+    # paged reads for the admin tables: (page frame, total matching rows).
+    # only the requested rows are copied out of the cached frames
+    def get_books_page(self, offset=0, limit=50, sort=None, descending=False):
+        return self._page('books', self._books_frame(), offset, limit, sort, descending)
+
+    def get_users_page(self, offset=0, limit=50, sort=None, descending=False):
+        return self._page('users', self._users_frame(), offset, limit, sort, descending)
+
+    def get_checkouts_page(self, offset=0, limit=50, sort=None, descending=False, status=None, user_id=None, today=None,
+                           start=None, end=None):
+        """
+        status is None (everything), 'open', 'overdue' or 'returned'; user_id narrows to one borrower.
+        without start/end only open loans and ones returned in the last ARCHIVE_AFTER_DAYS are paged,
+        with a range it's the loans out between start and end, archived months included
+        """
+        check_page_args('checkouts', sort, status)
+        ranged = start is not None or end is not None
+        frame = self.get_checkouts(start, end) if ranged else self._checkouts_frame()
+        mask = None
+        if status:
+            open_ = frame['return_date'].isna()
+            if status == 'overdue':
+                open_ &= frame['due_date'] < (today or datetime.date.today()).isoformat()
+            mask = ~open_ if status == 'returned' else open_
+        if user_id:
+            by_user = frame['user_id'].str.strip() == str(user_id).strip()
+            mask = by_user if mask is None else mask & by_user
+        if mask is None:
+            return self._page('checkouts', frame, offset, limit, sort, descending, cached=not ranged)
+        return self._page('checkouts', frame[mask], offset, limit, sort, descending, cached=False)
+
+    def _page(self, table, frame, offset, limit, sort, descending, cached=True):
+        check_page_args(table, sort)
+        offset, limit = max(0, int(offset)), max(0, int(limit))
+        if not sort:
+            return frame.iloc[offset:offset + limit].reset_index(drop=True), len(frame)
+
+        def build(df):
+            col = df[sort].reset_index(drop=True)
+            if not descending:
+                return col.sort_values(kind='stable', na_position='last').index.to_numpy()
+            # reversed, so ties come newest first and blanks still go last
+            return col.sort_values(kind='stable', na_position='first').index.to_numpy()[::-1]
+        # the sort order is kept per (table, column, direction) until the frame changes
+        order = self._derived(f"order:{table}:{sort}:{descending}", frame, build) if cached else build(frame)
+        return frame.iloc[order[offset:offset + limit]].reset_index(drop=True), len(frame)
+
+    # internal read-only views, other engines override these
+    def _books_frame(self):
+        """books with available_copies derived from the copy pools, not the stored snapshot"""
+        books = self._read(self.books_file)
+        with self._co_lock:
+            self._sync_journal()
+            hit = self._derived_cache.get('books_view')
+            if hit is not None and hit[0] is books and hit[1] == self._circ_version:
+                return hit[2]
+            avail = {bc: pool.available for bc, pool in self._pools.items()}
+            view = books.assign(available_copies=books['barcode'].map(avail).fillna(0).astype(int))
+            self._derived_cache['books_view'] = (books, self._circ_version, view)
+            return view
+
+    def _available(self, barcode):
+        """number of free copies of one book, straight from its pool"""
+        with self._co_lock:
+            self._sync_journal()
+            pool = self._pools.get(str(barcode))
+            return pool.available if pool else 0
+
+    def _users_frame(self):
+        return self._read(self.users_file)
+
+    def _sync_journal(self):
+        """
+        catch up with journal events we haven't seen yet (only the new tail is read).
+        events are applied idempotently, so overlapping a compaction is harmless.
+        call with self._co_lock held.
+        """
+        gen, events, offset, reset = self.journal.read_since(self._journal_gen, self._journal_offset)
+        base = self._read(self.checkouts_file)
+        copies = self._read(self.copies_file)
+        if reset or base is not self._co_base or copies is not self._copies_base:
+            if not reset:
+                # base tables changed underneath us, replay the whole generation
+                gen, events, offset, _ = self.journal.read_since(None, 0)
+            self._co_base = base
+            self._co_frame = base
+            self._co_pending = []
+            self._co_ids = set(base['checkout_id'].tolist())
+            open_rows = base[base['return_date'].isna()]
+            # .tolist() first: stepping through arrow-backed columns one cell at a time is slow
+            open_cols = {c: open_rows[c].tolist() for c in ('checkout_id', 'user_id', 'copy_id', 'due_date')}
+            self._open_loans = dict(zip(open_cols['copy_id'], open_cols['checkout_id']))
+            # checkout_id -> (user_id, copy_id, due_date) for every open loan
+            self._loan_info = dict(zip(open_cols['checkout_id'],
+                                       zip(open_cols['user_id'], open_cols['copy_id'], open_cols['due_date'])))
+            self._recent_events = deque(maxlen=RECENT_EVENTS_KEPT)
+            # everything after _events_floor is in _recent_events
+            self._events_floor = self._events_latest = self.journal.start_seq()
+
+            # copies.csv holds statuses as of the last compaction, open loans are on top of that
+            self._copies_base = copies
+            self._pools = {}
+            for cid, bc, status in zip(copies['copy_id'].tolist(), copies['barcode'].tolist(), copies['status'].tolist()):
+                if cid in self._open_loans and status != 'lost':
+                    status = 'on_loan'
+                pool = self._pools.get(bc)
+                if pool is None:
+                    pool = self._pools[bc] = CopyPool()
+                pool.add(cid, status if status in COPY_STATUSES else 'available')
+            self._circ_version += 1
+        self._journal_gen, self._journal_offset = gen, offset
+
+        if not events:
+            return
+        to_book, _ = self._copy_index()
+        for e in events:
+            pool = self._pools.get(to_book.get(e['copy_id']))
+            self._events_latest = max(self._events_latest, e['seq'])
+            if e['op'] == 'checkout':
+                self._remember_event((e['seq'], e['user_id'], e['copy_id'], 'checkout', e['checkout_date']))
+                if pool is not None and pool.status.get(e['copy_id']) != 'lost':
+                    pool.set_status(e['copy_id'], 'on_loan')
+                if e['checkout_id'] in self._co_ids:
+                    continue
+                self._co_ids.add(e['checkout_id'])
+                self._open_loans[e['copy_id']] = e['checkout_id']
+                self._loan_info[e['checkout_id']] = (e['user_id'], e['copy_id'], e['due_date'])
+                self._co_pending.append(e)
+            elif e['op'] == 'checkin':
+                info = self._loan_info.pop(e['checkout_id'], None)
+                self._remember_event((e['seq'], e.get('user_id') or (info and info[0]), e['copy_id'], 'checkin', e['return_date']))
+                if pool is not None:
+                    pool.release(e['copy_id'])
+                if self._open_loans.get(e['copy_id']) == e['checkout_id']:
+                    del self._open_loans[e['copy_id']]
+                self._co_pending.append(e)
+            elif e['op'] == 'status':
+                if pool is not None:
+                    pool.set_status(e['copy_id'], e['status'])
+        self._circ_version += 1
+
+    def _remember_event(self, event):
+        # keep the feed window bounded; anything older than the floor needs a full reload
+        if len(self._recent_events) == self._recent_events.maxlen:
+            self._events_floor = self._recent_events[0][0]
+        self._recent_events.append(event)
+
+    def _checkouts_frame(self):
+        """checkouts table = compacted base + journal, rebuilt lazily when something changed"""
+        with self._co_lock:
+            self._sync_journal()
+            if self._co_pending:
+                rows = [e for e in self._co_pending if e['op'] == 'checkout']
+                returns = {e['checkout_id']: e['return_date'] for e in self._co_pending if e['op'] == 'checkin'}
+                frame = self._co_frame
+                if rows:
+                    new_rows = pd.DataFrame(rows, columns=CHECKOUT_COLUMNS)
+                    frame = pd.concat([frame, new_rows], ignore_index=True)
+                else:
+                    frame = frame.copy()  # never mutate the cached base
+                if returns:
+                    mask = frame['checkout_id'].isin(returns.keys())
+                    frame.loc[mask, 'return_date'] = frame.loc[mask, 'checkout_id'].map(returns)
+                self._co_frame = frame
+                self._co_pending = []
+            return self._co_frame
+
+    def _archive_file(self, month):
+        return os.path.join(self.archive_dir, f"checkouts-{month}{self.table_ext}")
+
+    def _archive_months(self):
+        """{month: {'rows', 'first_checkout', 'last_return'}} per archive file, treat it as read-only"""
+        if not os.path.exists(self.archive_manifest):
+            return {}
+        return self.cache.get(self.archive_manifest, _read_json)
+
+    def _archive_paths(self, start=None, end=None):
+        """archive files that can hold a loan out between start and end"""
+        paths = []
+        for month, info in sorted(self._archive_months().items()):
+            if start and info['last_return'] < start:
+                continue  # all back before the range
+            if end and info['first_checkout'] > end:
+                continue  # all went out after it
+            paths.append(self._archive_file(month))
+        return paths
+
+    def _archive_closed_loans(self, frame, today=None):
+        """
+        moves loans returned before archive_cutoff() from frame into their month's archive
+        file and returns the rows that stay hot. call with the journal and catalog locks held
+        """
+        returned = frame['return_date']
+        old = returned.notna() & (returned < archive_cutoff(today))
+        if not old.any():
+            return frame
+        closed = frame[old]
+        months = dict(self._archive_months())
+        os.makedirs(self.archive_dir, exist_ok=True)
+        for month, rows in closed.groupby(closed['return_date'].str[:7]):
+            path = self._archive_file(month)
+            if os.path.exists(path):
+                # usually just the month that's still filling up; a rerun after a crash
+                # may bring rows that already made it in, so keep each loan once
+                rows = pd.concat([self._load_table(path), rows], ignore_index=True).drop_duplicates('checkout_id', keep='last')
+            # archived months aren't kept in the table cache, they're rarely read
+            self._write(path, rows.reset_index(drop=True), cache=False)
+            checkout_dates = rows['checkout_date'].dropna()
+            months[month] = {
+                'rows': len(rows),
+                'first_checkout': str(checkout_dates.min()) if len(checkout_dates) else "",
+                'last_return': str(rows['return_date'].max()),
+            }
+        # archive files first, then the manifest, then the hot file: a crash in between
+        # leaves loans in both places (reads de-duplicate), never in neither
+        _write_json(self.archive_manifest, months)
+        self.cache.put(self.archive_manifest, months)
+        metrics.inc("library_checkouts_archived_total", int(old.sum()))
+        return frame[~old].reset_index(drop=True)
+
+    def compact_journal(self):
+        """
+        fold the journal into checkouts.csv and start a new journal generation.
+        long-closed loans move to the monthly archive on the way, so the hot file stays small
+        """
+        with self.journal.lock, self.catalog_lock:
+            self.journal.sync()
+            frame = self._checkouts_frame()
+            with self._co_lock:
+                statuses = {cid: st for pool in self._pools.values() for cid, st in pool.status.items()}
+                copies = self._copies_base.assign(status=self._copies_base['copy_id'].map(statuses).fillna('available'))
+                books = self._books_frame()
+            self._write(self.checkouts_file, self._archive_closed_loans(frame))
+            self._write(self.copies_file, copies)
+            # refresh the stored available_copies snapshot while we're at it
+            self._write(self.books_file, books)
+            self.journal.rotate()
 
     def record_checkout(self, checkout_id, user_id, copy_id, date_str, due_str):
-        df = pd.read_csv(self.checkouts_file)
-        new_entry = {
+        # O(1): one appended journal line, no matter how long the loan history is
+        self.journal.append({
+            'op': 'checkout',
             'checkout_id': checkout_id,
-            'user_id': user_id,
+            'user_id': str(user_id),
             'copy_id': copy_id,
             'checkout_date': date_str,
             'due_date': due_str,
-            'return_date': None
-        }
-        df = pd.concat([df, pd.DataFrame([new_entry])], ignore_index=True)
-        df.to_csv(self.checkouts_file, index=False)
+        })
 
     def check_in_copy(self, copy_id):
         """
-        find an open checkout for this copy_id => set return_date => increment available_copies
+        find an open checkout for this copy_id => set return_date => copy becomes available
         returns True if success, False if not found or already returned
         """
-        checkouts_df = pd.read_csv(self.checkouts_file)
-        open_checkout = checkouts_df[
-            (checkouts_df['copy_id'] == copy_id) & (checkouts_df['return_date'].isna())
-        ]
-        if open_checkout.empty:
-            return False
-
-        # mark it returned
-        idx = open_checkout.index[0]
-        checkouts_df.at[idx, 'return_date'] = datetime.datetime.now().strftime("%Y-%m-%d")
-        checkouts_df.to_csv(self.checkouts_file, index=False)
-
-        # increment availability
-        books_df = pd.read_csv(self.books_file)
-        rowmatch = books_df[books_df['copy_ids'].str.contains(copy_id, na=False)]
-        if rowmatch.empty:
-            return True  # no book found, can't do anything else
-        row_idx = rowmatch.index[0]
-        av = int(books_df.loc[row_idx, 'available_copies'])
-        books_df.at[row_idx, 'available_copies'] = av + 1
-        books_df.to_csv(self.books_file, index=False)
+        # same compare-and-swap as checkout_copy, so two desks can't both close the same loan
+        for attempt in range(CONFLICT_RETRIES):
+            with self._co_lock:
+                self._sync_journal()
+                version = (self._journal_gen, self._journal_offset)
+                checkout_id = self._open_loans.get(copy_id)
+                user_id = self._loan_info.get(checkout_id, (None,))[0]
+            if checkout_id is None:
+                return False
+
+            # mark it returned
+            if self.journal.append_if(version, [{
+                'op': 'checkin',
+                'checkout_id': checkout_id,
+                'user_id': user_id,
+                'copy_id': copy_id,
+                'return_date': datetime.datetime.now().strftime("%Y-%m-%d"),
+            }]):
+                break
+            retry_on_conflict(attempt, CONFLICT_RETRIES, "check_in_copy")
+        # the copy goes back to its book's free pool when the event is applied
         return True
 
+    def checkout_books(self, user_id, barcodes, loan_days=LOAN_DAYS, today=None):
+        """
+        checks out a stack of books for one borrower. every barcode is checked against the
+        same snapshot of the copy pools, and all the loans go into the journal in one
+        compare-and-swap append: the batch lands as a whole or is re-validated and retried.
+        the same barcode twice means two copies. returns one result per barcode, in order:
+        {'barcode', 'ok', 'title', 'copy_id', 'checkout_id', 'due_date', 'error'}
+        """
+        barcodes = [str(b).strip() for b in barcodes]
+        today = today or datetime.date.today()
+        date_str, due_str = today.isoformat(), (today + datetime.timedelta(days=loan_days)).isoformat()
+        known_user = self.get_user(user_id) is not None
+        for attempt in range(CONFLICT_RETRIES):
+            with self._co_lock:
+                self._sync_journal()
+                version = (self._journal_gen, self._journal_offset)
+                free = {bc: self._pools[bc].peek_many(n) for bc, n in Counter(barcodes).items() if bc in self._pools}
+            results, events = [], []
+            for barcode in barcodes:
+                result = {'barcode': barcode, 'ok': False, 'title': None, 'copy_id': None,
+                          'checkout_id': None, 'due_date': None, 'error': None}
+                results.append(result)
+                title = self._title(barcode)
+                result['title'] = title
+                if not known_user:
+                    result['error'] = "unknown user id"
+                elif not barcode:
+                    result['error'] = "no barcode"
+                elif title is None:
+                    result['error'] = "that book isn't in the db"
+                elif not free.get(barcode):
+                    result['error'] = "no copies available"
+                else:
+                    copy_id = free[barcode].pop(0)
+                    result.update(ok=True, copy_id=copy_id, checkout_id=str(uuid.uuid4())[:8], due_date=due_str)
+                    events.append({'op': 'checkout', 'checkout_id': result['checkout_id'], 'user_id': str(user_id),
+                                   'copy_id': copy_id, 'checkout_date': date_str, 'due_date': due_str})
+            if not events or self.journal.append_if(version, events):
+                return results
+            retry_on_conflict(attempt, CONFLICT_RETRIES, "checkout_books")
+
+    def _title(self, barcode):
+        """title of a catalogued book ("" if it has none), None if the barcode isn't in the catalog"""
+        books, by_barcode = self._book_index()
+        idx = by_barcode.get(barcode)
+        if idx is None:
+            return None
+        title = books.at[idx, 'title']
+        return title if isinstance(title, str) else ""
+
+    def check_in_copies(self, copy_ids, today=None):
+        """
+        returns a stack of copies in one journal append, validated against one snapshot like
+        checkout_books. one result per copy id, in order:
+        {'copy_id', 'ok', 'title', 'checkout_id', 'user_id', 'error'}
+        """
+        copy_ids = [str(c).strip() for c in copy_ids]
+        return_date = (today or datetime.date.today()).isoformat()
+        for attempt in range(CONFLICT_RETRIES):
+            with self._co_lock:
+                self._sync_journal()
+                version = (self._journal_gen, self._journal_offset)
+                loans = {c: self._open_loans.get(c) for c in copy_ids}
+                borrowers = {c: self._loan_info.get(co, (None,))[0] for c, co in loans.items()}
+            to_book, _ = self._copy_index()
+            results, events, seen = [], [], set()
+            for copy_id in copy_ids:
+                result = {'copy_id': copy_id, 'ok': False, 'title': self._title(to_book.get(copy_id)),
+                          'checkout_id': loans.get(copy_id), 'user_id': borrowers.get(copy_id), 'error': None}
+                results.append(result)
+                if not copy_id:
+                    result['error'] = "no copy id"
+                elif copy_id in seen:
+                    # the first listing returns the loan, this one doesn't belong to it
+                    result.update(error="listed twice", checkout_id=None, user_id=None)
+                elif result['checkout_id'] is None:
+                    result['error'] = "not checked out"
+                else:
+                    result['ok'] = True
+                    events.append({'op': 'checkin', 'checkout_id': result['checkout_id'], 'user_id': result['user_id'],
+                                   'copy_id': copy_id, 'return_date': return_date})
+                seen.add(copy_id)
+            if not events or self.journal.append_if(version, events):
+                return results
+            retry_on_conflict(attempt, CONFLICT_RETRIES, "check_in_copies")
+
+    def get_open_loans(self):
+        """open loans as {checkout_id: (user_id, copy_id, due_date)}, without touching the history"""
+        with self._co_lock:
+            self._sync_journal()
+            return dict(self._loan_info)
+
     def get_recent_events(self, n=10):
         """
         merges checkouts with user/book data so admin can see who checked out or in
-        returns up to n events sorted by date desc
-        """
-        import datetime
-
-        co = pd.read_csv(self.checkouts_file)
-        users = pd.read_csv(self.users_file)
-        books = pd.read_csv(self.books_file)
-
-        # build a list of events
-        events = []
-        for _, row in co.iterrows():
-            checkout_date = row['checkout_date']
-            return_date = row['return_date']
-            user_id = row['user_id']
-            copy_id = row['copy_id']
-
-            # find user
-            urow = users[users['user_id'] == user_id]
-            user_name = "unknown"
-            if not urow.empty:
-                user_name = urow.iloc[0]['name']
-
-            # find book
-            brow = books[books['copy_ids'].str.contains(copy_id, na=False)]
-            book_title = "unknown"
-            if not brow.empty:
-                book_title = brow.iloc[0]['title']
-
-            # figure out event_date + type
-            if pd.isna(return_date):
-                # checkout
-                event_date = checkout_date
-                event_type = "checkout"
-            else:
-                event_date = return_date
-                event_type = "checkin"
-
-            events.append({
-                "user_name": user_name,
-                "book_title": book_title,
-                "copy_id": copy_id,
-                "event_type": event_type,
-                "event_date": event_date
-            })
-
-        edf = pd.DataFrame(events)
-        # parse date
-        def parse_d(s):
-            try:
-                return datetime.datetime.strptime(s, "%Y-%m-%d")
-            except:
-                return datetime.datetime.min
-        edf['parsed'] = edf['event_date'].apply(parse_d)
-        edf = edf.sort_values('parsed', ascending=False).head(n)
-        edf.drop('parsed', axis=1, inplace=True)
-        return edf
-
+        returns up to n events sorted by date desc. only the hot loans are looked at,
+        anything archived was returned weeks ago
+        """
+        co = self._checkouts_frame()
+        returned = co['return_date'].notna()
+        events = pd.DataFrame({
+            'user_id': co['user_id'],
+            'copy_id': co['copy_id'],
+            'event_type': np.where(returned, "checkin", "checkout"),
+            'event_date': co['return_date'].where(returned, co['checkout_date']),
+        })
+        # pick the top n first, so only those n rows get labelled
+        parsed = pd.to_datetime(events['event_date'], format="%Y-%m-%d", errors='coerce')
+        top = parsed.fillna(pd.Timestamp.min).nlargest(n, keep='first').index
+        return self._label_events(events.loc[top])
+
+    def get_events_since(self, cursor=None, limit=100):
+        """
+        incremental feed for the admin panel: circulation events recorded after `cursor`,
+        newest first, plus the cursor to pass next time. with no cursor (or one that's
+        older than what we still keep in memory) it falls back to the latest `limit` events.
+        """
+        with self._co_lock:
+            self._sync_journal()
+            latest = self._events_latest
+            if cursor is None or cursor < self._events_floor:
+                return self.get_recent_events(limit), latest
+            rows = []
+            for e in reversed(self._recent_events):
+                if e[0] <= cursor or len(rows) >= limit:
+                    break
+                rows.append(e)
+        events = pd.DataFrame(rows, columns=['seq', 'user_id', 'copy_id', 'event_type', 'event_date'])
+        return self._label_events(events.drop(columns='seq')), latest
+
+    def _label_events(self, events):
+        """user_id/copy_id -> user_name/book_title, looked up per event through the cached indexes"""
+        users, by_id = self._user_index()
+        to_book, _ = self._copy_index()
+        names, titles = [], []
+        for user_id, copy_id in zip(events['user_id'].tolist(), events['copy_id'].tolist()):
+            idx = by_id.get(str(user_id).strip())
+            name = users.at[idx, 'name'] if idx is not None else None
+            names.append(name if isinstance(name, str) else "unknown")
+            titles.append(self._title(to_book.get(copy_id)) or "unknown")
+        out = events.assign(user_name=names, book_title=titles)
+        return out[['user_name', 'book_title', 'copy_id', 'event_type', 'event_date']].reset_index(drop=True)
+
+    def _copies_frame(self):
+        return self._read(self.copies_file)
+
+
+_compactors = {}
+_compactors_lock = threading.Lock()
+
+
+def _start_compactor(db, interval=COMPACT_INTERVAL_SECONDS, max_bytes=COMPACT_JOURNAL_BYTES):
+    """
+    one background thread per journal file that compacts it once it grows past max_bytes,
+    and at least once a day so closed loans keep moving into the archive
+    """
+    with _compactors_lock:
+        if db.journal.path in _compactors:
+            return
+
+        def loop():
+            archived_on = None
+            while True:
+                time.sleep(interval)
+                try:
+                    today = datetime.date.today()
+                    if db.journal.size() > max_bytes or archived_on != today:
+                        db.compact_journal()
+                        archived_on = today
+                except Exception as e:
+                    print(f"DEBUG [compactor]: compaction failed => {e}")
+
+        t = threading.Thread(target=loop, daemon=True, name="checkout-journal-compactor")
+        _compactors[db.journal.path] = t
+        t.start()
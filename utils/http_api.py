@@ -0,0 +1,277 @@
+"""
+headless http/json api for kiosks and self-checkout, routes are listed in README.md.
+
+    python -m utils.http_api --port 8080
+"""
+import asyncio
+import json
+import math
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs, unquote, urlsplit
+
+from utils.database import get_database, LOAN_DAYS
+from utils.metrics import metrics
+
+# an idle keep-alive connection is closed after this long
+KEEPALIVE_SECONDS = 30
+MAX_BODY_BYTES = 1024 * 1024
+MAX_HEADER_BYTES = 16 * 1024
+# most calls are answered from memory, these threads are there for the ones that hit disk
+DB_THREADS = 4
+
+REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+           411: "Length Required", 413: "Payload Too Large", 500: "Internal Server Error"}
+
+
+class HttpError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+def _plain(value):
+    """numpy scalars -> python, NaN -> None, so json.dumps takes a record"""
+    if hasattr(value, "item"):
+        value = value.item()
+    if isinstance(value, float) and math.isnan(value):
+        return None
+    return value
+
+
+def _record(d):
+    return None if d is None else {k: _plain(v) for k, v in d.items()}
+
+
+def _strings(value):
+    """a non-empty list of non-blank strings (ids, not lists or nulls str()-ed into ids)"""
+    return isinstance(value, list) and bool(value) and all(isinstance(v, str) and v.strip() for v in value)
+
+
+class LibraryApi:
+    """the routes, as plain methods on top of one long-lived Database"""
+
+    def __init__(self, db):
+        self.db = db
+
+    def route(self, method, path, query, body):
+        """(route label for metrics, callable returning the response object)"""
+        parts = [unquote(p) for p in path.strip("/").split("/")]
+        if parts == ["health"]:
+            self._expect(method, "GET")
+            return "health", lambda: {'ok': True, 'engine': self.db.engine}
+        if parts[0] == "metrics" and len(parts) == 1:
+            self._expect(method, "GET")
+            return "metrics", metrics.render_prometheus
+        if parts[0] == "books" and len(parts) == 2:
+            self._expect(method, "GET")
+            return "book", lambda: self.book(parts[1])
+        if parts[0] == "copies" and len(parts) == 2:
+            self._expect(method, "GET")
+            return "copy", lambda: self.copy(parts[1])
+        if parts == ["search"]:
+            self._expect(method, "GET")
+            return "search", lambda: self.search(query)
+        if parts[0] == "users" and len(parts) == 2:
+            self._expect(method, "GET")
+            return "user", lambda: self.user(parts[1])
+        if parts == ["checkout"]:
+            self._expect(method, "POST")
+            return "checkout", lambda: self.checkout(body)
+        if parts == ["checkin"]:
+            self._expect(method, "POST")
+            return "checkin", lambda: self.checkin(body)
+        raise HttpError(404, f"no route for {path}")
+
+    def _expect(self, method, wanted):
+        if method != wanted:
+            raise HttpError(405, f"use {wanted}")
+
+    def book(self, barcode):
+        book = self.db.get_book(barcode)
+        if book is None:
+            raise HttpError(404, f"no book with barcode {barcode}")
+        return _record(book)
+
+    def copy(self, copy_id):
+        copy = self.db.get_copy(copy_id)
+        if copy is None:
+            raise HttpError(404, f"no copy {copy_id}")
+        return {**copy, 'book': _record(self.db.get_book(copy['barcode']))}
+
+    def search(self, query):
+        term = query.get('q', [""])[0].strip()
+        if not term:
+            raise HttpError(400, "missing q")
+        try:
+            limit = min(200, max(1, int(query.get('limit', ["20"])[0])))
+        except ValueError:
+            raise HttpError(400, "limit must be a number")
+        results = self.db.search_books(term, limit)
+        return {'results': [_record(r) for r in results.to_dict('records')]}
+
+    def user(self, user_id):
+        user = self.db.get_user(user_id)
+        if user is None:
+            raise HttpError(404, f"no user {user_id}")
+        return _record(user)
+
+    def checkout(self, body):
+        user_id, barcodes = body.get('user_id'), body.get('barcodes')
+        if not isinstance(user_id, str) or not user_id.strip() or not _strings(barcodes):
+            raise HttpError(400, "need a user_id and a non-empty list of barcode strings")
+        loan_days = body.get('loan_days', LOAN_DAYS)
+        # bool is an int subclass, true would otherwise be a one-day loan
+        if isinstance(loan_days, bool) or not isinstance(loan_days, int) or not 1 <= loan_days <= 365:
+            raise HttpError(400, "loan_days must be a whole number of days")
+        results = self.db.checkout_books(user_id, barcodes, loan_days=loan_days)
+        return {'ok': all(r['ok'] for r in results), 'results': results}
+
+    def checkin(self, body):
+        copy_ids = body.get('copy_ids')
+        if not _strings(copy_ids):
+            raise HttpError(400, "need a non-empty list of copy_id strings")
+        results = self.db.check_in_copies(copy_ids)
+        return {'ok': all(r['ok'] for r in results), 'results': results}
+
+
+async def _read_request(reader):
+    """(method, target, headers, body) or None when the client closed the connection"""
+    try:
+        head = await reader.readuntil(b"\r\n\r\n")
+    except asyncio.IncompleteReadError as e:
+        if e.partial.strip():
+            raise HttpError(400, "truncated request")
+        return None
+    except asyncio.LimitOverrunError:
+        raise HttpError(413, "headers too large")
+    lines = head.decode("latin-1").split("\r\n")
+    try:
+        method, target, version = lines[0].split(" ", 2)
+    except ValueError:
+        raise HttpError(400, "bad request line")
+    headers = {}
+    for line in lines[1:]:
+        if ":" in line:
+            name, value = line.split(":", 1)
+            headers[name.strip().lower()] = value.strip()
+    headers[':version'] = version
+    # bodies need a content-length: a chunked body we didn't read would be parsed as the
+    # next request on this connection. errors raised here close the connection
+    if 'transfer-encoding' in headers:
+        raise HttpError(411, "chunked bodies aren't supported, send a content-length")
+    if 'content-length' not in headers and method.upper() in ("POST", "PUT", "PATCH"):
+        raise HttpError(411, "content-length required")
+    try:
+        length = int(headers.get('content-length') or 0)
+    except ValueError:
+        raise HttpError(400, "bad content-length")
+    if length < 0:
+        raise HttpError(400, "bad content-length")
+    if length > MAX_BODY_BYTES:
+        raise HttpError(413, "body too large")
+    body = await reader.readexactly(length) if length else b""
+    return method.upper(), target, headers, body
+
+
+def _response(status, payload, keep_alive):
+    if isinstance(payload, str):
+        data, kind = payload.encode("utf-8"), "text/plain; version=0.0.4"
+    else:
+        data, kind = json.dumps(payload).encode("utf-8"), "application/json"
+    head = (f"HTTP/1.1 {status} {REASONS.get(status, '')}\r\n"
+            f"Content-Type: {kind}\r\n"
+            f"Content-Length: {len(data)}\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n")
+    return head.encode("latin-1") + data
+
+
+class ApiServer:
+    """asyncio http/1.1 server with keep-alive; database calls run on a small thread pool"""
+
+    def __init__(self, db, host="127.0.0.1", port=8080, threads=DB_THREADS):
+        self.api = LibraryApi(db)
+        self.host, self.port = host, port
+        self.pool = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="api-db")
+        self.server = None
+
+    async def start(self):
+        self.server = await asyncio.start_server(self._serve, self.host, self.port, limit=MAX_HEADER_BYTES)
+        self.port = self.server.sockets[0].getsockname()[1]  # port 0 picks a free one
+        print(f"DEBUG [http_api]: serving {self.api.db.engine} engine on http://{self.host}:{self.port}")
+        return self
+
+    async def serve_forever(self):
+        await self.start()
+        async with self.server:
+            await self.server.serve_forever()
+
+    async def _serve(self, reader, writer):
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                keep_alive, route = False, "invalid"
+                t0 = time.perf_counter()
+                try:
+                    request = await asyncio.wait_for(_read_request(reader), KEEPALIVE_SECONDS)
+                    if request is None:
+                        break
+                    method, target, headers, raw = request
+                    conn = headers.get('connection', "").lower()
+                    keep_alive = conn != "close" and (headers[':version'] != "HTTP/1.0" or conn == "keep-alive")
+                    url = urlsplit(target)
+                    body = {}
+                    if raw:
+                        try:
+                            body = json.loads(raw)
+                        except ValueError:
+                            raise HttpError(400, "body is not json")
+                        if not isinstance(body, dict):
+                            raise HttpError(400, "body must be a json object")
+                    route, call = self.api.route(method, url.path, parse_qs(url.query), body)
+                    status, payload = 200, await loop.run_in_executor(self.pool, call)
+                except HttpError as e:
+                    status, payload = e.status, {'error': str(e)}
+                except asyncio.TimeoutError:
+                    break
+                except (asyncio.IncompleteReadError, ConnectionError):
+                    break
+                except Exception as e:
+                    print(f"DEBUG [http_api]: {route} failed => {e!r}")
+                    status, payload = 500, {'error': "internal error"}
+                writer.write(_response(status, payload, keep_alive))
+                await writer.drain()
+                metrics.observe("library_api_request_seconds", time.perf_counter() - t0, route=route)
+                metrics.inc("library_api_requests_total", route=route, status=status)
+                if not keep_alive:
+                    break
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="http/json api for kiosks and self-checkout")
+    parser.add_argument("--host", default=os.environ.get("LIBRARY_API_HOST", "127.0.0.1"))
+    parser.add_argument("--port", type=int, default=int(os.environ.get("LIBRARY_API_PORT", 8080)))
+    parser.add_argument("--engine", default=None, help="csv, sqlite or arrow (default: LIBRARY_DB_ENGINE)")
+    parser.add_argument("--data-dir", default=None)
+    parser.add_argument("--threads", type=int, default=DB_THREADS)
+    args = parser.parse_args()
+
+    db = get_database(args.engine, args.data_dir)
+    # warm the caches and the search index before the first kiosk shows up
+    db.get_all_books()
+    db.search_books("warmup", 1)
+    try:
+        asyncio.run(ApiServer(db, args.host, args.port, args.threads).serve_forever())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
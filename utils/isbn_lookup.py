@@ -0,0 +1,165 @@
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from utils.database import DEFAULT_DATA_DIR
+from utils.metrics import metrics
+
+OPEN_LIBRARY_URL = os.environ.get("LIBRARY_OPENLIBRARY_URL", "https://openlibrary.org")
+LOOKUP_TIMEOUT = 5
+
+# how long a lookup result stays good. misses expire sooner, the record might show up later
+POSITIVE_TTL_SECONDS = 30 * 24 * 3600
+NEGATIVE_TTL_SECONDS = 24 * 3600
+
+MEMORY_ENTRIES = 4096
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS isbn_cache (
+    isbn TEXT PRIMARY KEY,
+    title TEXT,
+    author TEXT,
+    found INTEGER NOT NULL,
+    fetched_at REAL NOT NULL
+);
+"""
+
+
+class IsbnCache:
+    """
+    isbn -> (title, author, found, fetched_at), an LRU dict in front of a sqlite file.
+    get() hands back expired entries too (fresh=False), so a lookup can still fall
+    back to them when open library is unreachable.
+    """
+
+    def __init__(self, path, max_entries=MEMORY_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        with self._conn() as conn:
+            conn.executescript(SCHEMA)
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def _remember(self, isbn, entry):
+        with self._lock:
+            self._memory[isbn] = entry
+            self._memory.move_to_end(isbn)
+            while len(self._memory) > self.max_entries:
+                self._memory.popitem(last=False)
+
+    def get(self, isbn):
+        """(entry, fresh) or (None, False) if we've never looked this isbn up"""
+        with self._lock:
+            entry = self._memory.get(isbn)
+            if entry is not None:
+                self._memory.move_to_end(isbn)
+        if entry is None:
+            row = self._conn().execute(
+                "SELECT title, author, found, fetched_at FROM isbn_cache WHERE isbn = ?", (isbn,)
+            ).fetchone()
+            if row is None:
+                return None, False
+            entry = (row[0] or "", row[1] or "", bool(row[2]), row[3])
+            self._remember(isbn, entry)
+        ttl = POSITIVE_TTL_SECONDS if entry[2] else NEGATIVE_TTL_SECONDS
+        return entry, time.time() - entry[3] < ttl
+
+    def put_many(self, results):
+        """results: {isbn: (title, author) or None for not found}"""
+        now = time.time()
+        rows = []
+        for isbn, found in results.items():
+            title, author = found or ("", "")
+            entry = (title, author, found is not None, now)
+            self._remember(isbn, entry)
+            rows.append((isbn, title, author, int(entry[2]), now))
+        with self._conn() as conn:
+            conn.executemany("INSERT OR REPLACE INTO isbn_cache VALUES (?,?,?,?,?)", rows)
+
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def get_isbn_cache(path=None):
+    """one cache per file per process, so the LRU survives streamlit reruns"""
+    path = os.path.abspath(path or os.path.join(DEFAULT_DATA_DIR, "isbn_cache.db"))
+    with _caches_lock:
+        if path not in _caches:
+            _caches[path] = IsbnCache(path)
+        return _caches[path]
+
+
+def normalize_isbn(isbn):
+    isbn = str(isbn or "").strip().replace("-", "")
+    return isbn if isbn.isdigit() else ""
+
+
+def fetch_open_library(isbns, base_url=None, timeout=LOOKUP_TIMEOUT, session=None):
+    """
+    one bibkeys request for several isbns. returns {isbn: (title, author) or None};
+    network errors propagate so callers can tell "not found" from "couldn't ask"
+    """
+    import requests  # only needed on a cold miss
+
+    keys = ",".join(f"ISBN:{i}" for i in isbns)
+    url = f"{base_url or OPEN_LIBRARY_URL}/api/books?bibkeys={keys}&jscmd=data&format=json"
+    with metrics.timer("library_openlibrary_request_seconds"):
+        resp = (session or requests).get(url, timeout=timeout)
+        resp.raise_for_status()
+        data = resp.json()
+    metrics.inc("library_openlibrary_isbns_total", len(isbns))
+    results = {}
+    for isbn in isbns:
+        record = data.get(f"ISBN:{isbn}")
+        if record is None:
+            results[isbn] = None
+            continue
+        authors = record.get("authors", [])
+        author_name = authors[0]["name"] if authors else "unknown"
+        results[isbn] = (record.get("title", ""), author_name)
+    return results
+
+
+def lookup_isbn(isbn, db=None, cache=None):
+    """
+    (title, author) for an isbn, or ("", "") when nobody knows it.
+    local catalog first, then the cache, and open library only on a cold or expired miss.
+    if the network is down an expired cache entry is better than nothing.
+    """
+    isbn = normalize_isbn(isbn)
+    if not isbn:
+        return "", ""
+    if db is not None:
+        book = db.get_book(isbn)
+        if book and isinstance(book.get('title'), str) and book['title']:
+            author = book.get('author')
+            metrics.inc("library_isbn_lookups_total", source="catalog")
+            return book['title'], (author if isinstance(author, str) else "")
+
+    cache = cache or get_isbn_cache()
+    entry, fresh = cache.get(isbn)
+    if entry is not None and fresh:
+        metrics.inc("library_isbn_lookups_total", source="cache")
+        return entry[0], entry[1]
+
+    try:
+        results = fetch_open_library([isbn])
+    except Exception as e:
+        print(f"DEBUG [lookup_isbn]: error => {e}")
+        metrics.inc("library_isbn_lookups_total", source="stale" if entry is not None else "failed")
+        return (entry[0], entry[1]) if entry is not None else ("", "")
+    metrics.inc("library_isbn_lookups_total", source="network")
+    cache.put_many(results)
+    return results[isbn] or ("", "")
@@ -0,0 +1,205 @@
+import os
+import json
+import time
+import threading
+
+from utils.locking import get_lock
+from utils.metrics import metrics
+
+
+class CheckoutJournal:
+    """
+    append-only log of circulation events, one json object per line.
+
+    the first line is a header {"op": "start", "gen": g, "seq": s}; compaction folds
+    the events into checkouts.csv and starts a new generation, so readers that
+    remember (gen, offset) know whether they can just read the tail.
+    appends are flushed right away but fsync'd in batches (every fsync_batch events
+    or fsync_interval seconds, whichever comes first).
+
+    writers take a cross-process lock (<journal>.lock) only for the append itself;
+    append_if() is the compare-and-swap used by optimistic writers.
+    """
+
+    def __init__(self, path, fsync_batch=32, fsync_interval=0.5):
+        self.path = path
+        self.fsync_batch = fsync_batch
+        self.fsync_interval = fsync_interval
+        self.lock = get_lock(path + ".lock")
+        self._fh = None
+        self._unsynced = 0
+        self._tail = None  # (gen, size, seq) right after our last append
+
+        with self.lock:
+            if not os.path.exists(self.path):
+                self._write_header(gen=0, seq=0)
+
+        self._flusher = threading.Thread(target=self._flush_loop, daemon=True)
+        self._flusher.start()
+
+    def _write_header(self, gen, seq):
+        tmp = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(json.dumps({'op': 'start', 'gen': gen, 'seq': seq}) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.path)
+
+    def position(self):
+        """(gen, size) of the journal right now, the version optimistic writers compare against"""
+        with open(self.path, "rb") as f:
+            gen = json.loads(f.readline())['gen']
+            size = os.fstat(f.fileno()).st_size
+        return gen, size
+
+    def _last_seq_locked(self, gen, size):
+        # usually we wrote the last line ourselves; otherwise read it off the end of the file
+        if self._tail is not None and self._tail[:2] == (gen, size):
+            return self._tail[2]
+        with open(self.path, "rb") as f:
+            header = json.loads(f.readline())
+            f.seek(max(f.tell(), size - 4096))
+            lines = [line for line in f.read().splitlines() if line.strip()]
+        for line in reversed(lines):
+            try:
+                return json.loads(line)['seq']
+            except (ValueError, KeyError):
+                continue  # partial first line of the 4k window
+        return header['seq']
+
+    def start_seq(self):
+        """seq the current generation starts after"""
+        with open(self.path, "rb") as f:
+            return json.loads(f.readline())['seq']
+
+    def _open_locked(self):
+        # another process may have rotated the file since we opened it
+        if self._fh is not None:
+            try:
+                stale = os.fstat(self._fh.fileno()).st_ino != os.stat(self.path).st_ino
+            except FileNotFoundError:
+                stale = True
+            if stale:
+                self._sync_locked()
+                self._fh.close()
+                self._fh = None
+        if self._fh is None:
+            self._fh = open(self.path, "a", encoding="utf-8")
+        return self._fh
+
+    def append(self, event):
+        """append one event, returns it with its sequence number filled in"""
+        return self.append_many([event])[0]
+
+    def append_many(self, events):
+        """append several events with a single write + flush"""
+        with self.lock:
+            return self._append_locked(events, self.position())
+
+    def append_if(self, expected, events):
+        """
+        compare-and-swap append: only writes if the journal is still at `expected`
+        (a (gen, offset) pair from read_since). returns the events, or None on conflict.
+        """
+        with self.lock:
+            current = self.position()
+            if current != tuple(expected):
+                return None
+            return self._append_locked(events, current)
+
+    def _append_locked(self, events, position):
+        seq = self._last_seq_locked(*position)
+        out = []
+        for event in events:
+            seq += 1
+            out.append(dict(event, seq=seq))
+        fh = self._open_locked()
+        data = "".join(json.dumps(e) + "\n" for e in out)
+        fh.write(data)
+        fh.flush()
+        name = os.path.basename(self.path)
+        metrics.inc("library_file_write_bytes_total", len(data), file=name)
+        metrics.inc("library_file_write_rows_total", len(out), file=name)
+        self._tail = (position[0], position[1] + len(data.encode("utf-8")), seq)
+        self._unsynced += len(out)
+        if self._unsynced >= self.fsync_batch:
+            self._sync_locked()
+        return out
+
+    def sync(self):
+        if not self._unsynced:
+            return
+        with self.lock:
+            self._sync_locked()
+
+    def _sync_locked(self):
+        if self._fh is not None and self._unsynced:
+            os.fsync(self._fh.fileno())
+            self._unsynced = 0
+
+    def _flush_loop(self):
+        # group commit: whatever piled up since the last tick gets one fsync
+        while True:
+            time.sleep(self.fsync_interval)
+            try:
+                self.sync()
+            except (OSError, ValueError):
+                pass
+
+    def read_since(self, gen, offset):
+        """
+        events a reader hasn't seen yet. returns (gen, events, new_offset, reset);
+        reset is True when the journal was compacted since (gen, offset), in which case
+        events is the whole current generation and the caller should rebuild from its base.
+        """
+        # lock-free on purpose: rotation swaps the file in with os.replace, and the
+        # header and tail come from the same handle, so they always match
+        with open(self.path, "rb") as f:
+            header_line = f.readline()
+            cur_gen = json.loads(header_line)['gen']
+            reset = cur_gen != gen
+            start = len(header_line) if reset else max(offset, len(header_line))
+            f.seek(start)
+            data = f.read()
+        # a writer might be halfway through a line, only take complete ones
+        end = data.rfind(b"\n") + 1
+        events = [json.loads(line) for line in data[:end].splitlines() if line.strip()]
+        if events:
+            name = os.path.basename(self.path)
+            metrics.inc("library_file_read_bytes_total", end, file=name)
+            metrics.inc("library_file_read_rows_total", len(events), file=name)
+        return cur_gen, events, start + end, reset
+
+    def size(self):
+        try:
+            return os.path.getsize(self.path)
+        except FileNotFoundError:
+            return 0
+
+    def rotate(self):
+        """
+        start a new, empty generation. call with self.lock held, after the events
+        have been folded into the base table.
+        """
+        with self.lock:
+            gen, size = self.position()
+            seq = self._last_seq_locked(gen, size)
+            self._sync_locked()
+            if self._fh is not None:
+                self._fh.close()
+                self._fh = None
+            self._write_header(gen + 1, seq)
+            self._tail = None
+
+
+_journals = {}
+_journals_lock = threading.Lock()
+
+
+def get_journal(path):
+    """one journal object per file per process, so every Database shares its lock"""
+    path = os.path.abspath(path)
+    with _journals_lock:
+        if path not in _journals:
+            _journals[path] = CheckoutJournal(path)
+        return _journals[path]
@@ -0,0 +1,95 @@
+import os
+import random
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:  # windows
+    fcntl = None
+    import msvcrt
+
+
+class ConflictError(RuntimeError):
+    """an optimistic write kept losing to concurrent writers"""
+
+
+class FileLock:
+    """
+    cross-process exclusive lock on a sidecar .lock file, reentrant within a process.
+    the in-process RLock makes threads queue up locally, so the os-level lock is
+    only taken once per process at a time.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._rlock = threading.RLock()
+        self._depth = 0
+        self._fh = None
+
+    def acquire(self):
+        self._rlock.acquire()
+        if self._depth == 0:
+            try:
+                self._fh = open(self.path, "a+b")
+                if fcntl is not None:
+                    fcntl.flock(self._fh.fileno(), fcntl.LOCK_EX)
+                else:
+                    self._fh.seek(0)
+                    while True:
+                        try:
+                            msvcrt.locking(self._fh.fileno(), msvcrt.LK_LOCK, 1)
+                            break
+                        except OSError:
+                            continue
+            except Exception:
+                if self._fh is not None:
+                    self._fh.close()
+                    self._fh = None
+                self._rlock.release()
+                raise
+        self._depth += 1
+
+    def release(self):
+        self._depth -= 1
+        if self._depth == 0:
+            try:
+                if fcntl is not None:
+                    fcntl.flock(self._fh.fileno(), fcntl.LOCK_UN)
+                else:
+                    self._fh.seek(0)
+                    msvcrt.locking(self._fh.fileno(), msvcrt.LK_UNLCK, 1)
+            finally:
+                self._fh.close()
+                self._fh = None
+        self._rlock.release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+_locks = {}
+_locks_lock = threading.Lock()
+
+
+def get_lock(path):
+    """one FileLock per lock file per process"""
+    path = os.path.abspath(path)
+    with _locks_lock:
+        if path not in _locks:
+            _locks[path] = FileLock(path)
+        return _locks[path]
+
+
+def retry_on_conflict(attempt, retries, what):
+    """
+    call between optimistic attempts: sleeps with jittered backoff, or raises
+    ConflictError once we've used up our retries
+    """
+    if attempt + 1 >= retries:
+        raise ConflictError(f"{what}: gave up after {retries} conflicting attempts")
+    time.sleep(random.uniform(0, 0.002 * (2 ** min(attempt, 6))))
@@ -0,0 +1,156 @@
+import queue
+import smtplib
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from utils.metrics import metrics
+
+# errors that mean the connection itself is gone, so it's worth reconnecting and resending
+CONNECTION_ERRORS = (smtplib.SMTPServerDisconnected, smtplib.SMTPConnectError, ConnectionError, TimeoutError)
+
+
+class RateLimiter:
+    """spaces calls out to at most `per_second` across every thread sharing it (None = unlimited)"""
+
+    def __init__(self, per_second=None):
+        self.interval = 1.0 / per_second if per_second else 0.0
+        self._next = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self):
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next)
+            self._next = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+class SmtpPool:
+    """
+    reuses authenticated smtp connections instead of connecting, starttls-ing and
+    logging in once per message.
+
+    at most `size` connections are open at a time; send_many() splits a batch over
+    them and sends in parallel. a connection is recycled after max_per_connection
+    messages, and dropped + reopened (once per message) when the server hangs up.
+    with starttls=False and no password it talks to a plain local stand-in server.
+    """
+
+    def __init__(self, host, port, username="", password="", starttls=True, size=4,
+                 rate_per_second=None, max_per_connection=100, timeout=30):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.starttls = starttls
+        self.size = size
+        self.max_per_connection = max_per_connection
+        self.timeout = timeout
+        self.rate = RateLimiter(rate_per_second)
+        self._idle = queue.LifoQueue()  # [server, messages sent on it]
+        self._slots = threading.BoundedSemaphore(size)
+
+    def _connect(self):
+        with metrics.timer("library_smtp_connect_seconds"):
+            server = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+            try:
+                if self.starttls:
+                    server.starttls()
+                if self.password:
+                    server.login(self.username, self.password)
+            except Exception:
+                server.close()
+                raise
+        print(f"DEBUG [smtp_pool]: opened connection to {self.host}:{self.port}")
+        return [server, 0]
+
+    def _acquire(self):
+        self._slots.acquire()
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        try:
+            return self._connect()
+        except Exception:
+            self._slots.release()
+            raise
+
+    def _release(self, conn, broken=False):
+        try:
+            if broken or conn[1] >= self.max_per_connection:
+                self._quit(conn)
+            else:
+                self._idle.put(conn)
+        finally:
+            self._slots.release()
+
+    def _quit(self, conn):
+        try:
+            conn[0].quit()
+        except Exception:
+            conn[0].close()
+
+    def send(self, message):
+        """send one email.message.Message, returns True on success"""
+        return self.send_many([message])[0]
+
+    def send_many(self, messages):
+        """send a batch over up to `size` connections, returns one bool per message"""
+        results = [False] * len(messages)
+        if not messages:
+            return results
+        lanes = min(self.size, len(messages))
+        chunks = [list(range(i, len(messages), lanes)) for i in range(lanes)]
+        if lanes == 1:
+            self._send_chunk(messages, chunks[0], results)
+        else:
+            with ThreadPoolExecutor(lanes) as pool:
+                list(pool.map(lambda idx: self._send_chunk(messages, idx, results), chunks))
+        sent = sum(results)
+        metrics.inc("library_smtp_messages_total", sent, result="sent")
+        metrics.inc("library_smtp_messages_total", len(results) - sent, result="failed")
+        return results
+
+    def _send_chunk(self, messages, indexes, results):
+        conn = None
+        for i in indexes:
+            for attempt in range(2):
+                try:
+                    if conn is None:
+                        conn = self._acquire()
+                    self.rate.wait()
+                    with metrics.timer("library_smtp_send_seconds"):
+                        conn[0].send_message(messages[i])
+                    conn[1] += 1
+                    results[i] = True
+                    break
+                except CONNECTION_ERRORS as e:
+                    # stale or dropped connection: reopen and try this message once more
+                    print(f"DEBUG [smtp_pool]: connection lost => {e}")
+                    if conn is not None:
+                        self._release(conn, broken=True)
+                        conn = None
+                except Exception as e:
+                    # refused recipient and the like, reconnecting won't help
+                    print(f"DEBUG [smtp_pool]: send failed => {e}")
+                    if conn is None:
+                        return  # couldn't even log in, the rest of the chunk would fail the same way
+                    break
+            if conn is not None and conn[1] >= self.max_per_connection:
+                self._release(conn)
+                conn = None
+        if conn is not None:
+            self._release(conn)
+
+    def close(self):
+        """quit every idle connection"""
+        while True:
+            try:
+                self._quit(self._idle.get_nowait())
+            except queue.Empty:
+                return
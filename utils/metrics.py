@@ -0,0 +1,194 @@
+import bisect
+import functools
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+# histogram bucket upper bounds in seconds (prometheus-style, cumulative on export)
+LATENCY_BUCKETS = (0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# p50/p95 are computed over the most recent samples, so they follow the current load
+RECENT_SAMPLES = 2048
+
+
+class Histogram:
+    """bucket counts + sum for export, and a window of recent samples for percentiles"""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # last one is +Inf
+        self.count = 0
+        self.sum = 0.0
+        self.recent = deque(maxlen=RECENT_SAMPLES)
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.recent.append(value)
+
+
+def _key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+
+def _label_text(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, v in pairs)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + "}"
+
+
+class Metrics:
+    """
+    in-process counters and latency histograms, keyed by metric name + labels.
+    cheap enough to wrap every database call: one lock, one dict lookup, one append.
+    """
+
+    def __init__(self):
+        self._histograms = {}  # (name, labels) -> Histogram
+        self._counters = {}    # (name, labels) -> number
+        self._lock = threading.Lock()
+        self.started = time.time()
+
+    def observe(self, name, seconds, **labels):
+        self._observe(_key(name, labels), seconds)
+
+    def _observe(self, key, seconds):
+        with self._lock:
+            hist = self._histograms.get(key)
+            if hist is None:
+                hist = self._histograms[key] = Histogram()
+            hist.observe(seconds)
+
+    def inc(self, name, value=1, **labels):
+        self._inc(_key(name, labels), value)
+
+    def _inc(self, key, value=1):
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    @contextmanager
+    def timer(self, name, **labels):
+        """times the block into `name`; failures also bump `<name minus _seconds>_errors_total`"""
+        t0 = time.perf_counter()
+        try:
+            yield
+        except Exception:
+            self.inc(name.replace("_seconds", "") + "_errors_total", **labels)
+            raise
+        finally:
+            self.observe(name, time.perf_counter() - t0, **labels)
+
+    def histograms(self):
+        """one row per (metric, labels): calls, p50/p95 and total time in ms"""
+        with self._lock:
+            items = [(name, dict(labels), h.count, h.sum, list(h.recent)) for (name, labels), h in self._histograms.items()]
+        rows = []
+        for name, labels, count, total, recent in items:
+            recent.sort()
+            pick = lambda q: recent[min(len(recent) - 1, int(len(recent) * q))] if recent else 0.0
+            rows.append({
+                'metric': name, **labels, 'calls': count,
+                'p50_ms': 1000 * pick(0.5), 'p95_ms': 1000 * pick(0.95), 'total_ms': 1000 * total,
+            })
+        return sorted(rows, key=lambda r: r['total_ms'], reverse=True)
+
+    def counters(self):
+        with self._lock:
+            return [{'metric': name, **dict(labels), 'value': value} for (name, labels), value in sorted(self._counters.items())]
+
+    def render_prometheus(self):
+        """everything in the prometheus text exposition format"""
+        with self._lock:
+            hists = sorted((k, list(h.counts), h.count, h.sum, h.buckets) for k, h in self._histograms.items())
+            counters = sorted(self._counters.items())
+        out, typed = [], set()
+        for (name, labels), value in counters:
+            if name not in typed:
+                out.append(f"# TYPE {name} counter")
+                typed.add(name)
+            out.append(f"{name}{_label_text(labels)} {value}")
+        for (name, labels), counts, count, total, buckets in hists:
+            if name not in typed:
+                out.append(f"# TYPE {name} histogram")
+                typed.add(name)
+            running = 0
+            for bound, n in zip(list(buckets) + ["+Inf"], counts):
+                running += n
+                out.append(f"{name}_bucket{_label_text(labels, [('le', bound)])} {running}")
+            out.append(f"{name}_sum{_label_text(labels)} {total:.6f}")
+            out.append(f"{name}_count{_label_text(labels)} {count}")
+        return "\n".join(out) + "\n"
+
+    def reset(self):
+        with self._lock:
+            self._histograms.clear()
+            self._counters.clear()
+            self.started = time.time()
+
+
+# one registry per process, like the table cache
+metrics = Metrics()
+
+
+def instrumented(cls):
+    """
+    class decorator: times every public method defined on cls into
+    library_db_op_seconds{engine, op}. engine comes from the instance, so
+    methods a subclass inherits are labelled with the subclass's engine
+    """
+    for name, fn in list(vars(cls).items()):
+        if name.startswith("_") or not callable(fn):
+            continue
+        setattr(cls, name, _timed_method(fn, name))
+    return cls
+
+
+def _timed_method(fn, op):
+    # same as metrics.timer, minus the generator and label sorting: this runs on every db call
+    keys = {}
+
+    @functools.wraps(fn)
+    def wrapper(self, *args, **kwargs):
+        key = keys.get(self.engine)
+        if key is None:
+            key = keys[self.engine] = (
+                _key("library_db_op_seconds", {'engine': self.engine, 'op': op}),
+                _key("library_db_op_errors_total", {'engine': self.engine, 'op': op}),
+            )
+        t0 = time.perf_counter()
+        try:
+            return fn(self, *args, **kwargs)
+        except Exception:
+            metrics._inc(key[1])
+            raise
+        finally:
+            metrics._observe(key[0], time.perf_counter() - t0)
+    return wrapper
+
+
+def start_metrics_server(port, host="127.0.0.1"):
+    """serve GET /metrics for a prometheus scraper on a daemon thread"""
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = metrics.render_prometheus().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True, name="metrics-server").start()
+    return server
@@ -1,79 +1,97 @@
 import os
-import smtplib
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
-from datetime import datetime, timedelta
-import pandas as pd
+
+from utils.database import DEFAULT_DATA_DIR
+from utils.mailer import SmtpPool
+from utils.outbox import get_outbox
+from utils.reminders import ReminderScheduler
 
 class NotificationSystem:
-    def __init__(self):
-        # by default, read from environment or empty
-        self.smtp_server = "smtp.gmail.com"
-        self.smtp_port = 587
+    def __init__(self, data_dir=None):
+        # by default, read from environment or empty.
+        # point LIBRARY_SMTP_HOST/PORT at a local stand-in server with LIBRARY_SMTP_STARTTLS=0 for testing
+        self.smtp_server = os.environ.get('LIBRARY_SMTP_HOST', "smtp.gmail.com")
+        self.smtp_port = int(os.environ.get('LIBRARY_SMTP_PORT', 587))
+        self.smtp_starttls = os.environ.get('LIBRARY_SMTP_STARTTLS', '1') != '0'
+        self.smtp_connections = int(os.environ.get('LIBRARY_SMTP_CONNECTIONS', 4))
+        self.smtp_rate = float(os.environ.get('LIBRARY_SMTP_RATE', 0)) or None  # messages per second
         self.sender_email = os.environ.get('LIBRARY_EMAIL','')
         self.sender_password = os.environ.get('LIBRARY_EMAIL_PASSWORD','')
+        self._pool = None
+        self.outbox_file = os.path.join(data_dir or DEFAULT_DATA_DIR, "outbox.db")
 
     def update_credentials(self, new_email, new_password):
         """Change the sender email/password at runtime."""
         print(f"DEBUG [update_credentials]: updating to '{new_email}'")
         self.sender_email = new_email
         self.sender_password = new_password
+        # connections logged in with the old account are no good any more
+        if self._pool is not None:
+            self._pool.close()
+            self._pool = None
 
-    def send_email(self, recipient_email, subject, body):
-        print(f"DEBUG [send_email]: from='{self.sender_email}', to='{recipient_email}', subject='{subject}'")
+    def _smtp_pool(self):
+        if self._pool is None:
+            self._pool = SmtpPool(
+                self.smtp_server, self.smtp_port, self.sender_email, self.sender_password,
+                starttls=self.smtp_starttls, size=self.smtp_connections, rate_per_second=self.smtp_rate,
+            )
+        return self._pool
+
+    def _message(self, recipient_email, subject, body):
         message = MIMEMultipart()
         message["From"] = self.sender_email
         message["To"] = recipient_email
         message["Subject"] = subject
         message.attach(MIMEText(body, "plain"))
+        return message
+
+    def send_email(self, recipient_email, subject, body):
+        print(f"DEBUG [send_email]: from='{self.sender_email}', to='{recipient_email}', subject='{subject}'")
+        ok = self._smtp_pool().send(self._message(recipient_email, subject, body))
+        print(f"DEBUG [send_email]: returning {ok}")
+        return ok
 
+    def send_emails(self, emails):
+        """
+        send a batch of (recipient, subject, body) over the pooled connections.
+        returns one bool per email
+        """
+        print(f"DEBUG [send_emails]: sending {len(emails)} message(s)")
+        return self._smtp_pool().send_many([self._message(*e) for e in emails])
+
+    def outbox(self):
+        # the workers deliver through whichever NotificationSystem asked last, so new credentials apply
+        return get_outbox(self.outbox_file, self.send_emails)
+
+    def queue_email(self, recipient_email, subject, body):
+        """
+        put an email in the on-disk outbox and return right away; background workers
+        send it and retry with backoff if smtp is having trouble
+        """
+        print(f"DEBUG [queue_email]: to='{recipient_email}', subject='{subject}'")
         try:
-            with smtplib.SMTP(self.smtp_server, self.smtp_port) as server:
-                server.starttls()
-                print("DEBUG [send_email]: logging in to smtp server...")
-                server.login(self.sender_email, self.sender_password)
-                print("DEBUG [send_email]: login success, now sending message...")
-                server.send_message(message)
-            print("DEBUG [send_email]: email sent => returning True")
+            self.outbox().enqueue(recipient_email, subject, body)
             return True
         except Exception as e:
-            print(f"DEBUG [send_email]: failed => {e}")
+            print(f"DEBUG [queue_email]: failed => {e}")
             return False
 
-    def check_reminders(self, db):
-        print("DEBUG [check_reminders]: checking overdue or near-due books")
-        today = datetime.now().date()
-        checkouts_df = db.get_all_checkouts()
-        users_df = db.get_all_users()
-        books_df = db.get_all_books()
+    def queue_emails(self, emails):
+        """queue a batch of (recipient, subject, body) in one transaction"""
+        return self.outbox().enqueue_many(emails)
 
-        for _, row in checkouts_df.iterrows():
-            if pd.isna(row['return_date']):
-                due = pd.to_datetime(row['due_date']).date()
-                diff = (due - today).days
-                # example logic for 3 days prior, same day, 3 days after
-                if diff in (3,0,-3):
-                    user = users_df[users_df['user_id'] == row['user_id']]
-                    if not user.empty:
-                        user_email = user.iloc[0]['email']
-                        user_name = user.iloc[0]['name']
-                        book_record = books_df[books_df['copy_ids'].str.contains(row['copy_id'], na=False)]
-                        if not book_record.empty:
-                            btitle = book_record.iloc[0]['title']
-                            if diff == 3:
-                                subject = "Library Reminder: Book due in 3 days"
-                                body = f"Hello {user_name},\n\nYour book '{btitle}' is due in 3 days.\nRegards,\nLibrary"
-                            elif diff == 0:
-                                subject = "Library Reminder: Book due today"
-                                body = f"Hello {user_name},\n\nYour book '{btitle}' is due today!\nRegards,\nLibrary"
-                            else:
-                                subject = "Library Overdue Notice"
-                                body = f"Hello {user_name},\n\nYour book '{btitle}' is overdue by 3 days.\nRegards,\nLibrary"
+    def outbox_stats(self):
+        return self.outbox().stats()
 
-                            print(f"DEBUG [check_reminders]: emailing '{user_email}' about diff={diff}")
-                            ok = self.send_email(user_email, subject, body)
-                            if not ok:
-                                print(f"DEBUG [check_reminders]: email to {user_email} failed")
+    def check_reminders(self, db):
+        """
+        queue today's 3-days/due/overdue reminders now, returns how many were queued.
+        just one pass, the background thread is started by the app (see get_notify in main.py)
+        """
+        print("DEBUG [check_reminders]: checking overdue or near-due books")
+        return ReminderScheduler(db, self).run_once()
 
     def send_debug_email(self, test_email):
         print(f"DEBUG [send_debug_email]: sending to '{test_email}'")
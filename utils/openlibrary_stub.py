@@ -0,0 +1,49 @@
+import json
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """
+    answers /api/books?bibkeys=... like open library does (jscmd=data), with made-up
+    records. isbns ending in 0 are "not found", so misses get exercised too.
+    """
+
+    delay = 0.0
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path != "/api/books":
+            self.send_error(404)
+            return
+        keys = parse_qs(url.query).get("bibkeys", [""])[0].split(",")
+        data = {}
+        for key in keys:
+            isbn = key.split(":", 1)[-1]
+            if isbn and not isbn.endswith("0"):
+                data[key] = {"title": f"Book {isbn}", "authors": [{"name": f"Author {isbn[-3:]}"}]}
+        if self.delay:
+            time.sleep(self.delay)
+        body = json.dumps(data).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def serve(port=8099, delay=0.0):
+    StubHandler.delay = delay
+    server = ThreadingHTTPServer(("127.0.0.1", port), StubHandler)
+    print(f"open library stub on http://127.0.0.1:{port}")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    # python -m utils.openlibrary_stub [port] [delay seconds per request]
+    import sys
+    serve(int(sys.argv[1]) if len(sys.argv) > 1 else 8099, float(sys.argv[2]) if len(sys.argv) > 2 else 0.0)
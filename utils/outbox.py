@@ -0,0 +1,216 @@
+import os
+import random
+import sqlite3
+import threading
+import time
+from collections import deque
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS outbox (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    recipient TEXT NOT NULL,
+    subject TEXT,
+    body TEXT,
+    state TEXT NOT NULL DEFAULT 'queued',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    enqueued_at REAL NOT NULL,
+    next_attempt REAL NOT NULL,
+    claimed_at REAL,
+    last_error TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_outbox_due ON outbox(state, next_attempt);
+"""
+
+OUTBOX_WORKERS = 2
+OUTBOX_BATCH = 50
+
+# retry schedule: base * 2^attempts seconds (jittered), capped, then the message is parked as 'failed'
+RETRY_BASE_SECONDS = 5
+RETRY_MAX_SECONDS = 3600
+MAX_ATTEMPTS = 10
+
+# a claim older than this belonged to a worker that died mid-send
+STALE_CLAIM_SECONDS = 600
+# recording a batch's results is retried this many times when the file is busy
+FINISH_RETRIES = 3
+
+LATENCIES_KEPT = 1000
+
+
+class Outbox:
+    """
+    durable queue of outgoing mail in a small sqlite file.
+
+    enqueue() only inserts a row, so callers return as soon as the message is on disk.
+    worker threads claim batches, hand them to deliver(list of (recipient, subject, body))
+    which returns one bool per message, delete what went out and reschedule the rest
+    with exponential backoff. claims happen in a write transaction, so several app
+    processes can share one outbox without sending anything twice.
+    """
+
+    def __init__(self, path, deliver, workers=OUTBOX_WORKERS, batch_size=OUTBOX_BATCH):
+        self.path = path
+        self.deliver = deliver
+        self.batch_size = batch_size
+        self._local = threading.local()
+        self._wakeup = threading.Event()
+        self._stats_lock = threading.Lock()
+        self._latencies = deque(maxlen=LATENCIES_KEPT)  # enqueue -> sent, seconds
+        self.sent = 0
+        self.retried = 0
+
+        with self._conn() as conn:
+            conn.executescript(SCHEMA)
+        for i in range(workers):
+            threading.Thread(target=self._work_loop, daemon=True, name=f"outbox-worker-{i}").start()
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def enqueue(self, recipient, subject, body):
+        return self.enqueue_many([(recipient, subject, body)])[0]
+
+    def enqueue_many(self, emails):
+        """persist (recipient, subject, body) tuples, returns their outbox ids"""
+        now = time.time()
+        conn = self._conn()
+        ids = []
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            for recipient, subject, body in emails:
+                cur = conn.execute(
+                    "INSERT INTO outbox (recipient, subject, body, enqueued_at, next_attempt) VALUES (?,?,?,?,?)",
+                    (recipient, subject, body, now, now)
+                )
+                ids.append(cur.lastrowid)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        self._wakeup.set()
+        return ids
+
+    def _claim(self):
+        now = time.time()
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute(
+                "UPDATE outbox SET state = 'queued' WHERE state = 'sending' AND claimed_at < ?",
+                (now - STALE_CLAIM_SECONDS,)
+            )
+            rows = conn.execute(
+                """SELECT id, recipient, subject, body, attempts, enqueued_at FROM outbox
+                   WHERE state = 'queued' AND next_attempt <= ? ORDER BY next_attempt, id LIMIT ?""",
+                (now, self.batch_size)
+            ).fetchall()
+            conn.executemany(
+                "UPDATE outbox SET state = 'sending', claimed_at = ? WHERE id = ?",
+                [(now, r[0]) for r in rows]
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return rows
+
+    def _work_loop(self):
+        while True:
+            try:
+                rows = self._claim()
+            except sqlite3.Error as e:
+                print(f"DEBUG [outbox]: claim failed => {e}")
+                rows = []
+            if not rows:
+                # new mail wakes us up right away, retries are picked up by the timeout
+                self._wakeup.wait(1.0)
+                self._wakeup.clear()
+                continue
+            try:
+                results = self.deliver([(r[1], r[2], r[3]) for r in rows])
+                error = None
+            except Exception as e:
+                results, error = [False] * len(rows), str(e)
+            # a lost write here leaves the batch in 'sending' until it goes stale and is
+            # sent again, so try a few times before leaving it to the stale-claim sweep
+            for attempt in range(FINISH_RETRIES):
+                try:
+                    self._finish(rows, results, error)
+                    break
+                except sqlite3.Error as e:
+                    print(f"DEBUG [outbox]: recording results failed (attempt {attempt + 1}) => {e}")
+                    time.sleep(0.5 * (attempt + 1))
+
+    def _finish(self, rows, results, error):
+        now = time.time()
+        done, retry = [], []
+        latencies = []
+        for (msg_id, _, _, _, attempts, enqueued_at), ok in zip(rows, results):
+            if ok:
+                done.append((msg_id,))
+                latencies.append(now - enqueued_at)
+            else:
+                attempts += 1
+                delay = min(RETRY_BASE_SECONDS * 2 ** attempts, RETRY_MAX_SECONDS) * random.uniform(0.5, 1.0)
+                state = 'failed' if attempts >= MAX_ATTEMPTS else 'queued'
+                retry.append((state, attempts, now + delay, error or "send failed", msg_id))
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.executemany("DELETE FROM outbox WHERE id = ?", done)
+            conn.executemany(
+                "UPDATE outbox SET state = ?, attempts = ?, next_attempt = ?, last_error = ? WHERE id = ?",
+                retry
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        # counted only once the results are on disk, so a retried _finish doesn't count twice
+        with self._stats_lock:
+            self._latencies.extend(latencies)
+            self.sent += len(done)
+            self.retried += len(retry)
+        if retry:
+            print(f"DEBUG [outbox]: {len(retry)} message(s) failed, will retry with backoff")
+
+    def stats(self):
+        """queue depth and delivery latency, for the admin panel"""
+        now = time.time()
+        counts = dict(self._conn().execute("SELECT state, COUNT(*) FROM outbox GROUP BY state").fetchall())
+        (oldest,) = self._conn().execute("SELECT MIN(enqueued_at) FROM outbox WHERE state != 'failed'").fetchone()
+        with self._stats_lock:
+            lat = sorted(self._latencies)
+            sent, retried = self.sent, self.retried
+        return {
+            'queued': counts.get('queued', 0),
+            'sending': counts.get('sending', 0),
+            'failed': counts.get('failed', 0),
+            'oldest_age': (now - oldest) if oldest else 0.0,
+            'sent': sent,
+            'retried': retried,
+            'latency_p50': lat[len(lat) // 2] if lat else 0.0,
+            'latency_p95': lat[min(len(lat) - 1, int(len(lat) * 0.95))] if lat else 0.0,
+        }
+
+
+_outboxes = {}
+_outboxes_lock = threading.Lock()
+
+
+def get_outbox(path, deliver):
+    """one outbox (and worker pool) per file per process; later callers swap in their deliver()"""
+    path = os.path.abspath(path)
+    with _outboxes_lock:
+        outbox = _outboxes.get(path)
+        if outbox is None:
+            workers = int(os.environ.get("LIBRARY_OUTBOX_WORKERS", OUTBOX_WORKERS))
+            outbox = _outboxes[path] = Outbox(path, deliver, workers=workers)
+        else:
+            outbox.deliver = deliver
+        return outbox
@@ -0,0 +1,198 @@
+import os
+import heapq
+import datetime
+import threading
+import time
+
+from utils.locking import get_lock
+
+# days before the due date => (notice kind, subject, body). negative means overdue
+REMINDERS = {
+    3: ('due_soon', "Library Reminder: Book due in 3 days",
+        "Hello {name},\n\nYour book '{title}' is due in 3 days.\nRegards,\nLibrary"),
+    0: ('due_today', "Library Reminder: Book due today",
+        "Hello {name},\n\nYour book '{title}' is due today!\nRegards,\nLibrary"),
+    -3: ('overdue', "Library Overdue Notice",
+         "Hello {name},\n\nYour book '{title}' is overdue by 3 days.\nRegards,\nLibrary"),
+}
+
+# reminder dates come in this order for every loan: 3 days before, due day, 3 days after
+OFFSETS = sorted(REMINDERS, reverse=True)
+
+REMINDER_INTERVAL_SECONDS = 3600
+
+
+def _parse_date(value):
+    try:
+        return datetime.date.fromisoformat(str(value)[:10])
+    except ValueError:
+        return None
+
+
+class ReminderScheduler:
+    """
+    due-date reminders without scanning the loan history.
+
+    every open loan sits in a heap keyed on the date of its next reminder, so a run
+    only pops the loans that have actually reached a threshold. notices that went out
+    are queued in the notification outbox and appended to reminders_sent.csv, so nobody gets the same mail twice, even
+    across restarts or with several app processes running. rows for returned loans are
+    dropped from the file (and from memory) when it's read, so it stays the size of the open loans.
+    """
+
+    def __init__(self, db, notify, sent_file=None):
+        self.db = db
+        self.notify = notify
+        self.sent_file = sent_file or os.path.join(db.data_dir, "reminders_sent.csv")
+        self.lock = get_lock(self.sent_file + ".lock")
+        self._heap = []     # (reminder date, checkout_id, days before due)
+        self._loans = {}    # checkout_id -> (user_id, copy_id, due date) for loans in the heap
+        self._sent = set()  # (checkout_id, kind)
+        self._sent_offset = 0
+        self._sent_file_id = None  # (device, inode), changes when the file is pruned
+        self._mutex = threading.Lock()
+
+    def _push(self, checkout_id, due, not_before):
+        # schedule the loan's first reminder that isn't in the past yet
+        for days in OFFSETS:
+            when = due - datetime.timedelta(days=days)
+            if when >= not_before:
+                heapq.heappush(self._heap, (when, checkout_id, days))
+                return
+
+    def _refresh(self, today):
+        """pick up loans opened since last time; closed ones drop out when popped"""
+        open_loans = self.db.get_open_loans()
+        for checkout_id in self._loans.keys() - open_loans.keys():
+            del self._loans[checkout_id]
+        for checkout_id in open_loans.keys() - self._loans.keys():
+            user_id, copy_id, due = open_loans[checkout_id]
+            due = _parse_date(due)
+            if due is None:
+                continue
+            self._loans[checkout_id] = (user_id, copy_id, due)
+            self._push(checkout_id, due, today)
+
+    def _read_sent(self):
+        """
+        only read what other processes appended since our last look. call after _refresh:
+        notices for loans that aren't open anymore are forgotten, and the first full read
+        rewrites the file without them
+        """
+        try:
+            with open(self.sent_file, "r", encoding="utf-8") as f:
+                st = os.fstat(f.fileno())
+                if (st.st_dev, st.st_ino) != self._sent_file_id:
+                    # first look, or somebody pruned it since: start over from the top
+                    self._sent_file_id = (st.st_dev, st.st_ino)
+                    self._sent_offset = 0
+                    self._sent = set()
+                f.seek(self._sent_offset)
+                data = f.read()
+        except FileNotFoundError:
+            return
+        full = self._sent_offset == 0
+        end = data.rfind("\n") + 1
+        live, stale = [], 0
+        for line in data[:end].splitlines():
+            parts = line.split(",")
+            if len(parts) < 2 or parts[0] == "checkout_id":
+                continue
+            if parts[0] in self._loans:
+                self._sent.add((parts[0], parts[1]))
+                live.append(line)
+            else:
+                stale += 1
+        self._sent_offset += len(data[:end].encode("utf-8"))
+        self._sent = {key for key in self._sent if key[0] in self._loans}
+        if full and stale:
+            self._prune_sent(live)
+
+    def _prune_sent(self, live):
+        # same tmp + os.replace as the other rewrites; readers in other processes see the
+        # new inode and reread it from the top
+        tmp = f"{self.sent_file}.{os.getpid()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write("checkout_id,kind,sent_date\n")
+            f.writelines(line + "\n" for line in live)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.sent_file)
+        st = os.stat(self.sent_file)
+        self._sent_file_id = (st.st_dev, st.st_ino)
+        self._sent_offset = st.st_size
+
+    def _mark_sent(self, checkout_id, kind, today):
+        new = not os.path.exists(self.sent_file)
+        with open(self.sent_file, "a", encoding="utf-8") as f:
+            if new:
+                f.write("checkout_id,kind,sent_date\n")
+            f.write(f"{checkout_id},{kind},{today.isoformat()}\n")
+        self._sent.add((checkout_id, kind))
+
+    def run_once(self, today=None):
+        """queue whatever reminders are due today, returns how many"""
+        today = today or datetime.date.today()
+        with self._mutex, self.lock:
+            self._refresh(today)
+            self._read_sent()
+            due_now, queued = [], set()
+            while self._heap and self._heap[0][0] <= today:
+                when, checkout_id, days = heapq.heappop(self._heap)
+                loan = self._loans.get(checkout_id)
+                if loan is None:
+                    continue  # returned in the meantime
+                user_id, copy_id, due = loan
+                # a reminder date we slept through is skipped, not sent late
+                key = (checkout_id, REMINDERS[days][0])
+                if when == today and key not in self._sent and key not in queued:
+                    queued.add(key)
+                    due_now.append((checkout_id, user_id, copy_id, days))
+                self._push(checkout_id, due, today + datetime.timedelta(days=1))
+            return self._send(due_now, today)
+
+    def _send(self, due_now, today):
+        # one batch, so the outbox writes them in one transaction
+        batch, emails = [], []
+        for checkout_id, user_id, copy_id, days in due_now:
+            kind, subject, template = REMINDERS[days]
+            user = self.db.get_user(user_id)
+            book = self.db.find_book_by_copy(copy_id)
+            if not user or not book:
+                continue  # nobody to tell
+            batch.append((checkout_id, kind, days))
+            emails.append((user['email'], subject, template.format(name=user['name'], title=book['title'])))
+        if not emails:
+            return 0
+        print(f"DEBUG [reminders]: queueing {len(emails)} reminder(s)")
+        # once they're in the outbox, delivery and retries are the outbox's job
+        self.notify.queue_emails(emails)
+        for checkout_id, kind, _ in batch:
+            self._mark_sent(checkout_id, kind, today)
+        return len(batch)
+
+
+_schedulers = {}
+_schedulers_lock = threading.Lock()
+
+
+def start_reminder_scheduler(db, notify, interval=REMINDER_INTERVAL_SECONDS):
+    """one background reminder thread per data dir; later calls just swap in the newest notifier"""
+    key = os.path.abspath(db.data_dir)
+    with _schedulers_lock:
+        scheduler = _schedulers.get(key)
+        if scheduler is not None:
+            scheduler.notify = notify
+            return scheduler
+        scheduler = _schedulers[key] = ReminderScheduler(db, notify)
+
+        def loop():
+            while True:
+                try:
+                    scheduler.run_once()
+                except Exception as e:
+                    print(f"DEBUG [reminders]: run failed => {e}")
+                time.sleep(interval)
+
+        threading.Thread(target=loop, daemon=True, name="reminder-scheduler").start()
+        return scheduler
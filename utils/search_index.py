@@ -0,0 +1,151 @@
+import re
+import heapq
+import bisect
+import threading
+
+TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+# how much a hit in each field counts towards a book's score
+FIELD_WEIGHTS = {'title': 2.0, 'author': 1.0}
+
+# how much each kind of token match counts, relative to an exact match
+PREFIX_WEIGHT = 0.7
+FUZZY_WEIGHT = 0.5
+
+# keep expansion bounded so one-letter prefixes or vague typos stay cheap
+MAX_PREFIX_EXPANSIONS = 200
+MAX_FUZZY_CANDIDATES = 50
+MIN_FUZZY_SIMILARITY = 0.45
+
+
+def tokenize(text):
+    if not isinstance(text, str):
+        return []
+    return TOKEN_RE.findall(text.lower())
+
+
+def trigrams(token):
+    padded = f"  {token} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class SearchIndex:
+    """
+    in-memory inverted index over book titles and authors.
+
+    token -> {doc_id: field weight} postings, a sorted vocabulary for prefix matches,
+    and a trigram -> tokens index for typo tolerance. add() is incremental, so
+    add_book doesn't have to rebuild anything.
+    """
+
+    def __init__(self):
+        self._postings = {}
+        self._vocab = []          # sorted, for bisect prefix lookups
+        self._trigrams = {}       # trigram -> set of tokens
+        self._doc_tokens = {}     # doc_id -> set of tokens, so re-adding a doc replaces it
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_records(cls, records):
+        """records: iterable of (doc_id, title, author)"""
+        index = cls()
+        for doc_id, title, author in records:
+            index._add(doc_id, title, author, keep_sorted=False)
+        index._vocab.sort()
+        return index
+
+    def __len__(self):
+        return len(self._doc_tokens)
+
+    def add(self, doc_id, title, author):
+        """index (or re-index) one book"""
+        with self._lock:
+            self._add(doc_id, title, author, keep_sorted=True)
+
+    def _add(self, doc_id, title, author, keep_sorted):
+        if doc_id in self._doc_tokens:
+            self._remove(doc_id)
+        weights = {}
+        for field, text in (('title', title), ('author', author)):
+            for tok in tokenize(text):
+                weights[tok] = max(weights.get(tok, 0.0), FIELD_WEIGHTS[field])
+        for tok, w in weights.items():
+            postings = self._postings.get(tok)
+            if postings is None:
+                postings = self._postings[tok] = {}
+                if keep_sorted:
+                    bisect.insort(self._vocab, tok)
+                else:
+                    self._vocab.append(tok)
+                for tri in trigrams(tok):
+                    self._trigrams.setdefault(tri, set()).add(tok)
+            postings[doc_id] = w
+        self._doc_tokens[doc_id] = set(weights)
+
+    def _remove(self, doc_id):
+        # tokens stay in the vocabulary even if their postings run empty; harmless
+        for tok in self._doc_tokens.pop(doc_id, ()):
+            self._postings.get(tok, {}).pop(doc_id, None)
+
+    def _expand(self, qtok):
+        """tokens matching one query token, with match weights"""
+        matches = {}
+        if qtok in self._postings:
+            matches[qtok] = 1.0
+
+        i = bisect.bisect_left(self._vocab, qtok)
+        n = 0
+        while i < len(self._vocab) and n < MAX_PREFIX_EXPANSIONS and self._vocab[i].startswith(qtok):
+            tok = self._vocab[i]
+            if tok != qtok:
+                matches.setdefault(tok, PREFIX_WEIGHT)
+            i += 1
+            n += 1
+
+        if not matches and len(qtok) >= 3:
+            # typo tolerance: tokens sharing enough trigrams with the query token
+            qgrams = trigrams(qtok)
+            shared = {}
+            for tri in qgrams:
+                for tok in self._trigrams.get(tri, ()):
+                    shared[tok] = shared.get(tok, 0) + 1
+            best = heapq.nlargest(MAX_FUZZY_CANDIDATES, shared.items(), key=lambda kv: kv[1])
+            for tok, common in best:
+                sim = 2.0 * common / (len(qgrams) + len(trigrams(tok)))
+                if sim >= MIN_FUZZY_SIMILARITY:
+                    matches[tok] = FUZZY_WEIGHT * sim
+        return matches
+
+    def search(self, query, limit=50):
+        """
+        relevance-ranked (doc_id, score) pairs; every query token has to match
+        (exactly, as a prefix, or fuzzily)
+        """
+        qtoks = list(dict.fromkeys(tokenize(query)))
+        if not qtoks:
+            return []
+
+        with self._lock:
+            per_token = []
+            for qtok in qtoks:
+                scores = {}
+                for tok, mw in self._expand(qtok).items():
+                    for doc_id, fw in self._postings[tok].items():
+                        s = mw * fw
+                        if s > scores.get(doc_id, 0.0):
+                            scores[doc_id] = s
+                if not scores:
+                    return []
+                per_token.append(scores)
+
+        # intersect starting from the most selective token
+        per_token.sort(key=len)
+        totals = dict(per_token[0])
+        for scores in per_token[1:]:
+            totals = {d: s + scores[d] for d, s in totals.items() if d in scores}
+            if not totals:
+                return []
+
+        if limit is None:
+            return sorted(totals.items(), key=lambda kv: (-kv[1], kv[0]))
+        return heapq.nsmallest(limit, totals.items(), key=lambda kv: (-kv[1], kv[0]))
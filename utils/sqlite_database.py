@@ -0,0 +1,649 @@
+import os
+import sqlite3
+import threading
+import uuid
+import warnings
+import datetime
+
+import pandas as pd
+
+from utils.database import Database, DEFAULT_DATA_DIR, LOAN_DAYS, check_page_args, archive_cutoff, iso_date
+from utils.copy_pool import COPY_STATUSES
+from utils.search_index import SearchIndex
+from utils.metrics import instrumented
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS books (
+    barcode TEXT PRIMARY KEY,
+    title TEXT,
+    author TEXT,
+    total_copies INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS copies (
+    copy_id TEXT PRIMARY KEY,
+    barcode TEXT NOT NULL REFERENCES books(barcode),
+    position INTEGER NOT NULL,
+    status TEXT NOT NULL DEFAULT 'available'
+);
+CREATE TABLE IF NOT EXISTS users (
+    user_id TEXT PRIMARY KEY,
+    name TEXT,
+    email TEXT
+);
+CREATE TABLE IF NOT EXISTS checkouts (
+    checkout_id TEXT PRIMARY KEY,
+    user_id TEXT,
+    copy_id TEXT,
+    checkout_date TEXT,
+    due_date TEXT,
+    return_date TEXT
+);
+CREATE TABLE IF NOT EXISTS circulation_events (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    event_type TEXT NOT NULL,
+    checkout_id TEXT,
+    user_id TEXT,
+    copy_id TEXT,
+    event_date TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_copies_barcode ON copies(barcode, position);
+CREATE INDEX IF NOT EXISTS idx_copies_free ON copies(barcode, position) WHERE status = 'available';
+CREATE INDEX IF NOT EXISTS idx_users_email ON users(email COLLATE NOCASE);
+CREATE INDEX IF NOT EXISTS idx_checkouts_user ON checkouts(user_id);
+CREATE INDEX IF NOT EXISTS idx_checkouts_copy ON checkouts(copy_id);
+CREATE INDEX IF NOT EXISTS idx_checkouts_open ON checkouts(copy_id) WHERE return_date IS NULL;
+CREATE INDEX IF NOT EXISTS idx_checkouts_due ON checkouts(due_date) WHERE return_date IS NULL;
+CREATE INDEX IF NOT EXISTS idx_checkouts_date ON checkouts(checkout_date);
+CREATE INDEX IF NOT EXISTS idx_checkouts_returned ON checkouts(return_date);
+CREATE INDEX IF NOT EXISTS idx_books_title ON books(title IS NULL, title);
+CREATE INDEX IF NOT EXISTS idx_books_title_desc ON books(title IS NOT NULL, title);
+CREATE INDEX IF NOT EXISTS idx_books_author ON books(author IS NULL, author);
+CREATE INDEX IF NOT EXISTS idx_books_author_desc ON books(author IS NOT NULL, author);
+"""
+
+# books joined with their copy ids in shelf order, same layout as books.csv.
+# available_copies is derived from copy statuses, never stored
+BOOKS_QUERY = """
+SELECT b.barcode, b.title, b.author, b.total_copies,
+       (SELECT COUNT(*) FROM copies c WHERE c.barcode = b.barcode AND c.status = 'available') AS available_copies,
+       COALESCE((SELECT group_concat(copy_id, ',') FROM
+                   (SELECT copy_id FROM copies c WHERE c.barcode = b.barcode ORDER BY position)), '') AS copy_ids
+FROM books b
+"""
+
+
+# sort columns that can be blank; the rest get a plain ORDER BY so an index can serve it
+NULLABLE_SORT_KEYS = {'title', 'author', 'name', 'email', 'return_date'}
+
+
+def _order_by(table, sort, descending, tiebreak):
+    """ORDER BY for a paged query; sort was checked against SORT_KEYS, so it's safe to inline"""
+    check_page_args(table, sort)
+    if not sort:
+        return f"ORDER BY {tiebreak}"
+    # ties in insertion order, reversed when descending, and blanks last either way (same as the csv engine).
+    # the blanks term is spelled so a descending sort is a backwards scan of the *_desc indexes
+    direction = 'DESC' if descending else 'ASC'
+    nulls_last = ""
+    if sort in NULLABLE_SORT_KEYS:
+        nulls_last = f"{sort} IS NOT NULL DESC, " if descending else f"{sort} IS NULL, "
+    return f"ORDER BY {nulls_last}{sort} {direction}, {tiebreak} {direction}"
+
+
+@instrumented
+class SqliteDatabase(Database):
+    """
+    sqlite storage engine. same methods as the csv Database, but point lookups
+    and single-row updates go through indexes instead of rewriting whole files.
+    """
+
+    engine = "sqlite"
+
+    def __init__(self, data_dir=None, db_file=None):
+        self.data_dir = data_dir or DEFAULT_DATA_DIR
+        self.books_file = os.path.join(self.data_dir, "books.csv")
+        self.users_file = os.path.join(self.data_dir, "users.csv")
+        self.checkouts_file = os.path.join(self.data_dir, "checkouts.csv")
+        self.db_file = db_file or os.path.join(self.data_dir, "library.db")
+
+        os.makedirs(self.data_dir, exist_ok=True)
+        # streamlit runs each session in its own thread, so keep one connection per thread
+        self._local = threading.local()
+        self._index = None  # (max books rowid, SearchIndex)
+        self._index_lock = threading.Lock()
+
+        fresh = not os.path.exists(self.db_file)
+        with self._conn() as conn:
+            conn.executescript(SCHEMA)
+            cols = [r[1] for r in conn.execute("PRAGMA table_info(copies)")]
+            if 'status' not in cols:
+                conn.execute("ALTER TABLE copies ADD COLUMN status TEXT NOT NULL DEFAULT 'available'")
+        if fresh:
+            self.migrate_from_csv()
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_file, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def cache_stats(self):
+        # sqlite keeps its own page cache, nothing is cached at the DataFrame level
+        return {'hits': 0, 'misses': 0, 'hit_rate': 0.0, 'entries': 0}
+
+    def migrate_from_csv(self, data_dir=None):
+        """
+        one-shot import of books/users/checkouts csvs into sqlite.
+        only runs against empty tables, returns the number of rows imported per table.
+        """
+        data_dir = data_dir or self.data_dir
+        books_file = os.path.join(data_dir, "books.csv")
+        users_file = os.path.join(data_dir, "users.csv")
+        checkouts_file = os.path.join(data_dir, "checkouts.csv")
+        copies_file = os.path.join(data_dir, "copies.csv")
+        counts = {'books': 0, 'users': 0, 'checkouts': 0}
+
+        conn = self._conn()
+        with conn:
+            for table in counts:
+                (n,) = conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()
+                if n:
+                    raise RuntimeError(f"refusing to migrate: table '{table}' is not empty")
+
+            # loans and copy statuses since the last compaction only live in the csv engine's
+            # journal, fold them into the csvs first or open loans come over as returned
+            if os.path.exists(os.path.join(data_dir, "checkouts.journal")):
+                Database(data_dir).compact_journal()
+
+            if os.path.exists(books_file):
+                books = pd.read_csv(books_file, dtype={'barcode': str, 'copy_ids': str})
+                for row in books.itertuples(index=False):
+                    conn.execute(
+                        "INSERT INTO books (barcode, title, author, total_copies) VALUES (?,?,?,?)",
+                        (row.barcode, row.title, row.author, int(row.total_copies))
+                    )
+                    if os.path.exists(copies_file):
+                        continue
+                    copy_ids = row.copy_ids.split(',') if isinstance(row.copy_ids, str) and row.copy_ids.strip() else []
+                    conn.executemany(
+                        "INSERT INTO copies (copy_id, barcode, position) VALUES (?,?,?)",
+                        [(cid, row.barcode, pos) for pos, cid in enumerate(copy_ids)]
+                    )
+                counts['books'] = len(books)
+
+            if os.path.exists(copies_file):
+                copies = pd.read_csv(copies_file, dtype=str)
+                copies['position'] = copies.groupby('barcode').cumcount()
+                conn.executemany(
+                    "INSERT INTO copies (copy_id, barcode, position, status) VALUES (?,?,?,?)",
+                    copies[['copy_id', 'barcode', 'position', 'status']].itertuples(index=False, name=None)
+                )
+
+            if os.path.exists(users_file):
+                users = pd.read_csv(users_file, dtype=str)
+                conn.executemany(
+                    "INSERT INTO users VALUES (?,?,?)",
+                    users[['user_id', 'name', 'email']].itertuples(index=False, name=None)
+                )
+                counts['users'] = len(users)
+
+            # loans the csv engine already archived come along, the history lives in one table here
+            archive_dir = os.path.join(data_dir, "archive")
+            archived = sorted(os.path.join(archive_dir, f) for f in os.listdir(archive_dir)
+                              if f.startswith("checkouts-") and f.endswith(".csv")) if os.path.isdir(archive_dir) else []
+            if os.path.exists(checkouts_file):
+                checkouts = pd.concat([pd.read_csv(f, dtype=str) for f in archived + [checkouts_file]], ignore_index=True)
+                checkouts = checkouts.drop_duplicates('checkout_id', keep='last')
+                checkouts = checkouts.astype(object).where(checkouts.notna(), None)
+                conn.executemany(
+                    "INSERT INTO checkouts VALUES (?,?,?,?,?,?)",
+                    checkouts[['checkout_id', 'user_id', 'copy_id', 'checkout_date', 'due_date', 'return_date']]
+                    .itertuples(index=False, name=None)
+                )
+                counts['checkouts'] = len(checkouts)
+                conn.execute(
+                    """UPDATE copies SET status = 'on_loan' WHERE status = 'available' AND copy_id IN
+                       (SELECT copy_id FROM checkouts WHERE return_date IS NULL)"""
+                )
+        return counts
+
+    def add_book(self, barcode, title, author, copies):
+        copies = int(copies)
+        barcode = str(barcode)
+        new_ids = [str(uuid.uuid4()) for _ in range(copies)]
+
+        conn = self._conn()
+        with conn:
+            row = conn.execute("SELECT title, author FROM books WHERE barcode = ?", (barcode,)).fetchone()
+            if row:
+                conn.execute(
+                    "UPDATE books SET title = ?, author = ?, total_copies = total_copies + ? WHERE barcode = ?",
+                    (title if title else row[0], author if author else row[1], copies, barcode)
+                )
+                (start,) = conn.execute(
+                    "SELECT COALESCE(MAX(position) + 1, 0) FROM copies WHERE barcode = ?", (barcode,)
+                ).fetchone()
+            else:
+                conn.execute(
+                    "INSERT INTO books (barcode, title, author, total_copies) VALUES (?,?,?,?)",
+                    (barcode, title, author, copies)
+                )
+                start = 0
+            conn.executemany(
+                "INSERT INTO copies (copy_id, barcode, position) VALUES (?,?,?)",
+                [(cid, barcode, start + i) for i, cid in enumerate(new_ids)]
+            )
+            final = conn.execute("SELECT title, author, rowid FROM books WHERE barcode = ?", (barcode,)).fetchone()
+
+        with self._index_lock:
+            if self._index is not None:
+                version = max(self._index[0], final[2])
+                self._index[1].add(barcode, final[0], final[1])
+                self._index = (version, self._index[1])
+
+    def add_books(self, rows):
+        merged = {}
+        for barcode, title, author, copies in rows:
+            barcode = str(barcode)
+            prev = merged.get(barcode, ("", "", 0))
+            merged[barcode] = (title or prev[0], author or prev[1], prev[2] + int(copies))
+
+        conn = self._conn()
+        added = 0
+        # one transaction for the whole batch
+        with conn:
+            for barcode, (title, author, copies) in merged.items():
+                conn.execute(
+                    """INSERT INTO books (barcode, title, author, total_copies) VALUES (?,?,?,?)
+                       ON CONFLICT(barcode) DO UPDATE SET
+                           title = COALESCE(NULLIF(excluded.title, ''), title),
+                           author = COALESCE(NULLIF(excluded.author, ''), author),
+                           total_copies = total_copies + excluded.total_copies""",
+                    (barcode, title, author, copies)
+                )
+                (start,) = conn.execute(
+                    "SELECT COALESCE(MAX(position) + 1, 0) FROM copies WHERE barcode = ?", (barcode,)
+                ).fetchone()
+                conn.executemany(
+                    "INSERT INTO copies (copy_id, barcode, position) VALUES (?,?,?)",
+                    [(str(uuid.uuid4()), barcode, start + i) for i in range(copies)]
+                )
+                added += copies
+        with self._index_lock:
+            self._index = None  # rebuilt on the next search
+        return added
+
+    def checkout_copy(self, barcode):
+        # deprecated like the csv engine's, checkout_books writes status and loan together
+        warnings.warn("checkout_copy is deprecated, use checkout_books", DeprecationWarning, stacklevel=2)
+        conn = self._conn()
+        with conn:
+            # first free copy via the partial index; the status guard keeps two
+            # connections from handing out the same copy
+            row = conn.execute(
+                "SELECT copy_id FROM copies WHERE barcode = ? AND status = 'available' ORDER BY position LIMIT 1",
+                (str(barcode),)
+            ).fetchone()
+            if row is None:
+                return None
+            cur = conn.execute(
+                "UPDATE copies SET status = 'on_loan' WHERE copy_id = ? AND status = 'available'", (row[0],)
+            )
+            if cur.rowcount == 0:
+                return None
+            return row[0]
+
+    def checkout_books(self, user_id, barcodes, loan_days=LOAN_DAYS, today=None):
+        barcodes = [str(b).strip() for b in barcodes]
+        today = today or datetime.date.today()
+        date_str, due_str = today.isoformat(), (today + datetime.timedelta(days=loan_days)).isoformat()
+        conn = self._conn()
+        with conn:
+            # one write transaction: the checks below see one snapshot and nobody can
+            # take a copy between them and the inserts
+            conn.execute("BEGIN IMMEDIATE")
+            known_user = conn.execute("SELECT 1 FROM users WHERE user_id = ?", (str(user_id).strip(),)).fetchone()
+            wanted = {}
+            for barcode in barcodes:
+                wanted[barcode] = wanted.get(barcode, 0) + 1
+            titles, free = {}, {}
+            for barcode, n in wanted.items():
+                row = conn.execute("SELECT title FROM books WHERE barcode = ?", (barcode,)).fetchone()
+                if row is None:
+                    continue
+                titles[barcode] = row[0]
+                free[barcode] = [r[0] for r in conn.execute(
+                    "SELECT copy_id FROM copies WHERE barcode = ? AND status = 'available' ORDER BY position LIMIT ?",
+                    (barcode, n))]
+            results, loans = [], []
+            for barcode in barcodes:
+                result = {'barcode': barcode, 'ok': False, 'title': titles.get(barcode), 'copy_id': None,
+                          'checkout_id': None, 'due_date': None, 'error': None}
+                results.append(result)
+                if not known_user:
+                    result['error'] = "unknown user id"
+                elif not barcode:
+                    result['error'] = "no barcode"
+                elif barcode not in titles:
+                    result['error'] = "that book isn't in the db"
+                elif not free[barcode]:
+                    result['error'] = "no copies available"
+                else:
+                    copy_id = free[barcode].pop(0)
+                    result.update(ok=True, copy_id=copy_id, checkout_id=str(uuid.uuid4())[:8], due_date=due_str)
+                    loans.append((result['checkout_id'], str(user_id), copy_id, date_str, due_str))
+            conn.executemany("UPDATE copies SET status = 'on_loan' WHERE copy_id = ?", [(l[2],) for l in loans])
+            conn.executemany("INSERT INTO checkouts VALUES (?,?,?,?,?,NULL)", loans)
+            conn.executemany(
+                "INSERT INTO circulation_events (event_type, checkout_id, user_id, copy_id, event_date) "
+                "VALUES ('checkout',?,?,?,?)",
+                [l[:4] for l in loans]
+            )
+        return results
+
+    def check_in_copies(self, copy_ids, today=None):
+        copy_ids = [str(c).strip() for c in copy_ids]
+        return_date = (today or datetime.date.today()).isoformat()
+        conn = self._conn()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            results, returns, seen = [], [], set()
+            for copy_id in copy_ids:
+                row = conn.execute(
+                    """SELECT k.checkout_id, k.user_id, b.title FROM copies c
+                       JOIN books b ON b.barcode = c.barcode
+                       LEFT JOIN checkouts k ON k.copy_id = c.copy_id AND k.return_date IS NULL
+                       WHERE c.copy_id = ?""",
+                    (copy_id,)
+                ).fetchone() or (None, None, None)
+                result = {'copy_id': copy_id, 'ok': False, 'title': row[2], 'checkout_id': row[0],
+                          'user_id': row[1], 'error': None}
+                results.append(result)
+                if not copy_id:
+                    result['error'] = "no copy id"
+                elif copy_id in seen:
+                    # the first listing returns the loan, this one doesn't belong to it
+                    result.update(error="listed twice", checkout_id=None, user_id=None)
+                elif row[0] is None:
+                    result['error'] = "not checked out"
+                else:
+                    result['ok'] = True
+                    returns.append((row[0], row[1], copy_id))
+                seen.add(copy_id)
+            conn.executemany("UPDATE checkouts SET return_date = ? WHERE checkout_id = ?",
+                             [(return_date, r[0]) for r in returns])
+            conn.executemany(
+                "INSERT INTO circulation_events (event_type, checkout_id, user_id, copy_id, event_date) "
+                "VALUES ('checkin',?,?,?,?)",
+                [r + (return_date,) for r in returns]
+            )
+            conn.executemany("UPDATE copies SET status = 'available' WHERE copy_id = ?", [(r[2],) for r in returns])
+        return results
+
+    def set_copy_status(self, copy_id, status):
+        if status not in COPY_STATUSES:
+            raise ValueError(f"unknown copy status: {status}")
+        conn = self._conn()
+        with conn:
+            cur = conn.execute("UPDATE copies SET status = ? WHERE copy_id = ?", (status, copy_id))
+        return cur.rowcount > 0
+
+    def get_book(self, barcode):
+        # plain cursor, a one-row dataframe costs more than the query itself
+        cur = self._conn().execute(BOOKS_QUERY + " WHERE b.barcode = ?", (str(barcode),))
+        row = cur.fetchone()
+        if row is None:
+            return None
+        return dict(zip([d[0] for d in cur.description], row))
+
+    def get_copy_ids(self, barcode):
+        rows = self._conn().execute(
+            "SELECT copy_id FROM copies WHERE barcode = ? ORDER BY position", (str(barcode),)
+        ).fetchall()
+        return [r[0] for r in rows]
+
+    def get_copy(self, copy_id):
+        row = self._conn().execute(
+            "SELECT copy_id, barcode, status FROM copies WHERE copy_id = ?",
+            (copy_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        return dict(zip(['copy_id', 'barcode', 'status'], row))
+
+    def find_book_by_copy(self, copy_id):
+        row = self._conn().execute("SELECT barcode FROM copies WHERE copy_id = ?", (copy_id,)).fetchone()
+        if row is None:
+            return None
+        return self.get_book(row[0])
+
+    def _search_index(self):
+        # rebuilt only when another connection added books; our own add_book updates it in place
+        (version,) = self._conn().execute("SELECT COALESCE(MAX(rowid), 0) FROM books").fetchone()
+        with self._index_lock:
+            if self._index is None or self._index[0] != version:
+                rows = self._conn().execute("SELECT barcode, title, author FROM books").fetchall()
+                self._index = (version, SearchIndex.from_records(rows))
+            return self._index[1]
+
+    def _books_by_barcode(self, barcodes):
+        if not barcodes:
+            return pd.read_sql_query(BOOKS_QUERY + " WHERE 0", self._conn())
+        marks = ",".join("?" * len(barcodes))
+        df = pd.read_sql_query(BOOKS_QUERY + f" WHERE b.barcode IN ({marks})", self._conn(), params=list(barcodes))
+        order = {b: i for i, b in enumerate(barcodes)}
+        return df.sort_values('barcode', key=lambda col: col.map(order)).reset_index(drop=True)
+
+    def add_user(self, name, email):
+        user_id = str(uuid.uuid4())[:8]
+        conn = self._conn()
+        with conn:
+            conn.execute("INSERT INTO users VALUES (?,?,?)", (user_id, name, email))
+        return user_id
+
+    def get_user(self, user_id):
+        row = self._conn().execute(
+            "SELECT user_id, name, email FROM users WHERE user_id = ?", (str(user_id).strip(),)
+        ).fetchone()
+        if row is None:
+            return None
+        return dict(zip(['user_id', 'name', 'email'], row))
+
+    def get_user_by_email(self, email):
+        row = self._conn().execute(
+            "SELECT user_id, name, email FROM users WHERE email = ? COLLATE NOCASE", (email.strip(),)
+        ).fetchone()
+        if row is None:
+            return None
+        return dict(zip(['user_id', 'name', 'email'], row))
+
+    def get_all_books(self):
+        return pd.read_sql_query(BOOKS_QUERY, self._conn())
+
+    def get_all_users(self):
+        return pd.read_sql_query("SELECT user_id, name, email FROM users", self._conn())
+
+    def get_all_checkouts(self):
+        return pd.read_sql_query(
+            "SELECT checkout_id, user_id, copy_id, checkout_date, due_date, return_date FROM checkouts",
+            self._conn()
+        )
+
+    def get_checkouts(self, start=None, end=None):
+        # no archive files here: one table, the date indexes do the pruning
+        where, params = self._range_where(start, end)
+        return pd.read_sql_query(
+            f"SELECT checkout_id, user_id, copy_id, checkout_date, due_date, return_date FROM checkouts {where}",
+            self._conn(), params=params
+        )
+
+    def _range_where(self, start, end):
+        start, end = iso_date(start), iso_date(end)
+        where, params = [], []
+        if end:
+            where.append("checkout_date <= ?")
+            params.append(end)
+        if start:
+            where.append("(return_date IS NULL OR return_date >= ?)")
+            params.append(start)
+        return ("WHERE " + " AND ".join(where)) if where else "", params
+
+    def get_books_page(self, offset=0, limit=50, sort=None, descending=False):
+        (total,) = self._conn().execute("SELECT COUNT(*) FROM books").fetchone()
+        params = (int(limit), max(0, int(offset)))
+        if sort == 'available_copies':
+            # derived per row, so every book's count has to be computed before sorting
+            order = _order_by('books', sort, descending, "b.rowid")
+            return pd.read_sql_query(BOOKS_QUERY + f" {order} LIMIT ? OFFSET ?", self._conn(), params=params), total
+        # pick the page from the bare table first, the copy subqueries then only run for its rows
+        page = f"(SELECT rowid AS pos, * FROM books {_order_by('books', sort, descending, 'rowid')} LIMIT ? OFFSET ?) b"
+        query = BOOKS_QUERY.replace("FROM books b", f"FROM {page}") + " " + _order_by('books', sort, descending, "b.pos")
+        return pd.read_sql_query(query, self._conn(), params=params), total
+
+    def get_users_page(self, offset=0, limit=50, sort=None, descending=False):
+        (total,) = self._conn().execute("SELECT COUNT(*) FROM users").fetchone()
+        order = _order_by('users', sort, descending, "rowid")
+        df = pd.read_sql_query(
+            f"SELECT user_id, name, email FROM users {order} LIMIT ? OFFSET ?",
+            self._conn(), params=(int(limit), max(0, int(offset)))
+        )
+        return df, total
+
+    def get_checkouts_page(self, offset=0, limit=50, sort=None, descending=False, status=None, user_id=None, today=None,
+                           start=None, end=None):
+        check_page_args('checkouts', sort, status)
+        if start is None and end is None:
+            # the same hot set the csv engine pages: open loans and recent returns
+            where, params = ["(return_date IS NULL OR return_date >= ?)"], [archive_cutoff()]
+        else:
+            cond, params = self._range_where(start, end)
+            where = [cond[len("WHERE "):]] if cond else []
+        if status == 'returned':
+            where.append("return_date IS NOT NULL")
+        elif status:
+            where.append("return_date IS NULL")
+            if status == 'overdue':
+                where.append("due_date < ?")
+                params.append((today or datetime.date.today()).isoformat())
+        if user_id:
+            where.append("user_id = ?")
+            params.append(str(user_id).strip())
+        cond = f"WHERE {' AND '.join(where)}" if where else ""
+        conn = self._conn()
+        (total,) = conn.execute(f"SELECT COUNT(*) FROM checkouts {cond}", params).fetchone()
+        df = pd.read_sql_query(
+            f"SELECT checkout_id, user_id, copy_id, checkout_date, due_date, return_date FROM checkouts {cond} "
+            f"{_order_by('checkouts', sort, descending, 'rowid')} LIMIT ? OFFSET ?",
+            conn, params=params + [int(limit), max(0, int(offset))]
+        )
+        return df, total
+
+    def _books_frame(self):
+        return self.get_all_books()
+
+    def _users_frame(self):
+        return self.get_all_users()
+
+    def _checkouts_frame(self):
+        # open loans and recent returns only, like the csv engine's hot file
+        return pd.read_sql_query(
+            "SELECT checkout_id, user_id, copy_id, checkout_date, due_date, return_date FROM checkouts "
+            "WHERE return_date IS NULL OR return_date >= ?",
+            self._conn(), params=(archive_cutoff(),)
+        )
+
+    def _copies_frame(self):
+        return pd.read_sql_query("SELECT copy_id, barcode, status FROM copies", self._conn())
+
+    def get_open_loans(self):
+        rows = self._conn().execute(
+            "SELECT checkout_id, user_id, copy_id, due_date FROM checkouts WHERE return_date IS NULL"
+        ).fetchall()
+        return {r[0]: (r[1], r[2], r[3]) for r in rows}
+
+    def get_recent_events(self, n=10):
+        # top n straight from the hot loans, only those get labelled
+        events = pd.read_sql_query(
+            """SELECT user_id, copy_id,
+                      CASE WHEN return_date IS NULL THEN 'checkout' ELSE 'checkin' END AS event_type,
+                      COALESCE(return_date, checkout_date) AS event_date
+               FROM checkouts WHERE return_date IS NULL OR return_date >= ?
+               ORDER BY event_date DESC, rowid LIMIT ?""",
+            self._conn(), params=(archive_cutoff(), int(n))
+        )
+        return self._label_events(events)
+
+    def get_events_since(self, cursor=None, limit=100):
+        conn = self._conn()
+        (latest,) = conn.execute("SELECT COALESCE(MAX(seq), 0) FROM circulation_events").fetchone()
+        if cursor is None:
+            return self.get_recent_events(limit), latest
+        events = pd.read_sql_query(
+            """SELECT user_id, copy_id, event_type, event_date FROM circulation_events
+               WHERE seq > ? ORDER BY seq DESC LIMIT ?""",
+            conn, params=(cursor, limit)
+        )
+        return self._label_events(events), latest
+
+    def _label_events(self, events):
+        # names and titles for the users and copies on show, not a join over the whole catalog
+        conn = self._conn()
+        user_ids = list(set(events['user_id'].dropna().astype(str)))
+        copy_ids = list(set(events['copy_id'].dropna().astype(str)))
+        names = dict(conn.execute(
+            f"SELECT user_id, name FROM users WHERE user_id IN ({','.join('?' * len(user_ids))})", user_ids))
+        titles = dict(conn.execute(
+            f"""SELECT c.copy_id, b.title FROM copies c JOIN books b ON b.barcode = c.barcode
+                WHERE c.copy_id IN ({','.join('?' * len(copy_ids))})""", copy_ids))
+        out = events.assign(user_name=events['user_id'].map(names), book_title=events['copy_id'].map(titles))
+        out[['user_name', 'book_title']] = out[['user_name', 'book_title']].fillna("unknown")
+        return out[['user_name', 'book_title', 'copy_id', 'event_type', 'event_date']]
+
+    def record_checkout(self, checkout_id, user_id, copy_id, date_str, due_str):
+        conn = self._conn()
+        with conn:
+            conn.execute(
+                "INSERT INTO checkouts VALUES (?,?,?,?,?,NULL)",
+                (checkout_id, str(user_id), copy_id, date_str, due_str)
+            )
+            conn.execute(
+                "INSERT INTO circulation_events (event_type, checkout_id, user_id, copy_id, event_date) "
+                "VALUES ('checkout',?,?,?,?)",
+                (checkout_id, str(user_id), copy_id, date_str)
+            )
+
+    def check_in_copy(self, copy_id):
+        today = datetime.datetime.now().strftime("%Y-%m-%d")
+        conn = self._conn()
+        with conn:
+            row = conn.execute(
+                "SELECT checkout_id, user_id FROM checkouts WHERE copy_id = ? AND return_date IS NULL LIMIT 1",
+                (copy_id,)
+            ).fetchone()
+            if row is None:
+                return False
+            # guarded update: if another desk closed the loan first, nothing changes
+            cur = conn.execute(
+                "UPDATE checkouts SET return_date = ? WHERE checkout_id = ? AND return_date IS NULL",
+                (today, row[0])
+            )
+            if cur.rowcount == 0:
+                return False
+            conn.execute(
+                "INSERT INTO circulation_events (event_type, checkout_id, user_id, copy_id, event_date) "
+                "VALUES ('checkin',?,?,?,?)",
+                (row[0], row[1], copy_id, today)
+            )
+            conn.execute("UPDATE copies SET status = 'available' WHERE copy_id = ?", (copy_id,))
+        return True
+
+
+if __name__ == "__main__":
+    # one-shot migration: python -m utils.sqlite_database [data_dir]
+    import sys
+    target = sys.argv[1] if len(sys.argv) > 1 else None
+    db = SqliteDatabase(data_dir=target)
+    print(f"sqlite database ready at {db.db_file}")